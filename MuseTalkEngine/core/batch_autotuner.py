@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+batch大小自动调优 - 在每个设备上实测各候选batch的延迟、吞吐和峰值显存，
+结果按 设备型号 + 模型hash 持久化到磁盘，下次启动直接加载；
+调度器按延迟目标选择吞吐最高的batch大小（替代按剩余显存手写的档位表）
+
+配置（环境变量）:
+    MUSE_AUTOTUNE_DIR=...              profile保存目录
+    MUSE_AUTOTUNE_ON_STARTUP=0         启动时不测量（没有profile时使用默认batch）
+    MUSE_BATCH_LATENCY_TARGET_MS=250   单个batch的延迟目标
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import threading
+from typing import Dict, List, Optional
+
+import torch
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.gpu_inference_pool import run_inference, model_dtype
+from core.shape_buckets import get_bucket_sizes, plan_buckets
+from core.standin_models import WHISPER_CHUNK_SHAPE, LATENT_INPUT_SHAPE
+
+DEFAULT_AUTOTUNE_DIR = os.environ.get('MUSE_AUTOTUNE_DIR', '/opt/musetalk/cache/autotune')
+DEFAULT_BATCH_SIZE = 4  # 没有profile时的默认值
+DEFAULT_LATENCY_TARGET_MS = float(os.environ.get('MUSE_BATCH_LATENCY_TARGET_MS', '250'))
+
+STATUS_OK = 'ok'
+STATUS_OOM = 'oom'
+
+
+def autotune_on_startup() -> bool:
+    """启动时是否测量（已有profile时总是直接加载）"""
+    return os.environ.get('MUSE_AUTOTUNE_ON_STARTUP', '1') == '1'
+
+
+def device_name(device) -> str:
+    """设备型号（profile键的一部分，同型号设备共享profile）"""
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.get_device_name(device)
+    return f"cpu-{platform.machine()}-{os.cpu_count()}threads"
+
+
+def _peak_memory_mb(device) -> float:
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 / 1024
+    # CPU: 进程峰值RSS（Linux单位KB）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+
+
+def measure_batch_size(device, gpu_models: Dict, batch_size: int, runs: int = 3) -> Dict:
+    """测量单个batch大小（在设备专用推理线程中调用）"""
+    device = torch.device(device)
+    dtype = model_dtype(gpu_models)
+    timesteps = torch.tensor([0], device=device, dtype=torch.long)
+    try:
+        whisper_batch = torch.randn(batch_size, *WHISPER_CHUNK_SHAPE, device=device, dtype=dtype)
+        latent_batch = torch.randn(batch_size, *LATENT_INPUT_SHAPE, device=device, dtype=dtype)
+
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+        memory_before = _peak_memory_mb(device) if device.type != 'cuda' else torch.cuda.memory_allocated(device) / 1024 / 1024
+
+        # 第一次调用不计时（可能触发编译/cuDNN调优）
+        run_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+        start = time.perf_counter()
+        for _ in range(runs):
+            run_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        latency_ms = (time.perf_counter() - start) * 1000 / runs
+
+        return {
+            'status': STATUS_OK,
+            'latency_ms': round(latency_ms, 2),
+            'fps': round(batch_size * 1000 / latency_ms, 1),
+            'peak_memory_mb': round(max(0.0, _peak_memory_mb(device) - memory_before), 1),
+        }
+    except torch.cuda.OutOfMemoryError:
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+        return {'status': STATUS_OOM}
+
+
+def profile_device(device, gpu_models: Dict, candidates: Optional[List[int]] = None, runs: int = 3) -> Dict:
+    """测量一个设备上所有候选batch大小（从小到大，OOM后停止）"""
+    results = {}
+    for batch_size in sorted(candidates or get_bucket_sizes()):
+        result = measure_batch_size(device, gpu_models, batch_size, runs)
+        results[str(batch_size)] = result
+        if result['status'] == STATUS_OK:
+            print(f"  📏 {device} batch={batch_size}: {result['latency_ms']:.1f}ms, "
+                  f"{result['fps']:.1f}帧/秒, 峰值内存+{result['peak_memory_mb']:.0f}MB")
+        else:
+            print(f"  📏 {device} batch={batch_size}: OOM，停止测量更大的batch")
+            break
+    return results
+
+
+class BatchAutotuner:
+    """batch大小自动调优器 - profile按 设备型号 + 模型hash 持久化"""
+
+    def __init__(self, model_hash: Optional[str] = None, profile_dir: Optional[str] = None,
+                 candidates: Optional[List[int]] = None):
+        self.model_hash = model_hash or 'unknown'
+        self.profile_dir = profile_dir or DEFAULT_AUTOTUNE_DIR
+        self.candidates = candidates or list(get_bucket_sizes())
+        self.profiles = {}  # device -> profile
+        self._lock = threading.Lock()
+
+    def _profile_file(self, name: str) -> str:
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        return os.path.join(self.profile_dir, f"{safe_name}_{self.model_hash}.json")
+
+    def load_profile(self, device) -> Optional[Dict]:
+        """加载设备的已保存profile（候选batch不一致时视为失效）"""
+        profile_file = self._profile_file(device_name(device))
+        try:
+            with open(profile_file, 'r') as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if profile.get('torch') != torch.__version__ or sorted(profile.get('candidates', [])) != sorted(self.candidates):
+            return None
+        profile['source'] = 'disk'
+        return profile
+
+    def save_profile(self, profile: Dict):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile_file = self._profile_file(profile['device_name'])
+            tmp_file = f"{profile_file}.tmp{os.getpid()}"
+            with open(tmp_file, 'w') as f:
+                json.dump(profile, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, profile_file)
+        except OSError as e:
+            print(f"⚠️ batch profile写入失败（不影响运行）: {e}")
+
+    def tune_device(self, device, gpu_models: Dict, force: bool = False, runs: int = 3) -> Optional[Dict]:
+        """加载或测量一个设备的profile（测量时必须在设备专用推理线程中调用）"""
+        profile = None if force else self.load_profile(device)
+        if profile is None:
+            if not force and not autotune_on_startup():
+                return None
+            start = time.time()
+            print(f"📏 测量 {device} ({device_name(device)}) 的batch性能: {self.candidates}")
+            profile = {
+                'device_name': device_name(device),
+                'model_hash': self.model_hash,
+                'torch': torch.__version__,
+                'candidates': self.candidates,
+                'created': time.time(),
+                'results': profile_device(device, gpu_models, self.candidates, runs),
+            }
+            profile['tune_time'] = round(time.time() - start, 2)
+            self.save_profile(profile)
+            profile['source'] = 'measured'
+        with self._lock:
+            self.profiles[str(device)] = profile
+        return profile
+
+    def tune_pool(self, inference_pool, force: bool = False) -> Dict:
+        """在推理池每个设备的专用线程中加载/测量profile"""
+        return inference_pool.run_on_all(lambda device, gpu_models: self.tune_device(device, gpu_models, force))
+
+    def choose_batch_size(self, num_frames: Optional[int] = None, latency_target_ms: Optional[float] = None) -> int:
+        """按延迟目标选择吞吐最高的batch大小（多设备取最慢设备的延迟）
+
+        Args:
+            num_frames: 本次请求的帧数，不会选择比覆盖它所需档位更大的batch
+            latency_target_ms: 单个batch的延迟目标，默认 MUSE_BATCH_LATENCY_TARGET_MS
+        """
+        target = latency_target_ms if latency_target_ms is not None else DEFAULT_LATENCY_TARGET_MS
+        with self._lock:
+            profiles = [p for p in self.profiles.values() if p]
+        if not profiles:
+            return DEFAULT_BATCH_SIZE
+
+        # 每个batch在所有设备上的最大延迟 / 最小吞吐
+        candidates = {}
+        for batch_size in self.candidates:
+            results = [p['results'].get(str(batch_size)) for p in profiles]
+            if any(r is None or r.get('status') != STATUS_OK for r in results):
+                continue
+            candidates[batch_size] = (max(r['latency_ms'] for r in results), min(r['fps'] for r in results))
+        if not candidates:
+            return min(self.candidates)
+
+        if num_frames:
+            largest_needed = max(plan_buckets(num_frames, tuple(self.candidates)))
+            candidates = {b: v for b, v in candidates.items() if b <= largest_needed} or {min(candidates): candidates[min(candidates)]}
+
+        within_target = {b: v for b, v in candidates.items() if v[0] <= target}
+        if not within_target:
+            return min(candidates)
+        return max(within_target, key=lambda b: (within_target[b][1], -b))
+
+    def max_ok_batch_size(self, device) -> Optional[int]:
+        """设备上实测未OOM的最大batch（没有profile时返回None）"""
+        with self._lock:
+            profile = self.profiles.get(str(device))
+        if not profile:
+            return None
+        ok = [int(b) for b, r in profile['results'].items() if r.get('status') == STATUS_OK]
+        return max(ok) if ok else None
+
+    def get_status(self) -> Dict:
+        """profile概要（/api/status）"""
+        with self._lock:
+            return {
+                device: {
+                    'device_name': profile['device_name'],
+                    'source': profile.get('source'),
+                    'results': profile['results'],
+                } if profile else None
+                for device, profile in self.profiles.items()
+            }
+
+
+# ===== 自检（CPU + 替身模型） =====
+
+def benchmark_batch_autotuner():
+    """CPU上测量替身模型的batch profile，验证持久化和按延迟目标选择"""
+    import tempfile
+    from core.standin_models import build_standin_models
+    from core.gpu_inference_pool import GPUInferencePool
+
+    print("🧪 测试batch大小自动调优（CPU替身模型）...")
+    pool = GPUInferencePool({'cpu': build_standin_models('cpu')})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tuner = BatchAutotuner(model_hash='standin', profile_dir=tmp_dir)
+        start = time.time()
+        tuner.tune_pool(pool, force=True)
+        print(f"测量耗时: {time.time() - start:.2f}秒")
+
+        # 第二个实例应直接从磁盘加载
+        reloaded = BatchAutotuner(model_hash='standin', profile_dir=tmp_dir)
+        start = time.time()
+        reloaded.tune_pool(pool)
+        assert reloaded.profiles['cpu']['source'] == 'disk'
+        print(f"加载profile耗时: {(time.time() - start) * 1000:.1f}ms")
+
+        results = reloaded.profiles['cpu']['results']
+        for target in (10, 50, 100, 250, 1000):
+            print(f"  延迟目标 {target}ms -> batch={reloaded.choose_batch_size(latency_target_ms=target)}")
+        print(f"  5帧请求 -> batch={reloaded.choose_batch_size(num_frames=5, latency_target_ms=1000)}")
+        fastest = min(results.values(), key=lambda r: r['latency_ms'])['latency_ms']
+        assert reloaded.choose_batch_size(latency_target_ms=fastest / 2) == min(reloaded.candidates)
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark_batch_autotuner()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+编译管理器 - 在每个设备的专用推理线程中按固定batch档位编译 UNet / VAE解码器 / PE
+- 每个(模型, batch)单独编译和验证，失败的shape回退到eager，不影响其他shape
+- 编译产物持久化到 TORCHINDUCTOR_CACHE_DIR/<模型hash>_torch<版本>/，
+  清单manifest.json记录每个模型/shape的编译结果，下次启动直接跳过已知失败的shape
+
+配置（环境变量）:
+    DISABLE_TORCH_COMPILE=1          禁用编译（全部eager）
+    MUSE_COMPILE_BATCH_SIZES=1,2,4   编译的batch档位（默认MUSE_BATCH_BUCKETS）
+    MUSE_COMPILE_MODE=...            torch.compile的mode（默认max-autotune-no-cudagraphs）
+    ENABLE_CUDA_GRAPHS=1             使用reduce-overhead（含CUDA图）
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import platform
+from typing import Dict, List, Optional
+
+import torch
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.standin_models import WHISPER_CHUNK_SHAPE, LATENT_INPUT_SHAPE, LATENT_OUTPUT_SHAPE
+from core.shape_buckets import get_bucket_sizes
+
+DEFAULT_COMPILE_CACHE_DIR = os.environ.get('TORCHINDUCTOR_CACHE_DIR', '/opt/musetalk/cache/torch_compile')
+
+# 编译状态
+STATUS_COMPILED = 'compiled'
+STATUS_EAGER = 'eager'          # 编译失败，回退eager
+STATUS_SKIPPED = 'skipped'      # 清单记录过失败，直接使用eager
+
+
+def compile_disabled() -> bool:
+    """是否禁用torch.compile"""
+    if os.environ.get('DISABLE_TORCH_COMPILE', '0') == '1':
+        return True
+    return not hasattr(torch, 'compile') or platform.system() == 'Windows'
+
+
+def get_compile_batch_sizes() -> List[int]:
+    """编译的batch档位（默认与推理分桶档位一致）"""
+    value = os.environ.get('MUSE_COMPILE_BATCH_SIZES', '')
+    if not value.strip():
+        return list(get_bucket_sizes())
+    return sorted({int(v) for v in value.split(',') if v.strip()})
+
+
+def get_compile_options() -> Dict:
+    """torch.compile参数（动态shape关闭，每个batch档位一张固定图）"""
+    if os.environ.get('ENABLE_CUDA_GRAPHS', '0') == '1':
+        mode = 'reduce-overhead'
+    else:
+        mode = os.environ.get('MUSE_COMPILE_MODE', 'max-autotune-no-cudagraphs')
+    return {'backend': 'inductor', 'mode': mode, 'fullgraph': False, 'dynamic': False}
+
+
+class ShapeDispatchModule(torch.nn.Module):
+    """按batch大小分派: 编译成功的batch走编译图，其余走eager（不在请求路径上触发重新编译）"""
+
+    def __init__(self, eager: torch.nn.Module, compiled, compiled_batch_sizes=()):
+        super().__init__()
+        self.eager = eager
+        self.compiled = compiled
+        self.compiled_batch_sizes = set(compiled_batch_sizes)
+
+    def forward(self, x, *args, **kwargs):
+        if x.shape[0] in self.compiled_batch_sizes:
+            return self.compiled(x, *args, **kwargs)
+        return self.eager(x, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # 其他属性（config/dtype等）透传给原模型
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(super().__getattr__('eager'), name)
+
+
+def _compile_targets(gpu_models: Dict) -> Dict:
+    """可编译的模块: {名称: (取模块, 设置模块)}"""
+    targets = {}
+    unet = gpu_models.get('unet')
+    if unet is not None and isinstance(getattr(unet, 'model', None), torch.nn.Module):
+        targets['unet'] = (lambda: unet.model, lambda m: setattr(unet, 'model', m))
+    vae = gpu_models.get('vae')
+    if vae is not None and isinstance(getattr(getattr(vae, 'vae', None), 'decoder', None), torch.nn.Module):
+        targets['vae_decoder'] = (lambda: vae.vae.decoder, lambda m: setattr(vae.vae, 'decoder', m))
+    pe = gpu_models.get('pe')
+    if isinstance(pe, torch.nn.Module):
+        targets['pe'] = (lambda: gpu_models['pe'], lambda m: gpu_models.__setitem__('pe', m))
+    return targets
+
+
+def _example_call(name: str, module, batch_size: int, device, dtype):
+    """用合成输入调用一次模块（触发该batch档位的编译）"""
+    with torch.no_grad():
+        if name == 'unet':
+            latent = torch.randn(batch_size, *LATENT_INPUT_SHAPE, device=device, dtype=dtype)
+            audio = torch.randn(batch_size, *WHISPER_CHUNK_SHAPE, device=device, dtype=dtype)
+            timesteps = torch.tensor([0], device=device, dtype=torch.long)
+            return module(latent, timesteps, encoder_hidden_states=audio)
+        if name == 'vae_decoder':
+            return module(torch.randn(batch_size, *LATENT_OUTPUT_SHAPE, device=device, dtype=dtype))
+        return module(torch.randn(batch_size, *WHISPER_CHUNK_SHAPE, device=device, dtype=dtype))
+
+
+class CompileManager:
+    """编译管理器 - 编译状态按 设备/模型/batch 记录，供 /api/status 查询"""
+
+    def __init__(self, model_hash: Optional[str] = None, cache_dir: Optional[str] = None,
+                 batch_sizes: Optional[List[int]] = None):
+        self.model_hash = model_hash or 'unknown'
+        self.base_cache_dir = cache_dir or DEFAULT_COMPILE_CACHE_DIR
+        self.batch_sizes = batch_sizes or get_compile_batch_sizes()
+        self.options = get_compile_options()
+        self.enabled = not compile_disabled()
+        self.cache_key = f"{self.model_hash}_torch{torch.__version__}".replace('+', '_')
+        self.cache_dir = os.path.join(self.base_cache_dir, self.cache_key)
+        self.manifest_file = os.path.join(self.cache_dir, 'manifest.json')
+        self.artifacts_file = os.path.join(self.cache_dir, 'compile_artifacts.bin')
+        self.manifest = self._load_manifest()
+        self.status = {}  # device -> model -> batch -> {...}
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = f"{self.manifest_file}.tmp{os.getpid()}"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_file, self.manifest_file)
+        except OSError as e:
+            print(f"⚠️ 编译清单写入失败（不影响运行）: {e}")
+
+    def prepare_cache(self):
+        """把inductor缓存目录指向 模型hash+torch版本 子目录，并加载已保存的编译产物"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        os.environ['TORCHINDUCTOR_CACHE_DIR'] = self.cache_dir
+        if os.path.exists(self.artifacts_file) and hasattr(torch.compiler, 'load_cache_artifacts'):
+            try:
+                with open(self.artifacts_file, 'rb') as f:
+                    torch.compiler.load_cache_artifacts(f.read())
+                print(f"✅ 加载编译产物缓存: {self.artifacts_file}")
+            except Exception as e:
+                print(f"⚠️ 编译产物缓存加载失败，重新编译: {e}")
+
+    def save_cache(self):
+        """保存编译产物和清单"""
+        self._save_manifest()
+        if not hasattr(torch.compiler, 'save_cache_artifacts'):
+            return
+        try:
+            artifacts = torch.compiler.save_cache_artifacts()
+            if artifacts is not None:
+                tmp_file = f"{self.artifacts_file}.tmp{os.getpid()}"
+                with open(tmp_file, 'wb') as f:
+                    f.write(artifacts[0])
+                os.replace(tmp_file, self.artifacts_file)
+                print(f"💾 编译产物缓存已写入: {self.artifacts_file}")
+        except Exception as e:
+            print(f"⚠️ 编译产物缓存写入失败（不影响运行）: {e}")
+
+    def compile_device_models(self, device, gpu_models: Dict) -> Dict:
+        """编译一个设备上的模型（必须在该设备的专用推理线程中调用）
+
+        每个模型按batch档位逐个编译验证，成功的档位走编译图，失败的档位回退eager
+        """
+        device_key = str(device)
+        device_status = {}
+        if not self.enabled:
+            print(f"{device_key} torch.compile已禁用（DISABLE_TORCH_COMPILE=1）")
+            return device_status
+
+        print(f"{device_key} 开始按batch档位编译: {self.batch_sizes}, mode={self.options['mode']}")
+        for name, (get_module, set_module) in _compile_targets(gpu_models).items():
+            eager = get_module()
+            if isinstance(eager, ShapeDispatchModule):
+                eager = eager.eager
+            dtype = next(eager.parameters()).dtype
+            compiled = torch.compile(eager, **self.options)
+            compiled_sizes = []
+            model_status = {}
+
+            for batch_size in self.batch_sizes:
+                entry_key = f"{name}/{batch_size}"
+                known = self.manifest.get(entry_key, {})
+                if known.get('status') == STATUS_EAGER:
+                    model_status[batch_size] = {'status': STATUS_SKIPPED, 'error': known.get('error')}
+                    continue
+
+                start = time.time()
+                try:
+                    _example_call(name, compiled, batch_size, device, dtype)
+                    if torch.device(device).type == 'cuda':
+                        torch.cuda.synchronize(device)
+                    compiled_sizes.append(batch_size)
+                    model_status[batch_size] = {
+                        'status': STATUS_COMPILED,
+                        'compile_time': round(time.time() - start, 3),
+                        'cached': known.get('status') == STATUS_COMPILED,
+                    }
+                except Exception as e:
+                    error = f"{type(e).__name__}: {str(e)[:200]}"
+                    print(f"  ⚠️ {device_key} {name} batch={batch_size} 编译失败，回退eager: {error[:100]}")
+                    model_status[batch_size] = {'status': STATUS_EAGER, 'error': error}
+
+                with self._lock:
+                    self.manifest[entry_key] = {
+                        'status': model_status[batch_size]['status'],
+                        'error': model_status[batch_size].get('error'),
+                        'torch': torch.__version__,
+                    }
+
+            set_module(ShapeDispatchModule(eager, compiled, compiled_sizes))
+            device_status[name] = model_status
+            print(f"  ✅ {device_key} {name} 已编译batch: {compiled_sizes}")
+
+        with self._lock:
+            self.status[device_key] = device_status
+        return device_status
+
+    def compile_pool(self, inference_pool) -> Dict:
+        """在推理池每个设备的专用线程中并行编译"""
+        if not self.enabled:
+            print("torch.compile已禁用（DISABLE_TORCH_COMPILE=1），使用eager模型")
+            return {}
+        start = time.time()
+        self.prepare_cache()
+        results = inference_pool.run_on_all(self.compile_device_models)
+        self.save_cache()
+        print(f"✅ 所有设备编译完成: {time.time() - start:.2f}秒")
+        return results
+
+    def get_status(self) -> Dict:
+        """编译状态（/api/status）"""
+        return {
+            'enabled': self.enabled,
+            'mode': self.options['mode'],
+            'batch_sizes': self.batch_sizes,
+            'cache_dir': self.cache_dir,
+            'devices': self.status,
+        }
+
+
+# ===== 自检（CPU + 替身模型） =====
+
+def benchmark_compile_manager():
+    """CPU上编译替身模型两次（冷缓存/热缓存），验证编译结果与eager一致、失败shape回退eager"""
+    import tempfile
+    from core.standin_models import build_standin_models, synthetic_batch
+    from core.gpu_inference_pool import GPUInferencePool, run_inference
+
+    print("🧪 测试编译管理器（CPU替身模型）...")
+    os.environ.pop('DISABLE_TORCH_COMPILE', None)
+    os.environ.setdefault('MUSE_COMPILE_MODE', 'default')
+    timesteps = torch.tensor([0], dtype=torch.long)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for run in ('cold', 'warm'):
+            torch._dynamo.reset()
+            gpu_models = build_standin_models('cpu')
+            whisper_batch, latent_batch = synthetic_batch(2)
+            expected = run_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+
+            manager = CompileManager(model_hash='standin', cache_dir=tmp_dir, batch_sizes=[1, 2])
+            pool = GPUInferencePool({'cpu': gpu_models})
+            start = time.time()
+            manager.compile_pool(pool)
+            elapsed = time.time() - start
+
+            # 编译档位（2）和未编译档位（3，走eager）都要能跑
+            actual = pool.run('cpu', run_inference, gpu_models, whisper_batch, latent_batch, timesteps)
+            eager_batch = synthetic_batch(3)
+            pool.run('cpu', run_inference, gpu_models, *eager_batch, timesteps)
+            pool.shutdown()
+
+            max_diff = int(abs(actual.astype(int) - expected.astype(int)).max())
+            print(f"{run}: 编译耗时 {elapsed:.2f}秒, 与eager最大像素差 {max_diff}")
+            print(json.dumps(manager.get_status()['devices'], ensure_ascii=False, indent=2))
+            assert max_diff <= 2
+
+
+if __name__ == "__main__":
+    benchmark_compile_manager()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+模板背景帧压缩存储 - 每帧单独编码为 PNG（无损）/ WebP / JPEG 图像块，顺序写入一个
+{template_id}_frames.<格式>.pack 文件（文件尾是每帧偏移的索引，可以按帧随机读取）；
+推理时 EncodedFrameCycle 按循环帧下标解码，后台线程预取后续帧，合成线程按顺序取帧时不等待解码
+
+文件格式: 8字节魔数 + 8字节索引偏移（小端）+ 各帧图像块 + JSON索引（格式/帧数/帧形状/偏移）
+
+配置（环境变量）:
+    MUSE_FRAME_STORAGE=npy    模板帧存储格式（npy=原始帧mmap / png=无损 / webp / jpg）
+    MUSE_FRAME_QUALITY=95     webp/jpg 编码质量（webp >100 为无损）
+    MUSE_FRAME_PREFETCH=16    推理时后台预取的帧数
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FRAME_STORAGES = ('npy', 'png', 'webp', 'jpg')
+PACK_MAGIC = b'MUSEFRM1'
+PACK_HEADER_SIZE = 16
+
+
+def get_frame_storage() -> str:
+    """模板帧存储格式"""
+    storage = os.environ.get('MUSE_FRAME_STORAGE', 'npy').lower()
+    if storage not in FRAME_STORAGES:
+        print(f"⚠️ 未知的模板帧存储格式 {storage}，使用 npy")
+        return 'npy'
+    return storage
+
+
+def get_frame_quality() -> int:
+    return int(os.environ.get('MUSE_FRAME_QUALITY', '95'))
+
+
+def get_frame_prefetch() -> int:
+    return max(1, int(os.environ.get('MUSE_FRAME_PREFETCH', '16')))
+
+
+def frame_file_name(storage: str) -> str:
+    """解码阶段输出文件名（不含 {template_id}_ 前缀，npy 没有扩展名）"""
+    return 'frames' if storage == 'npy' else f"frames.{storage}.pack"
+
+
+def _encode_params(codec: str, quality: int) -> List[int]:
+    if codec == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, 1]  # 压缩级别1: 编码比默认级别快得多
+    if codec == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+
+class EncodedFrameWriter:
+    """按块写入帧（与 FrameArrayWriter 接口相同），每块在线程池中并行编码（cv2编码不持有GIL）"""
+
+    def __init__(self, path: str, codec: str = 'png', quality: Optional[int] = None, workers: Optional[int] = None):
+        if codec not in FRAME_STORAGES[1:]:
+            raise ValueError(f"不支持的帧编码格式: {codec}")
+        self.path = path
+        self.codec = codec
+        self.params = _encode_params(codec, get_frame_quality() if quality is None else quality)
+        self.count = 0
+        self.frame_shape = None
+        self._offsets = [PACK_HEADER_SIZE]
+        self._file = None
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def _encode(self, frame: np.ndarray) -> bytes:
+        ok, blob = cv2.imencode(f".{self.codec}", np.ascontiguousarray(frame), self.params)
+        if not ok:
+            raise ValueError(f"帧编码失败（{self.codec}）")
+        return blob.tobytes()
+
+    def write(self, frames):
+        if not len(frames):
+            return
+        if self._file is None:
+            self.frame_shape = tuple(frames[0].shape)
+            self._file = open(self.path + '.tmp', 'wb')
+            self._file.write(PACK_MAGIC + (0).to_bytes(8, 'little'))
+        for frame in frames:
+            if tuple(frame.shape) != self.frame_shape:
+                raise ValueError(f"帧形状 {frame.shape} 与 {self.frame_shape} 不一致")
+        for blob in self._executor.map(self._encode, frames):
+            self._file.write(blob)
+            self._offsets.append(self._offsets[-1] + len(blob))
+            self.count += 1
+
+    def close(self) -> int:
+        """写入索引并原子替换目标文件，返回帧数"""
+        self._executor.shutdown()
+        if self._file is None:
+            return 0
+        index = {'codec': self.codec, 'count': self.count, 'frame_shape': list(self.frame_shape),
+                 'offsets': self._offsets}
+        self._file.write(json.dumps(index).encode())
+        self._file.seek(len(PACK_MAGIC))
+        self._file.write(self._offsets[-1].to_bytes(8, 'little'))
+        self._file.close()
+        self._file = None
+        os.replace(self.path + '.tmp', self.path)
+        return self.count
+
+    def abort(self):
+        self._executor.shutdown()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self.path + '.tmp'):
+                os.remove(self.path + '.tmp')
+
+
+def read_pack_index(path: str) -> Dict:
+    """读取 .pack 文件的索引（只读文件头和尾部索引）"""
+    with open(path, 'rb') as f:
+        header = f.read(PACK_HEADER_SIZE)
+        if len(header) != PACK_HEADER_SIZE or header[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f"不是帧压缩文件: {path}")
+        f.seek(int.from_bytes(header[len(PACK_MAGIC):], 'little'))
+        index = json.loads(f.read().decode())
+    if len(index['offsets']) != index['count'] + 1:
+        raise ValueError(f"帧压缩文件索引不完整: {path}")
+    return index
+
+
+def _decode_blob(blob: bytes) -> np.ndarray:
+    frame = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("帧解码失败")
+    frame.setflags(write=False)  # 与mmap的帧一样只读，合成时先复制
+    return frame
+
+
+def iter_pack_chunks(path: str, chunk_size: int) -> Iterator[List[np.ndarray]]:
+    """按块顺序解码 .pack 文件（预处理的后续阶段使用）"""
+    offsets = read_pack_index(path)['offsets']
+    with open(path, 'rb') as f:
+        f.seek(offsets[0])
+        for start in range(0, len(offsets) - 1, chunk_size):
+            end = min(start + chunk_size, len(offsets) - 1)
+            data = f.read(offsets[end] - offsets[start])
+            yield [_decode_blob(data[offsets[i] - offsets[start]:offsets[i + 1] - offsets[start]])
+                   for i in range(start, end)]
+
+
+class EncodedFrameCycle:
+    """模板帧循环序列: frame_list_cycle[i] 返回解码后的帧（只读）
+
+    每次取帧后，后台线程按循环顺序预取之后的 prefetch 帧；命中预取的帧不等待解码，
+    未命中（跳帧或预取跟不上）时在调用线程同步解码，计入 stalls
+    """
+
+    def __init__(self, path: str, prefetch: Optional[int] = None):
+        self.path = path
+        index = read_pack_index(path)
+        self.codec = index['codec']
+        self.frame_shape = tuple(index['frame_shape'])
+        self.offsets = index['offsets']
+        self.prefetch = prefetch or get_frame_prefetch()
+        self.stats = {'hits': 0, 'stalls': 0, 'prefetched': 0}
+        self._fd = os.open(path, os.O_RDONLY)
+        self._cache = OrderedDict()  # 下标 -> 帧
+        self._cache_limit = 2 * self.prefetch + 8
+        self._inflight = set()
+        self._cursor = None  # 下一个预取窗口的起点
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def disk_bytes(self) -> int:
+        return self.offsets[-1]
+
+    def _read_blob(self, index: int) -> bytes:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return os.pread(self._fd, end - start, start)  # 线程安全，不共享文件位置
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        with self._cond:
+            self._cursor = (index + 1) % len(self)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._prefetch_loop, name='frame-prefetch', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            while index in self._inflight:
+                self._cond.wait()
+            frame = self._cache.get(index)
+            if frame is not None:
+                self._cache.move_to_end(index)
+                self.stats['hits'] += 1
+                return frame
+            self.stats['stalls'] += 1
+            self._inflight.add(index)
+        try:
+            frame = _decode_blob(self._read_blob(index))
+        finally:
+            with self._cond:
+                self._inflight.discard(index)
+                self._cond.notify_all()
+        with self._cond:
+            self._store(index, frame)
+        return frame
+
+    def _store(self, index: int, frame: np.ndarray):
+        self._cache[index] = frame
+        self._cache.move_to_end(index)
+        while len(self._cache) > self._cache_limit:
+            self._cache.popitem(last=False)
+
+    def _next_missing(self) -> Optional[int]:
+        """预取窗口中第一个既没有缓存也没有在解码的帧"""
+        if self._cursor is None:
+            return None
+        for offset in range(min(self.prefetch, len(self))):
+            index = (self._cursor + offset) % len(self)
+            if index not in self._cache and index not in self._inflight:
+                return index
+        return None
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                index = self._next_missing()
+                while index is None and not self._closed:
+                    self._cond.wait()
+                    index = self._next_missing()
+                if self._closed:
+                    return
+                self._inflight.add(index)
+            try:
+                frame = _decode_blob(self._read_blob(index))
+            except Exception as e:
+                print(f"⚠️ 预取第{index}帧失败: {e}")
+                frame = None
+            with self._cond:
+                self._inflight.discard(index)
+                if frame is not None:
+                    self._store(index, frame)
+                    self.stats['prefetched'] += 1
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# ===== 性能测试（合成视频） =====
+
+def benchmark_frame_storage(seconds: float = 4.0, width: int = 1920, height: int = 1080, compose_ms: float = 20.0):
+    """pickle / npy(mmap) / png / webp / jpg 的磁盘大小、加载耗时、解码吞吐和合成时的预取效果"""
+    import pickle
+    import tempfile
+    from core.template_frames import TemplateSource, FrameArrayWriter, write_synthetic_video
+
+    print(f"🧪 测试模板帧压缩存储（{seconds:.0f}秒 {width}x{height} 合成视频，合成耗时模拟 {compose_ms:.0f}ms/帧）...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'template.mp4')
+        write_synthetic_video(video_path, seconds, width, height)
+        frames = [frame for chunk in TemplateSource(video_path).iter_chunks(32) for frame in chunk]
+        num_frames = len(frames)
+
+        # 原格式: 帧列表整体pickle
+        pickle_path = os.path.join(tmp_dir, 'frames.pkl')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump({'frame_list_cycle': frames}, f)
+        start = time.perf_counter()
+        with open(pickle_path, 'rb') as f:
+            pickle.load(f)
+        print(f"  {'pickle':<5}: {os.path.getsize(pickle_path) / 1024 / 1024:7.1f}MB, "
+              f"加载 {(time.perf_counter() - start) * 1000:7.1f}ms（全部帧载入内存）")
+        os.remove(pickle_path)
+
+        npy_path = os.path.join(tmp_dir, 'frames.npy')
+        writer = FrameArrayWriter(npy_path)
+        writer.write(frames)
+        writer.close()
+        start = time.perf_counter()
+        cycle = np.load(npy_path, mmap_mode='r')
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(num_frames):
+            np.array(cycle[i])
+        print(f"  {'npy':<5}: {os.path.getsize(npy_path) / 1024 / 1024:7.1f}MB, "
+              f"加载 {load_time * 1000:7.1f}ms, 读取 {num_frames / (time.perf_counter() - start):7.1f} 帧/秒（mmap）")
+        del cycle
+        os.remove(npy_path)
+
+        for codec in FRAME_STORAGES[1:]:
+            pack_path = os.path.join(tmp_dir, f"frames.{codec}.pack")
+            start = time.perf_counter()
+            writer = EncodedFrameWriter(pack_path, codec)
+            writer.write(frames)
+            writer.close()
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cycle = EncodedFrameCycle(pack_path)
+            load_time = time.perf_counter() - start
+            decoded = [frame for chunk in iter_pack_chunks(pack_path, 32) for frame in chunk]
+            start = time.perf_counter()
+            for chunk in iter_pack_chunks(pack_path, 32):
+                pass
+            decode_rate = num_frames / (time.perf_counter() - start)
+            if codec == 'png':
+                assert all(np.array_equal(a, b) for a, b in zip(frames, decoded)), "png应当无损"
+            error = max(float(np.abs(a.astype(np.int16) - b).mean()) for a, b in zip(frames, decoded))
+
+            # 模拟合成: 按循环顺序取帧，每帧合成耗时 compose_ms（预取在后台与合成重叠）
+            start = time.perf_counter()
+            for i in range(num_frames):
+                frame = cycle[i]
+                time.sleep(compose_ms / 1000)
+            compose_time = time.perf_counter() - start
+            stats = dict(cycle.stats)
+            for i in (num_frames - 1, 0, num_frames // 2):  # 随机访问
+                assert np.array_equal(cycle[i], decoded[i])
+            cycle.close()
+            print(f"  {codec:<5}: {os.path.getsize(pack_path) / 1024 / 1024:7.1f}MB, "
+                  f"加载 {load_time * 1000:7.1f}ms, 解码 {decode_rate:7.1f} 帧/秒, 编码 {num_frames / encode_time:.1f} 帧/秒, "
+                  f"平均误差 {error:.2f}; 合成 {compose_time:.2f}秒（理想 {num_frames * compose_ms / 1000:.2f}秒）, "
+                  f"预取命中 {stats['hits']}/{num_frames}, 等待解码 {stats['stalls']}")
+            os.remove(pack_path)
+    print("  png无损，随机访问和循环顺序取帧正确 ✅")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='模板帧压缩存储性能测试')
+    parser.add_argument('--seconds', type=float, default=4.0)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--compose_ms', type=float, default=20.0, help='模拟每帧合成耗时')
+    args = parser.parse_args()
+    benchmark_frame_storage(args.seconds, args.width, args.height, args.compose_ms)
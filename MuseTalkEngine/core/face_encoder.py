@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+批量人脸编码 - 模板预处理的VAE编码
+每帧只以uint8上传人脸框区域，在设备上缩放到256×256并堆叠为一个batch，
+面部解析mask在设备上二值化和高斯平滑，masked latent和reference latent各一次批量编码；
+输出按输入顺序构造（不再按线程完成顺序追加）
+
+配置（环境变量）:
+    MUSE_ENCODE_BATCH=16   每次VAE编码的帧数
+"""
+
+import os
+import sys
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FACE_INPUT_SIZE = 256
+
+
+def get_encode_batch_size() -> int:
+    """每次VAE编码的帧数"""
+    return max(1, int(os.environ.get('MUSE_ENCODE_BATCH', '16')))
+
+
+def encode_images(vae, images: torch.Tensor) -> torch.Tensor:
+    """(B,3,H,W) [-1,1] -> reference latent (B,4,h,w)，兼容不同的VAE编码接口"""
+    if hasattr(vae, 'encode_latents'):
+        return vae.encode_latents(images)
+    if hasattr(vae, 'encode'):
+        latent_dist = vae.encode(images)
+        if hasattr(latent_dist, 'latent_dist'):
+            return latent_dist.latent_dist.sample() * 0.18215
+        if hasattr(latent_dist, 'sample'):
+            return latent_dist.sample() * 0.18215
+        return latent_dist * 0.18215
+    raise AttributeError(f"VAE对象没有encode方法: {dir(vae)}")
+
+
+def gaussian_kernel(sigma: float, device, truncate: float = 4.0) -> torch.Tensor:
+    """一维高斯核（半径与scipy.ndimage.gaussian_filter相同）"""
+    radius = int(truncate * sigma + 0.5)
+    x = torch.arange(-radius, radius + 1, device=device, dtype=torch.float32)
+    kernel = torch.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def blur_masks(masks: torch.Tensor, sigma: float = 1.0) -> torch.Tensor:
+    """(B,1,H,W) 可分离高斯平滑（边界反射，与scipy默认模式一致）"""
+    kernel = gaussian_kernel(sigma, masks.device)
+    radius = len(kernel) // 2
+    masks = F.pad(masks, (radius, radius, 0, 0), mode='reflect')
+    masks = F.conv2d(masks, kernel.view(1, 1, 1, -1))
+    masks = F.pad(masks, (0, 0, radius, radius), mode='reflect')
+    return F.conv2d(masks, kernel.view(1, 1, -1, 1))
+
+
+class BatchedFaceEncoder:
+    """批量人脸编码器（裁剪/缩放/mask平滑/编码都在设备上完成）"""
+
+    def __init__(self, vae, device, batch_size: Optional[int] = None, size: int = FACE_INPUT_SIZE):
+        self.vae = vae
+        self.device = torch.device(device)
+        self.batch_size = batch_size or get_encode_batch_size()
+        self.size = size
+
+    def crop_faces(self, frames: Sequence[np.ndarray], face_boxes: Sequence[Sequence[int]]) -> Tuple[torch.Tensor, List[np.ndarray]]:
+        """按人脸框裁剪（只上传人脸区域），在设备上缩放到模型输入尺寸
+
+        Returns:
+            (设备上的人脸图 (B,3,256,256) 取值[0,255] float, 主机端uint8 BGR人脸裁剪图（面部解析用）)
+        """
+        faces = []
+        for frame, (x1, y1, x2, y2) in zip(frames, face_boxes):
+            face = torch.from_numpy(np.ascontiguousarray(frame[y1:y2, x1:x2])).to(self.device, non_blocking=True)
+            face = face.permute(2, 0, 1).unsqueeze(0)
+            if self.device.type != 'cpu':
+                face = face.float()  # CUDA的抗锯齿缩放不支持uint8
+            faces.append(F.interpolate(face, size=(self.size, self.size), mode='bilinear',
+                                       align_corners=False, antialias=True))
+        faces = torch.cat(faces)
+        if faces.dtype != torch.uint8:
+            faces = faces.round_().clamp_(0, 255).to(torch.uint8)
+        crops = faces.permute(0, 2, 3, 1).cpu().numpy()
+        return faces.float(), list(crops)
+
+    def masks_to_device(self, parsing_masks: Sequence[np.ndarray]) -> torch.Tensor:
+        """面部解析标签图 -> 设备上平滑后的前景mask (B,1,256,256)"""
+        masks = torch.from_numpy(np.stack([np.asarray(mask, dtype=np.uint8) for mask in parsing_masks]))
+        masks = (masks.to(self.device) > 0).float().unsqueeze(1)
+        if masks.shape[-2:] != (self.size, self.size):
+            masks = F.interpolate(masks, size=(self.size, self.size), mode='bilinear', align_corners=False)
+        return blur_masks(masks)
+
+    def encode(self, faces: torch.Tensor, parsing_masks: Optional[Sequence[np.ndarray]] = None) -> torch.Tensor:
+        """masked latent + reference latent (B,8,32,32)，第i个输出对应第i个输入"""
+        masks = self.masks_to_device(parsing_masks) if parsing_masks is not None else None
+        outputs = []
+        with torch.no_grad():
+            for start in range(0, len(faces), self.batch_size):
+                images = faces[start:start + self.batch_size] / 127.5 - 1.0
+                reference_latent = encode_images(self.vae, images)
+                if masks is not None:
+                    masked_latent = encode_images(self.vae, images * masks[start:start + self.batch_size])
+                else:
+                    masked_latent = reference_latent
+                outputs.append(torch.cat([masked_latent, reference_latent], dim=1))
+        return torch.cat(outputs).cpu()
+
+
+# ===== 性能测试（CPU + 替身模型） =====
+
+def _per_frame_encode(vae, device, crop: np.ndarray, mask: np.ndarray) -> torch.Tensor:
+    """原来的逐帧编码路径: 逐帧float上传、主机端平滑mask、两次单帧编码"""
+    import cv2
+    with torch.no_grad():
+        frame_tensor = torch.from_numpy(crop).float().to(device) / 127.5 - 1.0
+        frame_tensor = frame_tensor.permute(2, 0, 1).unsqueeze(0)
+        reference_latent = encode_images(vae, frame_tensor)
+        binary_mask = cv2.GaussianBlur((mask > 0).astype(np.float32), (0, 0), 1.0)
+        mask_tensor = torch.from_numpy(binary_mask).to(device)[None, None].repeat(1, 3, 1, 1)
+        masked_latent = encode_images(vae, frame_tensor * mask_tensor)
+        return torch.cat([masked_latent, reference_latent], dim=1).cpu()
+
+
+def benchmark_face_encoder(num_frames: int = 64, height: int = 1080, width: int = 1920):
+    """批量编码 vs 逐帧线程池编码: 耗时、输出顺序和数值一致性"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from core.standin_models import build_standin_models, standin_face_boxes
+    from core.preprocessing import SimpleFaceParsing
+
+    print(f"🧪 测试批量人脸编码（{num_frames}帧 {width}x{height}，CPU替身模型）...")
+    vae = build_standin_models('cpu')['vae']
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(num_frames)]
+    boxes = standin_face_boxes(frames)
+    parser = SimpleFaceParsing()
+    encoder = BatchedFaceEncoder(vae, 'cpu')
+
+    start = time.perf_counter()
+    faces, crops = encoder.crop_faces(frames, boxes)
+    masks = parser.parse_batch(crops)
+    latents = encoder.encode(faces, masks)
+    batched_time = time.perf_counter() - start
+
+    # 原路径: 主机端裁剪缩放 + 4线程逐帧编码，按完成顺序追加
+    import cv2
+    start = time.perf_counter()
+    host_crops = [cv2.resize(f[y1:y2, x1:x2], (FACE_INPUT_SIZE, FACE_INPUT_SIZE), interpolation=cv2.INTER_LANCZOS4)
+                  for f, (x1, y1, x2, y2) in zip(frames, boxes)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {executor.submit(_per_frame_encode, vae, 'cpu', crop, parser(crop)): i
+                   for i, crop in enumerate(host_crops)}
+        completion_order = [futures[future] for future in as_completed(futures)]
+    per_frame_time = time.perf_counter() - start
+    shuffled = sum(1 for position, index in enumerate(completion_order) if position != index)
+
+    # 顺序和数值: 批量输出第i帧 == 单独编码第i帧
+    for i in range(0, num_frames, max(1, num_frames // 8)):
+        single = encoder.encode(faces[i:i + 1], masks[i:i + 1])
+        assert torch.allclose(latents[i:i + 1], single, atol=1e-4), f"第{i}帧批量编码结果不一致"
+    assert latents.shape == (num_frames, 8, 32, 32)
+
+    print(f"  逐帧线程池: {per_frame_time * 1000:.0f}ms（完成顺序与帧顺序不一致 {shuffled} 处）")
+    print(f"  批量编码  : {batched_time * 1000:.0f}ms（{num_frames / batched_time:.1f} 帧/秒），输出顺序与输入一致 ✅")
+
+
+if __name__ == "__main__":
+    benchmark_face_encoder()
@@ -1,92 +1,207 @@
 """
 GPU推理池 - 每个GPU一个专用线程，支持CUDA图
+模型编译、预热和推理都在同一个专用线程中执行（torch.compile/CUDA图的线程局部状态不跨线程）
 """
+import os
+import sys
 import torch
+import numpy as np
 import threading
 import queue
+import contextlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from typing import Dict, Any
 import time
 
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.shape_buckets import split_into_buckets, pad_batch
+
+
+def model_dtype(gpu_models: dict):
+    """模型权重精度（以UNet为准）"""
+    try:
+        return next(gpu_models['unet'].model.parameters()).dtype
+    except (StopIteration, AttributeError, KeyError):
+        return torch.float32
+
+
+def predict_latents(gpu_models: dict, whisper_batch, latent_batch, timesteps):
+    """PE -> UNet（输入已在模型所在设备上，返回设备上的预测latent）"""
+    with torch.no_grad():
+        audio_features = gpu_models['pe'](whisper_batch)
+        return gpu_models['unet'].model(
+            latent_batch, timesteps,
+            encoder_hidden_states=audio_features
+        ).sample
+
+
+def decode_latents_to_uint8(vae, latents: torch.Tensor) -> torch.Tensor:
+    """整批VAE解码，缩放/截断/通道重排/RGB->BGR/量化都在设备上完成
+
+    返回设备上连续的uint8张量 (B,H,W,3)，与 vae.decode_latents 的结果逐位一致，
+    但拷回主机的数据量只有float16图像的一半、float32的四分之一
+    """
+    latents = (1 / vae.vae.config.scaling_factor) * latents
+    image = vae.vae.decode(latents.to(next(vae.vae.parameters()).dtype)).sample
+    image = (image / 2 + 0.5).clamp(0, 1)
+    image = (image.permute(0, 2, 3, 1).float() * 255).round().to(torch.uint8)
+    return image.flip(-1).contiguous()
+
+
+def frames_to_numpy(frames: torch.Tensor) -> np.ndarray:
+    """一次性拷回主机，返回NumPy视图（不再逐帧转换）"""
+    return frames.cpu().numpy()
+
+
+def infer_frames(gpu_models: dict, whisper_batch, latent_batch, timesteps) -> torch.Tensor:
+    """PE -> UNet -> VAE解码，uint8 BGR帧留在设备上"""
+    with torch.no_grad():
+        pred_latents = predict_latents(gpu_models, whisper_batch, latent_batch, timesteps)
+        return decode_latents_to_uint8(gpu_models['vae'], pred_latents)
+
+
+def run_inference(gpu_models: dict, whisper_batch, latent_batch, timesteps):
+    """PE -> UNet -> VAE解码（输入已在模型所在设备上，返回uint8 BGR帧 (B,H,W,3)）"""
+    return frames_to_numpy(infer_frames(gpu_models, whisper_batch, latent_batch, timesteps))
+
+
+def run_latent_inference(gpu_models: dict, whisper_batch, latent_batch, timesteps):
+    """PE -> UNet，不解码，预测latent整批拷回 (B,4,32,32)（latent插值模式）"""
+    return predict_latents(gpu_models, whisper_batch, latent_batch, timesteps).cpu().numpy()
+
+
+def concat_frames(outputs):
+    """合并多段解码结果（numpy数组 / tensor / 列表）"""
+    if len(outputs) == 1:
+        return outputs[0]
+    if isinstance(outputs[0], np.ndarray):
+        return np.concatenate(outputs, axis=0)
+    if isinstance(outputs[0], torch.Tensor):
+        return torch.cat(outputs, dim=0)
+    return [frame for output in outputs for frame in output]
+
+
+def run_bucketed_inference(gpu_models: dict, whisper_batch, latent_batch, timesteps, buckets=None,
+                           infer_fn=run_inference):
+    """按batch档位补齐后推理（复用编译图），去掉补齐帧，返回帧数与输入一致"""
+    outputs = []
+    for start, end, bucket in split_into_buckets(whisper_batch.shape[0], buckets):
+        frames = infer_fn(
+            gpu_models,
+            pad_batch(whisper_batch[start:end], bucket),
+            pad_batch(latent_batch[start:end], bucket),
+            timesteps
+        )
+        outputs.append(frames[:end - start])
+    return concat_frames(outputs)
+
+
+def run_bucketed_decode(gpu_models: dict, latents: torch.Tensor, buckets=None) -> np.ndarray:
+    """只做VAE解码（输入为设备上的预测latent），按batch档位补齐，返回uint8 BGR帧 (B,H,W,3)"""
+    outputs = []
+    with torch.no_grad():
+        for start, end, bucket in split_into_buckets(latents.shape[0], buckets):
+            frames = decode_latents_to_uint8(gpu_models['vae'], pad_batch(latents[start:end], bucket))
+            outputs.append(frames_to_numpy(frames)[:end - start])
+    return concat_frames(outputs)
+
+
 class GPUInferenceWorker:
     """单个GPU的专用推理线程"""
-    
-    def __init__(self, gpu_id: int, gpu_models: dict):
+
+    def __init__(self, gpu_id: int, gpu_models: dict, device: str = None):
         self.gpu_id = gpu_id
-        self.device = f'cuda:{gpu_id}'
+        self.device = device or f'cuda:{gpu_id}'
         self.gpu_models = gpu_models
-        
-        # 任务队列
+
+        # 任务队列: (future, fn, args, kwargs)
         self.task_queue = queue.Queue()
         self.result_dict = {}
-        
-        # 启动专用线程
-        self.thread = threading.Thread(target=self._worker_loop, daemon=True)
-        self.thread.start()
-        
+
         # CUDA图缓存（在专用线程中创建）
         self.cuda_graphs = {}
-        
+
+        # 启动专用线程
+        self.thread = threading.Thread(target=self._worker_loop, name=f'gpu-worker-{self.device}', daemon=True)
+        self.thread.start()
+
+    def _device_context(self):
+        if torch.device(self.device).type == 'cuda':
+            return torch.cuda.device(self.device)
+        return contextlib.nullcontext()
+
     def _worker_loop(self):
         """专用线程主循环 - 这里可以安全使用CUDA图"""
-        torch.cuda.set_device(self.gpu_id)
-        
+        if torch.device(self.device).type == 'cuda':
+            torch.cuda.set_device(self.device)
+
         while True:
             try:
                 # 获取任务
                 task = self.task_queue.get(timeout=0.1)
                 if task is None:
                     break
-                    
-                batch_idx, whisper_batch, latent_batch, timesteps = task
-                
-                # 执行推理（在同一线程中，CUDA图安全）
-                result = self._inference(whisper_batch, latent_batch, timesteps)
-                
-                # 存储结果
-                self.result_dict[batch_idx] = result
-                
+
+                future, fn, args, kwargs = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                # 执行任务（在同一线程中，CUDA图安全）
+                try:
+                    with self._device_context():
+                        future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
             except queue.Empty:
                 continue
             except Exception as e:
                 print(f"GPU {self.gpu_id} 推理错误: {e}")
-                
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """在专用线程中执行任意函数（编译、预热、推理），返回Future"""
+        future = Future()
+        self.task_queue.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """在专用线程中执行并等待结果（异常原样抛出）"""
+        return self.submit(fn, *args, **kwargs).result()
+
     def _inference(self, whisper_batch, latent_batch, timesteps):
         """实际推理 - 可以使用CUDA图"""
-        with torch.cuda.device(self.device):
-            with torch.no_grad():
-                # 这里的模型已经被torch.compile优化
-                # 且在单线程中可以安全使用CUDA图
-                audio_features = self.gpu_models['pe'](whisper_batch)
-                pred_latents = self.gpu_models['unet'].model(
-                    latent_batch, timesteps, 
-                    encoder_hidden_states=audio_features
-                ).sample
-                recon_frames = self.gpu_models['vae'].decode_latents(pred_latents)
-                
-        return recon_frames
-        
+        # 这里的模型已经被torch.compile优化（按档位补齐，复用编译图）
+        # 且在单线程中可以安全使用CUDA图
+        return run_bucketed_inference(self.gpu_models, whisper_batch, latent_batch, timesteps)
+
     def submit_task(self, batch_idx, whisper_batch, latent_batch, timesteps):
         """提交推理任务"""
         # 将数据移到GPU
         whisper_batch = whisper_batch.to(self.device)
-        latent_batch = latent_batch.to(self.device) 
+        latent_batch = latent_batch.to(self.device)
         timesteps = timesteps.to(self.device)
-        
-        self.task_queue.put((batch_idx, whisper_batch, latent_batch, timesteps))
-        
+
+        self.result_dict[batch_idx] = self.submit(self._inference, whisper_batch, latent_batch, timesteps)
+
     def get_result(self, batch_idx, timeout=10):
         """获取推理结果"""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if batch_idx in self.result_dict:
-                return self.result_dict.pop(batch_idx)
-            time.sleep(0.01)
-        raise TimeoutError(f"等待批次 {batch_idx} 结果超时")
+        future = self.result_dict.pop(batch_idx)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"等待批次 {batch_idx} 结果超时")
+
+    def shutdown(self):
+        """停止专用线程"""
+        self.task_queue.put(None)
+        self.thread.join(timeout=5)
 
 
 class GPUInferencePool:
     """GPU推理池管理器"""
-    
+
     def __init__(self, gpu_models_dict: Dict[str, dict]):
         """
         gpu_models_dict: {
@@ -95,45 +210,100 @@ class GPUInferencePool:
         }
         """
         self.workers = {}
-        
+
         # 为每个GPU创建专用worker
         for device, models in gpu_models_dict.items():
-            gpu_id = int(device.split(':')[1])
-            self.workers[device] = GPUInferenceWorker(gpu_id, models)
-            print(f"✅ GPU {gpu_id} 推理线程已启动（支持CUDA图）")
-    
+            gpu_id = int(device.split(':')[1]) if ':' in device else 0
+            self.workers[device] = GPUInferenceWorker(gpu_id, models, device=device)
+            print(f"✅ {device} 推理线程已启动（支持CUDA图）")
+
+    def submit(self, device, fn, *args, **kwargs) -> Future:
+        """在指定设备的专用线程中执行，返回Future"""
+        return self.workers[device].submit(fn, *args, **kwargs)
+
+    def run(self, device, fn, *args, **kwargs):
+        """在指定设备的专用线程中执行并等待结果"""
+        return self.workers[device].run(fn, *args, **kwargs)
+
+    def run_on_all(self, fn, *args, **kwargs) -> Dict[str, Any]:
+        """在每个设备的专用线程中并行执行 fn(device, gpu_models, *args)，返回 {device: 结果}"""
+        futures = {
+            device: worker.submit(fn, device, worker.gpu_models, *args, **kwargs)
+            for device, worker in self.workers.items()
+        }
+        return {device: future.result() for device, future in futures.items()}
+
     def process_batch(self, batch_idx, batch_data, target_device):
         """处理一个批次"""
         whisper_batch, latent_batch = batch_data
         timesteps = torch.tensor([0], dtype=torch.long)
-        
+
         # 提交到指定GPU的专用线程
         worker = self.workers[target_device]
         worker.submit_task(batch_idx, whisper_batch, latent_batch, timesteps)
-        
+
         # 异步获取结果
         return worker.get_result(batch_idx)
-    
+
     def process_batches_parallel(self, all_batches):
         """并行处理所有批次"""
         results = {}
-        gpu_count = len(self.workers)
-        
+        devices = list(self.workers.keys())
+
         # 分配批次到不同GPU
         for batch_idx, batch_data in enumerate(all_batches):
-            target_device = f'cuda:{batch_idx % gpu_count}'
-            worker = self.workers[target_device]
-            
+            worker = self.workers[devices[batch_idx % len(devices)]]
+
             whisper_batch, latent_batch = batch_data
             timesteps = torch.tensor([0], dtype=torch.long)
-            
+
             # 提交任务（非阻塞）
             worker.submit_task(batch_idx, whisper_batch, latent_batch, timesteps)
-        
+
         # 收集结果
         for batch_idx in range(len(all_batches)):
-            target_device = f'cuda:{batch_idx % gpu_count}'
-            worker = self.workers[target_device]
+            worker = self.workers[devices[batch_idx % len(devices)]]
             results[batch_idx] = worker.get_result(batch_idx)
-            
-        return results
\ No newline at end of file
+
+        return results
+
+    def shutdown(self):
+        """停止所有专用线程"""
+        for worker in self.workers.values():
+            worker.shutdown()
+
+
+# ===== 自检（CPU + 替身模型） =====
+
+def benchmark_fused_decode():
+    """验证设备端融合解码与 vae.decode_latents 逐位一致，并比较拷回数据量和耗时"""
+    from core.standin_models import build_standin_models, LATENT_OUTPUT_SHAPE
+
+    print("🧪 测试融合解码（替身模型）...")
+    devices = ['cpu'] + (['cuda:0'] if torch.cuda.is_available() else [])
+    for device in devices:
+        dtype = torch.float16 if device.startswith('cuda') else torch.float32
+        vae = build_standin_models(device, dtype)['vae']
+        latents = torch.randn(16, *LATENT_OUTPUT_SHAPE, device=device, dtype=dtype)
+
+        with torch.no_grad():
+            start = time.perf_counter()
+            for _ in range(5):
+                expected = vae.decode_latents(latents)
+                expected = [frame.astype(np.uint8) for frame in expected]  # 原来合成前的逐帧转换
+            reference_time = (time.perf_counter() - start) / 5
+
+            start = time.perf_counter()
+            for _ in range(5):
+                actual = frames_to_numpy(decode_latents_to_uint8(vae, latents))
+            fused_time = (time.perf_counter() - start) / 5
+
+        assert actual.dtype == np.uint8 and actual.flags['C_CONTIGUOUS']
+        assert np.array_equal(actual, np.stack(expected)), f"{device} 融合解码结果不一致"
+        float_bytes = actual.size * torch.finfo(dtype).bits // 8
+        print(f"  {device}: 结果一致 ✅, 拷回 {actual.nbytes / 1024 / 1024:.1f}MB（浮点图像 {float_bytes / 1024 / 1024:.1f}MB）, "
+              f"耗时 {fused_time * 1000:.1f}ms（原路径 {reference_time * 1000:.1f}ms）")
+
+
+if __name__ == "__main__":
+    benchmark_fused_decode()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+人脸关键点服务 - 进程内共享的face_alignment检测器（第一次使用时加载，之后常驻），
+按批调用 get_landmarks_from_batch；检测结果按帧内容哈希缓存（内存 + 磁盘记录文件），
+同一个源重新预处理时已检测过的帧不再经过检测器；
+musetalk_face_boxes 是MuseTalk人脸框检测的内存版本（直接接受解码后的帧，不经过临时图片文件）
+
+配置（环境变量）:
+    MUSE_LANDMARK_DEVICE=         检测器设备（默认: 有GPU时cuda，否则cpu）
+    MUSE_LANDMARK_BATCH=8         每批检测的帧数
+    MUSE_LANDMARK_CACHE_DIR=      检测结果缓存目录（默认: 模板缓存目录下的 .landmark_cache，设为空字符串只缓存在内存）
+"""
+
+import os
+import sys
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIGEST_SIZE = 16
+LANDMARK_SHAPE = (68, 2)
+MISSING = object()  # 缓存未命中（与"检测过但没有人脸"的None区分）
+
+
+def get_landmark_device() -> str:
+    """检测器设备"""
+    device = os.environ.get('MUSE_LANDMARK_DEVICE', '').strip()
+    if device:
+        return device
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def get_landmark_batch_size() -> int:
+    """每批检测的帧数"""
+    return max(1, int(os.environ.get('MUSE_LANDMARK_BATCH', '8')))
+
+
+def get_landmark_cache_dir() -> Optional[str]:
+    """检测结果缓存目录（None=只缓存在内存）"""
+    cache_dir = os.environ.get('MUSE_LANDMARK_CACHE_DIR')
+    if cache_dir is None:
+        template_cache_dir = os.environ.get('MUSE_TEMPLATE_CACHE_DIR', '/opt/musetalk/template_cache')
+        cache_dir = os.path.join(template_cache_dir, '.landmark_cache')
+    return cache_dir or None
+
+
+def frame_digest(frame: np.ndarray) -> bytes:
+    """帧内容哈希（像素 + 形状）"""
+    frame = np.ascontiguousarray(frame)
+    digest = hashlib.blake2b(frame.data, digest_size=DIGEST_SIZE)
+    digest.update(repr((frame.shape, frame.dtype.str)).encode())
+    return digest.digest()
+
+
+class FrameResultCache:
+    """按帧内容哈希缓存固定形状的检测结果
+
+    磁盘上是追加写入的定长记录文件（哈希 + float32结果，没有人脸时为NaN），第一次使用时整体读入内存
+    """
+
+    def __init__(self, name: str, record_shape: Tuple[int, ...], cache_dir: Optional[str] = None):
+        self.record_shape = tuple(record_shape)
+        self.record_bytes = int(np.prod(self.record_shape)) * 4
+        shape_tag = 'x'.join(str(v) for v in self.record_shape)
+        self.path = os.path.join(cache_dir, f"{name}_{shape_tag}.bin") if cache_dir else None
+        self.entries: Dict[bytes, Optional[np.ndarray]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        record_size = DIGEST_SIZE + self.record_bytes
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for offset in range(0, len(data) - record_size + 1, record_size):  # 忽略写了一半的尾部记录
+            digest = data[offset:offset + DIGEST_SIZE]
+            result = np.frombuffer(data, np.float32, int(np.prod(self.record_shape)), offset + DIGEST_SIZE)
+            self.entries[digest] = None if np.isnan(result).all() else result.reshape(self.record_shape).copy()
+
+    def get_many(self, digests: Sequence[bytes]) -> list:
+        """结果列表，未命中的位置为 MISSING"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            results = [self.entries.get(digest, MISSING) for digest in digests]
+        misses = sum(1 for result in results if result is MISSING)
+        self.misses += misses
+        self.hits += len(results) - misses
+        return results
+
+    def put_many(self, digests: Sequence[bytes], results: Sequence[Optional[np.ndarray]]):
+        records = []
+        with self._lock:
+            for digest, result in zip(digests, results):
+                array = (np.full(self.record_shape, np.nan, dtype=np.float32) if result is None
+                         else np.asarray(result, dtype=np.float32).reshape(self.record_shape))
+                self.entries[digest] = None if result is None else array
+                records.append(digest + array.tobytes())
+            if self.path and records:
+                try:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    with open(self.path, 'ab') as f:
+                        f.write(b''.join(records))
+                except OSError as e:
+                    print(f"⚠️ 关键点缓存写入失败（只缓存在内存）: {e}")
+
+    def snapshot(self) -> Dict:
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'path': self.path}
+
+
+def _face_alignment_factory(device: str):
+    """face_alignment 2D关键点检测器"""
+    from face_alignment import FaceAlignment, LandmarksType
+    landmarks_type = getattr(LandmarksType, 'TWO_D', None) or getattr(LandmarksType, '_2D')
+    return FaceAlignment(landmarks_type, flip_input=False, device=device)
+
+
+class LandmarkService:
+    """共享的人脸关键点检测服务（检测器懒加载，批量检测，按帧哈希缓存）"""
+
+    def __init__(self, device: Optional[str] = None, batch_size: Optional[int] = None,
+                 cache_dir: Optional[str] = '', detector_factory: Callable[[str], object] = _face_alignment_factory):
+        self.device = device or get_landmark_device()
+        self.batch_size = batch_size or get_landmark_batch_size()
+        self.cache_dir = get_landmark_cache_dir() if cache_dir == '' else cache_dir
+        self.detector_factory = detector_factory
+        self.detector = None
+        self.caches: Dict[str, FrameResultCache] = {}
+        self._lock = threading.Lock()
+        self._detect_lock = threading.Lock()  # 检测器不保证线程安全（多个预处理工作线程共用）
+
+    def get_detector(self):
+        """第一次调用时加载检测器"""
+        if self.detector is None:
+            with self._lock:
+                if self.detector is None:
+                    start = time.time()
+                    self.detector = self.detector_factory(self.device)
+                    print(f"✅ 人脸关键点检测器已加载 ({self.device}, {time.time() - start:.2f}秒)")
+        return self.detector
+
+    def cache(self, name: str, record_shape: Tuple[int, ...]) -> FrameResultCache:
+        """按名称共享的帧结果缓存（不同检测器/结果类型用不同名称）"""
+        with self._lock:
+            if name not in self.caches:
+                self.caches[name] = FrameResultCache(name, record_shape, self.cache_dir)
+            return self.caches[name]
+
+    def get_landmarks(self, frames: Sequence[np.ndarray], digests: Optional[Sequence[bytes]] = None) -> List[Optional[np.ndarray]]:
+        """BGR帧 -> 每帧第一个人脸的68个关键点 (68,2)，没有人脸时为None"""
+        digests = digests or [frame_digest(frame) for frame in frames]
+        cache = self.cache('face_alignment', LANDMARK_SHAPE)
+        results = cache.get_many(digests)
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            detected = self._detect([frames[i] for i in missing])
+            cache.put_many([digests[i] for i in missing], detected)
+            for i, landmarks in zip(missing, detected):
+                results[i] = landmarks
+        return results
+
+    def _detect(self, frames: Sequence[np.ndarray]) -> List[Optional[np.ndarray]]:
+        """按批检测（同一批内帧尺寸相同）"""
+        import torch
+        detector = self.get_detector()
+        results: List[Optional[np.ndarray]] = [None] * len(frames)
+        by_shape: Dict[tuple, List[int]] = {}
+        for i, frame in enumerate(frames):
+            by_shape.setdefault(frame.shape, []).append(i)
+        with self._detect_lock, torch.no_grad():
+            for indices in by_shape.values():
+                for start in range(0, len(indices), self.batch_size):
+                    batch_indices = indices[start:start + self.batch_size]
+                    batch = np.stack([frames[i][..., ::-1] for i in batch_indices])  # BGR -> RGB
+                    batch = torch.from_numpy(batch).permute(0, 3, 1, 2).to(self.device)
+                    predictions = detector.get_landmarks_from_batch(batch)
+                    for i, prediction in zip(batch_indices, predictions):
+                        if prediction is not None and len(prediction) >= LANDMARK_SHAPE[0]:
+                            results[i] = np.asarray(prediction, dtype=np.float32)[:LANDMARK_SHAPE[0], :2]
+        return results
+
+    def snapshot(self) -> Dict:
+        return {
+            'device': self.device,
+            'loaded': self.detector is not None,
+            'caches': {name: cache.snapshot() for name, cache in self.caches.items()},
+        }
+
+
+_musetalk_lock = threading.Lock()  # MuseTalk模块级的检测/姿态模型在多个预处理线程间共用
+
+
+def musetalk_face_boxes(frames: Sequence[np.ndarray], upperbondrange: int = 0,
+                        batch_size: Optional[int] = None) -> list:
+    """MuseTalk get_landmark_and_bbox 的内存版本: 直接接受解码后的BGR帧，不写临时文件
+
+    与原函数相同的模型（musetalk.utils.preprocessing 模块级的人脸检测 fa 和DWPose model）和相同的框计算，
+    人脸检测按批执行，没有检测到人脸的帧不做关键点推理；返回 (x1,y1,x2,y2)，没有人脸时为 coord_placeholder
+    """
+    from musetalk.utils import preprocessing as musetalk_preprocessing  # 导入时加载检测/姿态模型
+    from mmpose.apis import inference_topdown
+    from mmpose.structures import merge_data_samples
+
+    batch_size = batch_size or get_landmark_batch_size()
+    placeholder = musetalk_preprocessing.coord_placeholder
+    coords = []
+    with _musetalk_lock:
+        for start in range(0, len(frames), batch_size):
+            batch = frames[start:start + batch_size]
+            detections = musetalk_preprocessing.fa.get_detections_for_batch(np.asarray(batch))
+            for frame, bbox in zip(batch, detections):
+                if bbox is None:
+                    coords.append(placeholder)
+                    continue
+                results = merge_data_samples(inference_topdown(musetalk_preprocessing.model, frame))
+                face_land_mark = results.pred_instances.keypoints[0][23:91].astype(np.int32)
+                half_face_coord = face_land_mark[29].copy()
+                if upperbondrange != 0:
+                    half_face_coord[1] = upperbondrange + half_face_coord[1]
+                half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
+                upper_bond = half_face_coord[1] - half_face_dist
+                x1, y1, x2, y2 = (int(np.min(face_land_mark[:, 0])), int(upper_bond),
+                                  int(np.max(face_land_mark[:, 0])), int(np.max(face_land_mark[:, 1])))
+                if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # 关键点框不合适时使用检测框
+                    coords.append(tuple(int(v) for v in bbox[:4]))
+                else:
+                    coords.append((x1, y1, x2, y2))
+    return coords
+
+
+# 全局服务实例
+_landmark_service: Optional[LandmarkService] = None
+_landmark_service_lock = threading.Lock()
+
+
+def get_landmark_service() -> LandmarkService:
+    """获取共享的关键点服务实例（检测器在第一次检测时加载）"""
+    global _landmark_service
+    if _landmark_service is None:
+        with _landmark_service_lock:
+            if _landmark_service is None:
+                _landmark_service = LandmarkService()
+    return _landmark_service
+
+
+# ===== 性能测试（CPU + 模拟检测器） =====
+
+class _SimulatedDetector:
+    """模拟face_alignment: 构造时加载权重，检测耗时 = 每次调用固定开销 + 每帧开销"""
+
+    load_seconds = 0.2
+    call_seconds = 0.004
+    frame_seconds = 0.002
+
+    def __init__(self, device):
+        time.sleep(self.load_seconds)
+
+    def _landmarks(self, height, width):
+        points = np.stack(np.meshgrid(np.linspace(0.3, 0.7, 17), np.linspace(0.3, 0.7, 4)), -1).reshape(-1, 2)[:68]
+        return points * [width, height]
+
+    def get_landmarks(self, image):
+        time.sleep(self.call_seconds + self.frame_seconds)
+        return [self._landmarks(*image.shape[:2])]
+
+    def get_landmarks_from_batch(self, batch):
+        time.sleep(self.call_seconds + self.frame_seconds * len(batch))
+        return [self._landmarks(*batch.shape[2:]) for _ in range(len(batch))]
+
+
+def benchmark_landmark_service(num_frames: int = 32, height: int = 720, width: int = 1280):
+    """逐帧构造检测器 vs 共享服务批量检测 vs 同一源再次检测（缓存命中）"""
+    import tempfile
+    import torch  # noqa: F401  预处理进程中torch已导入，不计入检测耗时
+
+    print(f"🧪 测试人脸关键点服务（{num_frames}帧 {width}x{height}，模拟检测器）...")
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(num_frames)]
+
+    # 原路径: 每帧构造一个检测器再单帧检测
+    start = time.perf_counter()
+    per_frame = [_SimulatedDetector('cpu').get_landmarks(frame[..., ::-1])[0] for frame in frames]
+    per_frame_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = LandmarkService('cpu', 8, cache_dir, _SimulatedDetector)
+        start = time.perf_counter()
+        batched = service.get_landmarks(frames)
+        batched_time = time.perf_counter() - start
+
+        # 新的服务实例（模拟重新启动后再次预处理同一个源）: 从磁盘缓存读取，不加载检测器
+        restarted = LandmarkService('cpu', 8, cache_dir, _SimulatedDetector)
+        start = time.perf_counter()
+        cached = restarted.get_landmarks(frames)
+        cached_time = time.perf_counter() - start
+        assert restarted.detector is None
+        assert restarted.caches['face_alignment'].hits == num_frames
+
+    for a, b, c in zip(per_frame, batched, cached):
+        assert np.allclose(a, b) and np.allclose(b, c)
+    print(f"  逐帧构造检测器: {per_frame_time * 1000:.0f}ms")
+    print(f"  共享服务批量  : {batched_time * 1000:.0f}ms（检测器加载1次）")
+    print(f"  缓存命中      : {cached_time * 1000:.0f}ms（{cached_time / num_frames * 1000:.1f}ms/帧，主要是帧哈希）✅")
+
+
+def check_placeholder_redetect(num_frames: int = 4, height: int = 360, width: int = 640):
+    """预处理器的人脸框检测: MuseTalk返回 coord_placeholder 的帧必须经过共享服务的face_alignment重新检测"""
+    import tempfile
+    import core.landmark_service as landmark_service  # 预处理器通过模块取共享服务（直接运行本文件时是 __main__）
+    from core.preprocessing import OptimizedPreprocessor, coord_placeholder
+
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(num_frames)]
+    original_service, original_boxes = landmark_service._landmark_service, landmark_service.musetalk_face_boxes
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            service = landmark_service.LandmarkService('cpu', 8, cache_dir, _SimulatedDetector)
+            landmark_service._landmark_service = service
+            landmark_service.musetalk_face_boxes = lambda batch: [coord_placeholder] * len(batch)
+            boxes = OptimizedPreprocessor().detect_face_boxes(frames)
+    finally:
+        landmark_service._landmark_service, landmark_service.musetalk_face_boxes = original_service, original_boxes
+
+    redetected = service.caches['face_alignment'].misses
+    assert redetected == num_frames, f"重新检测 {redetected}/{num_frames} 帧"
+    assert all(box is not None and 0 <= box[0] < box[2] <= width and 0 <= box[1] < box[3] <= height
+               for box in boxes), boxes
+    print(f"  占位框重新检测: {redetected}/{num_frames}帧经过共享face_alignment服务 ✅")
+
+
+if __name__ == "__main__":
+    benchmark_landmark_service()
+    check_placeholder_redetect()
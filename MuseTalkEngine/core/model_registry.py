@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+模型注册表 - 权重只反序列化一次
+从磁盘读取一次checkpoint构建CPU主副本（半精度），再按需克隆到各设备；
+半精度转换结果缓存到磁盘，下次启动通过mmap直接加载，跳过原始checkpoint读取和转换
+"""
+
+import os
+import sys
+import copy
+import glob
+import time
+import hashlib
+import resource
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+# 半精度权重缓存目录
+DEFAULT_WEIGHT_CACHE_DIR = os.environ.get('MUSE_WEIGHT_CACHE_DIR', '/opt/musetalk/cache/fp16_weights')
+
+
+def clone_to_device(obj, device):
+    """深拷贝模型对象，参数和缓冲区直接拷贝到目标设备（不在CPU上额外复制一份）"""
+    if isinstance(obj, torch.nn.Module):
+        modules = [obj]
+    else:
+        modules = [v for v in vars(obj).values() if isinstance(v, torch.nn.Module)]
+
+    # 预先填充deepcopy的memo，让拷贝直接复用目标设备上的张量
+    memo = {}
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) in memo:
+                continue
+            copied = tensor.detach().to(device, non_blocking=True)
+            if isinstance(tensor, torch.nn.Parameter):
+                copied = torch.nn.Parameter(copied, requires_grad=tensor.requires_grad)
+            memo[id(tensor)] = copied
+    return copy.deepcopy(obj, memo)
+
+
+def convert_components(components: Dict, dtype=torch.float16) -> Dict:
+    """把 vae/unet/pe 组件转换到CPU + 指定精度 + eval模式
+    兼容MuseTalk包装对象（vae.vae / unet.model）和普通nn.Module
+    """
+    converted = {}
+    for name, component in components.items():
+        if hasattr(component, 'vae') and isinstance(component.vae, torch.nn.Module):
+            component.vae = component.vae.to('cpu', dtype=dtype).eval()
+        elif hasattr(component, 'model') and isinstance(component.model, torch.nn.Module):
+            component.model = component.model.to('cpu', dtype=dtype).eval()
+        elif isinstance(component, torch.nn.Module):
+            component = component.to('cpu', dtype=dtype).eval()
+        else:
+            print(f"警告: {name}对象结构不明，跳过精度转换")
+        converted[name] = component
+    return converted
+
+
+def _files_fingerprint(paths: List[str]) -> List[str]:
+    """收集checkpoint文件的 路径/大小/修改时间（目录递归），不读取文件内容"""
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True))
+        else:
+            files = [path]
+        for file_path in files:
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                entries.append(f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return entries
+
+
+class ModelRegistry:
+    """模型注册表 - CPU主副本 + 按设备克隆 + 半精度磁盘缓存"""
+
+    def __init__(self, name: str = 'musetalk', cache_dir: Optional[str] = None, dtype=torch.float16):
+        self.name = name
+        self.cache_dir = cache_dir or DEFAULT_WEIGHT_CACHE_DIR
+        self.dtype = dtype
+        self.master = None
+        self.model_hash = None
+        self.stats = {}
+
+    def cache_key(self, checkpoint_paths: List[str]) -> str:
+        """缓存键: checkpoint指纹 + torch版本 + 精度"""
+        hasher = hashlib.sha1()
+        hasher.update(torch.__version__.encode())
+        hasher.update(str(self.dtype).encode())
+        for entry in _files_fingerprint(checkpoint_paths):
+            hasher.update(entry.encode())
+        return hasher.hexdigest()[:16]
+
+    def _cache_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.name}_{key}_fp16.pt")
+
+    def load(self, loader: Callable[[], Dict], checkpoint_paths: List[str], use_cache: bool = True) -> Dict:
+        """加载CPU主副本
+
+        Args:
+            loader: 从原始checkpoint构建组件的函数，返回 {'vae':..., 'unet':..., 'pe':...}
+            checkpoint_paths: 用于计算缓存键的checkpoint文件/目录
+            use_cache: 是否使用半精度磁盘缓存
+        """
+        start = time.time()
+        self.model_hash = self.cache_key(checkpoint_paths)
+        cache_file = self._cache_file(self.model_hash)
+
+        if use_cache and os.path.exists(cache_file):
+            try:
+                self.master = self._load_cache(cache_file)
+                self.stats = {'source': 'fp16_cache', 'cache_file': cache_file, 'load_time': time.time() - start}
+                print(f"✅ 从半精度缓存加载模型: {cache_file} ({self.stats['load_time']:.2f}秒)")
+                return self.master
+            except Exception as e:
+                print(f"⚠️ 半精度缓存加载失败，回退到原始checkpoint: {e}")
+
+        # 原始checkpoint只读取一次
+        components = loader()
+        self.master = convert_components(components, self.dtype)
+        load_time = time.time() - start
+        self.stats = {'source': 'checkpoint', 'cache_file': None, 'load_time': load_time}
+        print(f"✅ 从原始checkpoint加载模型并转换为半精度: {load_time:.2f}秒")
+
+        if use_cache:
+            self._save_cache(cache_file)
+        return self.master
+
+    def _load_cache(self, cache_file: str) -> Dict:
+        """mmap加载缓存（torch>=2.1），张量按需从页缓存读取"""
+        try:
+            return torch.load(cache_file, map_location='cpu', mmap=True, weights_only=False)
+        except TypeError:
+            # 旧版torch不支持mmap参数
+            return torch.load(cache_file, map_location='cpu')
+
+    def _save_cache(self, cache_file: str):
+        """原子写入缓存文件，并清理同名旧缓存"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.tmp{os.getpid()}"
+            torch.save(self.master, tmp_file)
+            os.replace(tmp_file, cache_file)
+            self.stats['cache_file'] = cache_file
+            print(f"💾 半精度权重缓存已写入: {cache_file}")
+
+            for old_file in glob.glob(os.path.join(self.cache_dir, f"{self.name}_*_fp16.pt")):
+                if old_file != cache_file:
+                    os.remove(old_file)
+        except Exception as e:
+            print(f"⚠️ 半精度权重缓存写入失败（不影响运行）: {e}")
+            if 'tmp_file' in locals() and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def replicate(self, device) -> Dict:
+        """把主副本克隆到指定设备"""
+        if self.master is None:
+            raise RuntimeError("模型主副本未加载")
+        replica = {}
+        for name, component in self.master.items():
+            replica[name] = clone_to_device(component, device)
+            # 包装对象记录的设备也要同步
+            if hasattr(replica[name], 'device') and not isinstance(replica[name], torch.nn.Module):
+                replica[name].device = torch.device(device)
+        return replica
+
+    def release(self):
+        """释放CPU主副本（所有设备复制完成后调用）"""
+        self.master = None
+
+
+# ===== 性能测试（CPU + 小型替身模型） =====
+
+class _DummyWrapper:
+    """模拟MuseTalk的包装对象结构（.model / .vae）"""
+
+    def __init__(self, attr: str, module: torch.nn.Module):
+        setattr(self, attr, module)
+
+
+def _build_dummy_models(checkpoint_file: str) -> Dict:
+    """从checkpoint构建替身模型（每次调用都会重新读取磁盘）"""
+    state = torch.load(checkpoint_file, map_location='cpu')
+    modules = {}
+    for name in ('vae', 'unet', 'pe'):
+        module = _dummy_module()
+        module.load_state_dict(state[name])
+        modules[name] = module
+    return {
+        'vae': _DummyWrapper('vae', modules['vae']),
+        'unet': _DummyWrapper('model', modules['unet']),
+        'pe': modules['pe'],
+    }
+
+
+def _dummy_module() -> torch.nn.Module:
+    return torch.nn.Sequential(*[torch.nn.Linear(1024, 1024) for _ in range(12)])
+
+
+def _peak_rss_mb() -> float:
+    """进程峰值RSS（MB），Linux的ru_maxrss单位为KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+
+
+def _benchmark_worker(mode: str, checkpoint_file: str, cache_dir: str, device_count: int, result_queue):
+    """在独立进程中测量一种加载方式的耗时和峰值内存"""
+    baseline_rss = _peak_rss_mb()  # import torch等的基础占用
+    start = time.time()
+    replicas = []
+    if mode == 'per_device':
+        # 旧方式: 每个设备单独读取checkpoint + 转换
+        for _ in range(device_count):
+            replicas.append(convert_components(_build_dummy_models(checkpoint_file)))
+    else:
+        registry = ModelRegistry(name='dummy', cache_dir=cache_dir)
+        registry.load(lambda: _build_dummy_models(checkpoint_file), [checkpoint_file])
+        for _ in range(device_count):
+            replicas.append(registry.replicate('cpu'))
+        registry.release()
+    elapsed = time.time() - start
+    result_queue.put((mode, elapsed, _peak_rss_mb() - baseline_rss))
+
+
+def benchmark_model_registry(device_count: int = 2):
+    """对比 每设备重复加载 vs 注册表（冷启动/缓存命中） 的启动耗时和峰值内存"""
+    import multiprocessing as mp
+
+    print("🧪 测试模型注册表加载性能...")
+    ctx = mp.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint_file = os.path.join(tmp_dir, 'dummy_checkpoint.bin')
+        torch.save({name: _dummy_module().state_dict() for name in ('vae', 'unet', 'pe')}, checkpoint_file)
+        size_mb = os.path.getsize(checkpoint_file) / 1024 / 1024
+        cache_dir = os.path.join(tmp_dir, 'fp16_cache')
+        print(f"替身checkpoint: {size_mb:.1f}MB, 设备数: {device_count}")
+
+        # registry_cold写入缓存，registry_cached命中缓存
+        for mode in ('per_device', 'registry_cold', 'registry_cached'):
+            result_queue = ctx.Queue()
+            process = ctx.Process(
+                target=_benchmark_worker,
+                args=(mode, checkpoint_file, cache_dir, device_count, result_queue)
+            )
+            process.start()
+            mode, elapsed, peak_rss_delta = result_queue.get()
+            process.join()
+
+            print(f"方式: {mode}")
+            print(f"  - 耗时: {elapsed*1000:.1f}ms")
+            print(f"  - 峰值RSS增量: {peak_rss_delta:.1f}MB")
+            print()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    benchmark_model_registry()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+显存不足自动恢复 - batch遇到OOM时对半拆分重试（递归到单帧），保证输出帧数完整
+每个设备维护一个自适应的安全batch上限: OOM时降低，连续成功后逐级回升
+
+配置（环境变量）:
+    MUSE_OOM_RECOVER_AFTER=20   连续成功多少个batch后上限回升一档
+"""
+
+import os
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+import torch
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.gpu_inference_pool import run_bucketed_inference, run_inference, concat_frames
+from core.shape_buckets import get_bucket_sizes
+
+
+class AdaptiveBatchLimit:
+    """单个设备的自适应batch上限（取值总是分桶档位之一）"""
+
+    def __init__(self, ceiling: Optional[int] = None, recover_after: Optional[int] = None,
+                 buckets: Optional[Tuple[int, ...]] = None):
+        self.buckets = tuple(sorted(buckets or get_bucket_sizes()))
+        self.ceiling = self._floor_bucket(ceiling or self.buckets[-1])
+        self.limit = self.ceiling
+        self.recover_after = recover_after or int(os.environ.get('MUSE_OOM_RECOVER_AFTER', '20'))
+        self.successes = 0
+        self.oom_count = 0
+        self._lock = threading.Lock()
+
+    def _floor_bucket(self, size: int) -> int:
+        """不超过size的最大档位"""
+        candidates = [b for b in self.buckets if b <= size]
+        return candidates[-1] if candidates else self.buckets[0]
+
+    def record_oom(self, batch_size: int):
+        """OOM: 上限降到失败batch的一半（按档位取整）"""
+        with self._lock:
+            self.oom_count += 1
+            self.successes = 0
+            self.limit = min(self.limit, self._floor_bucket(max(1, batch_size // 2)))
+
+    def record_success(self):
+        """成功: 连续成功recover_after次后上限回升一档"""
+        with self._lock:
+            if self.limit >= self.ceiling:
+                return
+            self.successes += 1
+            if self.successes >= self.recover_after:
+                self.successes = 0
+                larger = [b for b in self.buckets if self.limit < b <= self.ceiling]
+                self.limit = larger[0] if larger else self.ceiling
+                print(f"📈 安全batch上限回升到 {self.limit}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {'limit': self.limit, 'ceiling': self.ceiling, 'oom_count': self.oom_count}
+
+
+def _is_oom(error: BaseException) -> bool:
+    return isinstance(error, torch.cuda.OutOfMemoryError) or 'out of memory' in str(error).lower()
+
+
+def _release_memory(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.empty_cache()
+
+
+def run_inference_with_oom_split(gpu_models: dict, whisper_batch, latent_batch, timesteps,
+                                 limit: Optional[AdaptiveBatchLimit] = None, device='cpu', infer_fn=run_inference):
+    """推理并在OOM时对半拆分重试，返回帧数与输入一致（单帧仍OOM时抛出异常）
+
+    infer_fn为 run_latent_inference 时只返回预测latent（latent插值模式）
+    """
+    num_frames = whisper_batch.shape[0]
+
+    # 超过当前安全上限的batch先按上限切分
+    if limit is not None and num_frames > limit.limit:
+        step = limit.limit
+        return concat_frames([
+            run_inference_with_oom_split(gpu_models, whisper_batch[i:i + step], latent_batch[i:i + step],
+                                         timesteps, limit, device, infer_fn)
+            for i in range(0, num_frames, step)
+        ])
+
+    try:
+        frames = run_bucketed_inference(gpu_models, whisper_batch, latent_batch, timesteps, infer_fn=infer_fn)
+    except Exception as e:
+        if not _is_oom(e):
+            raise
+        _release_memory(device)
+        if limit is not None:
+            limit.record_oom(num_frames)
+        if num_frames <= 1:
+            raise
+        half = (num_frames + 1) // 2
+        print(f"⚠️ {device} batch={num_frames} 显存不足，拆分为 {half}+{num_frames - half} 重试")
+        return concat_frames([
+            run_inference_with_oom_split(gpu_models, whisper_batch[:half], latent_batch[:half],
+                                         timesteps, limit, device, infer_fn),
+            run_inference_with_oom_split(gpu_models, whisper_batch[half:], latent_batch[half:],
+                                         timesteps, limit, device, infer_fn),
+        ])
+
+    if limit is not None:
+        limit.record_success()
+    return frames
+
+
+# ===== 自检（CPU + 替身模型 + 故障注入） =====
+
+class _FaultyUNetModel(torch.nn.Module):
+    """故障注入: batch超过阈值时抛出CUDA OOM"""
+
+    def __init__(self, model: torch.nn.Module, threshold: int):
+        super().__init__()
+        self.model = model
+        self.threshold = threshold
+        self.injected = 0
+
+    def forward(self, latent, *args, **kwargs):
+        if latent.shape[0] > self.threshold:
+            self.injected += 1
+            raise torch.cuda.OutOfMemoryError(f"CUDA out of memory (模拟, batch={latent.shape[0]})")
+        return self.model(latent, *args, **kwargs)
+
+
+def benchmark_oom_recovery():
+    """故障注入: 替身UNet在batch超过阈值时抛出OOM，验证拆分重试后帧数完整、结果一致、上限调整正确"""
+    import numpy as np
+    from core.standin_models import build_standin_models, synthetic_batch
+
+    print("🧪 测试OOM自动拆分重试（CPU替身模型 + 故障注入）...")
+    gpu_models = build_standin_models('cpu')
+    reference_unet = gpu_models['unet'].model
+    faulty_unet = _FaultyUNetModel(reference_unet, threshold=4)
+    timesteps = torch.tensor([0], dtype=torch.long)
+
+    def run_reference(whisper_batch, latent_batch):
+        gpu_models['unet'].model = reference_unet
+        try:
+            return run_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+        finally:
+            gpu_models['unet'].model = faulty_unet
+
+    gpu_models['unet'].model = faulty_unet
+    limit = AdaptiveBatchLimit(ceiling=16, recover_after=1000)
+    for num_frames in (16, 13, 7, 3, 9, 25):
+        whisper_batch, latent_batch = synthetic_batch(num_frames)
+        expected = run_reference(whisper_batch, latent_batch)
+        actual = run_inference_with_oom_split(gpu_models, whisper_batch, latent_batch, timesteps, limit, 'cpu')
+        assert len(actual) == num_frames, f"帧数不完整: {len(actual)}/{num_frames}"
+        assert int(np.abs(actual.astype(int) - expected.astype(int)).max()) <= 1
+        print(f"  batch={num_frames:2d}: 输出 {len(actual)} 帧 ✅, 上限 {limit.snapshot()}")
+
+    assert limit.snapshot()['limit'] <= faulty_unet.threshold
+    print(f"注入OOM次数: {faulty_unet.injected}")
+
+    # 显存恢复后，连续成功应让上限逐级回升到ceiling
+    faulty_unet.threshold = 16
+    limit.recover_after = 3
+    for _ in range(12):
+        run_inference_with_oom_split(gpu_models, *synthetic_batch(16), timesteps, limit, 'cpu')
+    assert limit.snapshot()['limit'] == 16, limit.snapshot()
+    print(f"恢复后上限: {limit.snapshot()}")
+
+    # 单帧仍然OOM时必须抛出，而不是静默丢帧
+    faulty_unet.threshold = 0
+    try:
+        run_inference_with_oom_split(gpu_models, *synthetic_batch(2), timesteps, limit, 'cpu')
+        raise AssertionError("单帧OOM应抛出异常")
+    except torch.cuda.OutOfMemoryError:
+        print("单帧OOM正确抛出异常 ✅")
+
+
+if __name__ == "__main__":
+    benchmark_oom_recovery()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+模板预处理工作池 - 每个设备常驻一个已初始化的预处理器（模型只加载一次），
+socket和HTTP接口提交的预处理任务进入同一个优先级队列，多个模板并行处理；
+任务状态/进度可查询，同一模板的任务串行执行（不会同时写同一个模板目录）
+
+配置（环境变量）:
+    MUSE_PREPROCESS_DEVICES=            预处理设备，逗号分隔（默认: 所有GPU，没有GPU时为cpu）
+    MUSE_PREPROCESS_WORKERS_PER_DEVICE=1  每个设备的工作线程数（每个线程一个预处理器）
+"""
+
+import os
+import sys
+import time
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+MAX_FINISHED_JOBS = 500  # 保留的已结束任务数（超出后丢弃最早的）
+
+# 进度阶段及其在总进度中的区间
+PROGRESS_PHASES = {'decode': (0.0, 0.4), 'encode': (0.4, 0.95)}
+
+
+def get_preprocess_devices() -> List[str]:
+    """预处理设备列表"""
+    configured = os.environ.get('MUSE_PREPROCESS_DEVICES', '').strip()
+    if configured:
+        return [device.strip() for device in configured.split(',') if device.strip()]
+    import torch
+    if torch.cuda.is_available():
+        return [f'cuda:{i}' for i in range(torch.cuda.device_count())]
+    return ['cpu']
+
+
+def get_workers_per_device() -> int:
+    """每个设备的工作线程数"""
+    return max(1, int(os.environ.get('MUSE_PREPROCESS_WORKERS_PER_DEVICE', '1')))
+
+
+def default_preprocessor_factory(device: str):
+    """按设备创建预处理器（模型在第一个需要模型的任务中加载，之后常驻）"""
+    from core.preprocessing import OptimizedPreprocessor
+    preprocessor = OptimizedPreprocessor()
+    preprocessor.device = device
+    return preprocessor
+
+
+class PreprocessJob:
+    """一个模板预处理任务"""
+
+    def __init__(self, job_id: str, template_id: str, template_path: str, output_dir: str,
+                 bbox_shift: int = 0, priority: int = PRIORITY_NORMAL,
+                 on_success: Optional[Callable[['PreprocessJob'], None]] = None):
+        self.job_id = job_id
+        self.template_id = template_id
+        self.template_path = template_path
+        self.output_dir = output_dir
+        self.bbox_shift = bbox_shift
+        self.priority = priority
+        self.on_success = on_success
+        self.status = JOB_QUEUED
+        self.phase = None
+        self.frames_done = 0
+        self.frames_total = 0
+        self.progress = 0.0
+        self.device = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    @property
+    def success(self) -> bool:
+        return self.status == JOB_COMPLETED
+
+    def update_progress(self, phase: str, done: int, total: int):
+        """预处理进度回调"""
+        start, end = PROGRESS_PHASES.get(phase, (0.0, 0.95))
+        self.phase = phase
+        self.frames_done = done
+        self.frames_total = total
+        self.progress = round(start + (end - start) * min(1.0, done / max(total, 1)), 3)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待任务结束，返回是否成功（超时返回False）"""
+        return self._done.wait(timeout) and self.success
+
+    def snapshot(self) -> Dict:
+        """任务状态快照（供 /api/preprocess_jobs 和 socket preprocess_status 查询）"""
+        now = time.time()
+        return {
+            'job_id': self.job_id,
+            'template_id': self.template_id,
+            'template_path': self.template_path,
+            'bbox_shift': self.bbox_shift,
+            'priority': self.priority,
+            'status': self.status,
+            'phase': self.phase,
+            'progress': self.progress,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'device': self.device,
+            'error': self.error,
+            'queued_seconds': round((self.started_at or now) - self.submitted_at, 3),
+            'run_seconds': round((self.finished_at or now) - self.started_at, 3) if self.started_at else 0.0,
+        }
+
+
+class PreprocessWorkerPool:
+    """预处理工作池: 每个工作线程绑定一个设备和一个常驻预处理器，从优先级队列取任务"""
+
+    def __init__(self, devices: Optional[List[str]] = None, workers_per_device: Optional[int] = None,
+                 preprocessor_factory: Callable[[str], object] = default_preprocessor_factory):
+        self.devices = devices or get_preprocess_devices()
+        self.workers_per_device = workers_per_device or get_workers_per_device()
+        self.preprocessor_factory = preprocessor_factory
+        self.task_queue = queue.PriorityQueue()
+        self.jobs = OrderedDict()  # job_id -> PreprocessJob（按提交顺序）
+        self.active_jobs = {}  # template_id -> 排队/运行中的任务
+        self.running_templates = set()  # 正在预处理的模板（同一模板串行）
+        self.deferred_jobs = {}  # template_id -> 等该模板当前任务结束后重新入队的任务（不占用工作线程）
+        self.preprocessors = {}  # 工作线程名 -> 预处理器
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._job_ids = itertools.count(1)
+
+        self.threads = []
+        for device in self.devices:
+            for index in range(self.workers_per_device):
+                thread = threading.Thread(target=self._worker_loop, args=(device,),
+                                          name=f'preprocess-{device}-{index}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        print(f"✅ 预处理工作池已启动: {len(self.threads)}个工作线程 ({', '.join(self.devices)})")
+
+    def submit(self, template_id: str, template_path: str, output_dir: str, bbox_shift: int = 0,
+               priority: int = PRIORITY_NORMAL, on_success=None) -> PreprocessJob:
+        """提交预处理任务（priority越小越先执行）；同一模板相同参数的任务还在排队/运行时返回该任务"""
+        with self._lock:
+            active = self.active_jobs.get(template_id)
+            if (active is not None and not active.is_finished and active.template_path == template_path
+                    and active.bbox_shift == bbox_shift and active.output_dir == output_dir):
+                print(f"📋 模板 {template_id} 已有相同的预处理任务: {active.job_id} ({active.status})")
+                return active
+            job = PreprocessJob(f"pre-{next(self._job_ids):06d}", template_id, template_path, output_dir,
+                                bbox_shift, priority, on_success)
+            self.jobs[job.job_id] = job
+            self.active_jobs[template_id] = job
+            self._trim_finished_jobs()
+        self.task_queue.put((priority, next(self._sequence), job))
+        print(f"📥 预处理任务入队: {job.job_id} 模板 {template_id} (priority={priority}, 排队 {self.task_queue.qsize()})")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[PreprocessJob]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.snapshot() for job in jobs if status is None or job.status == status]
+
+    def stats(self) -> Dict:
+        """队列和工作线程概况"""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED)}
+        for job in jobs:
+            counts[job.status] += 1
+        return {
+            'devices': self.devices,
+            'workers': len(self.threads),
+            'initialized_workers': sum(1 for p in self.preprocessors.values() if getattr(p, 'is_initialized', False)),
+            'jobs': counts,
+        }
+
+    def shutdown(self):
+        """停止所有工作线程（已排队的任务先执行完）"""
+        for _ in self.threads:
+            self.task_queue.put((float('inf'), next(self._sequence), None))
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def _trim_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _claim_template(self, job: PreprocessJob) -> bool:
+        """同一模板已有任务在运行时把该任务暂存，当前任务结束后再入队，工作线程继续取其他模板"""
+        with self._lock:
+            if job.template_id in self.running_templates:
+                self.deferred_jobs.setdefault(job.template_id, []).append(job)
+                return False
+            self.running_templates.add(job.template_id)
+            return True
+
+    def _release_template(self, template_id: str):
+        with self._lock:
+            self.running_templates.discard(template_id)
+            deferred = self.deferred_jobs.pop(template_id, [])
+        for job in deferred:
+            self.task_queue.put((job.priority, next(self._sequence), job))
+
+    def _worker_loop(self, device: str):
+        name = threading.current_thread().name
+        preprocessor = None
+        while True:
+            _, _, job = self.task_queue.get()
+            if job is None:
+                break
+            if not self._claim_template(job):
+                continue
+            try:
+                if preprocessor is None:
+                    preprocessor = self.preprocessor_factory(device)
+                    self.preprocessors[name] = preprocessor
+                self._run_job(job, device, preprocessor)
+            except Exception as e:
+                # 预处理器创建失败等: 任务标记为失败，否则同模板的重新提交会一直去重到这个任务上
+                print(f"预处理工作线程 {name} 错误: {e}")
+                if not job.is_finished:
+                    job.error = str(e)
+                    self._finish_job(job, device, False)
+            finally:
+                self._release_template(job.template_id)
+
+    def _run_job(self, job: PreprocessJob, device: str, preprocessor):
+        job.status = JOB_RUNNING
+        job.device = device
+        job.started_at = time.time()
+        print(f"🔄 [{device}] 开始预处理 {job.job_id}: {job.template_id}")
+        try:
+            success = preprocessor.preprocess_template_ultra_fast(
+                template_path=job.template_path,
+                output_dir=job.output_dir,
+                template_id=job.template_id,
+                bbox_shift=job.bbox_shift,
+                progress_fn=job.update_progress
+            )
+            if success and job.on_success is not None:
+                job.on_success(job)
+            if not success:
+                job.error = '模板预处理失败'
+        except Exception as e:
+            success = False
+            job.error = str(e)
+
+        self._finish_job(job, device, success)
+
+    def _finish_job(self, job: PreprocessJob, device: str, success: bool):
+        job.progress = 1.0 if success else job.progress
+        job.status = JOB_COMPLETED if success else JOB_FAILED
+        job.finished_at = time.time()
+        with self._lock:
+            if self.active_jobs.get(job.template_id) is job:
+                del self.active_jobs[job.template_id]
+        job._done.set()
+        print(f"{'✅' if success else '❌'} [{device}] 预处理{'完成' if success else '失败'} {job.job_id}: "
+              f"{job.template_id} ({job.finished_at - (job.started_at or job.finished_at):.2f}秒)")
+
+
+# 全局工作池实例
+_preprocess_pool: Optional[PreprocessWorkerPool] = None
+_preprocess_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool() -> PreprocessWorkerPool:
+    """获取预处理工作池实例（第一次调用时启动工作线程）"""
+    global _preprocess_pool
+    if _preprocess_pool is None:
+        with _preprocess_pool_lock:
+            if _preprocess_pool is None:
+                _preprocess_pool = PreprocessWorkerPool()
+    return _preprocess_pool
+
+
+# ===== 性能测试（合成图片模板 + CPU替身模型） =====
+
+def benchmark_preprocess_pool(num_templates: int = 8, frames_per_template: int = 8, size: int = 512):
+    """批量预处理: 1个和2个工作线程的吞吐、模型只初始化一次、优先级和同模板去重"""
+    import tempfile
+    import cv2
+    import numpy as np
+    from core.preprocessing import OptimizedPreprocessor
+
+    print(f"🧪 测试预处理工作池（{num_templates}个模板 × {frames_per_template}帧 {size}x{size}，CPU替身模型）...")
+    init_counts = []
+
+    def standin_factory(device):
+        preprocessor = OptimizedPreprocessor()
+        preprocessor.initialize_standin_models(device)
+        init_counts.append(device)
+        return preprocessor
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rng = np.random.default_rng(0)
+        template_dirs = []
+        for t in range(num_templates):
+            template_dir = os.path.join(tmp_dir, 'src', f'avatar_{t:03d}')
+            os.makedirs(template_dir)
+            for i in range(frames_per_template):
+                cv2.imwrite(os.path.join(template_dir, f'{i:04d}.png'),
+                            rng.integers(0, 255, (size, size, 3), dtype=np.uint8))
+            template_dirs.append(template_dir)
+
+        results = {}
+        for workers in (1, 2):
+            init_counts.clear()
+            pool = PreprocessWorkerPool(['cpu'], workers, standin_factory)
+            output_dir = os.path.join(tmp_dir, f'cache_{workers}')
+            start = time.perf_counter()
+            jobs = [pool.submit(os.path.basename(d), d, output_dir) for d in template_dirs]
+            assert all(job.wait(120) for job in jobs), [job.snapshot() for job in jobs if not job.success]
+            results[workers] = time.perf_counter() - start
+            assert len(init_counts) == workers, init_counts  # 每个工作线程只初始化一次
+            pool.shutdown()
+
+        # 优先级: 唯一的工作线程忙于第一个任务时，后提交的高优先级任务先于排队的普通任务执行
+        pool = PreprocessWorkerPool(['cpu'], 1, standin_factory)
+        output_dir = os.path.join(tmp_dir, 'cache_priority')
+        jobs = [pool.submit(os.path.basename(d), d, output_dir) for d in template_dirs[:4]]
+        urgent = pool.submit('urgent', template_dirs[4], output_dir, priority=PRIORITY_HIGH)
+        duplicate = pool.submit('urgent', template_dirs[4], output_dir, priority=PRIORITY_HIGH)
+        assert duplicate is urgent
+        assert all(job.wait(120) for job in jobs + [urgent])
+        order = sorted(jobs + [urgent], key=lambda job: job.started_at)
+        assert order.index(urgent) <= 1, [job.template_id for job in order]
+        assert urgent.snapshot()['progress'] == 1.0
+        pool.shutdown()
+
+    frames = num_templates * frames_per_template
+    for workers, elapsed in results.items():
+        print(f"  {workers}个工作线程: {elapsed:.2f}秒, {num_templates / elapsed:.2f} 模板/秒, {frames / elapsed:.1f} 帧/秒")
+    print(f"  每个工作线程只初始化一次模型，高优先级任务插队，同模板任务去重 ✅"
+          f"（本机 {os.cpu_count()} 个CPU，多线程加速取决于设备数）")
+
+
+if __name__ == "__main__":
+    benchmark_preprocess_pool()
@@ -14,11 +14,7 @@ import cv2
 import numpy as np
 import argparse
 import time
-from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
 import copy
-from tqdm import tqdm
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -26,23 +22,22 @@ warnings.filterwarnings("ignore")
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'MuseTalk'))
 sys.path.append('/opt/musetalk/repo/MuseTalk')  # 添加实际的MuseTalk路径
 
-try:
-    from musetalk.utils.face_parsing import FaceParsing
-    print("成功导入FaceParsing")
-    FACE_PARSING_AVAILABLE = True
-except ImportError as e:
-    print(f"无法导入FaceParsing: {e}")
-    FACE_PARSING_AVAILABLE = False
-
-from musetalk.utils.utils import load_all_model
-from musetalk.utils.preprocessing import get_landmark_and_bbox, read_imgs
-from musetalk.utils.blending import get_image_prepare_material
-from musetalk.utils.audio_processor import AudioProcessor
-
 # 定义coord_placeholder常量
 coord_placeholder = (0, 0, 0, 0)  # 表示无效的边界框
+REDETECT = 'redetect'  # 关键点全是0，需要face_alignment重新检测
+
+# 注意：musetalk.* 在初始化模型/预处理时才导入，模块导入不加载模型代码
 
-print("Optimized Preprocessing V2 - 极速预处理引擎")
+
+def _import_face_parsing():
+    """延迟导入FaceParsing，不可用时返回None"""
+    try:
+        from musetalk.utils.face_parsing import FaceParsing
+        print("成功导入FaceParsing")
+        return FaceParsing
+    except ImportError as e:
+        print(f"无法导入FaceParsing: {e}")
+        return None
 
 # 简单的FaceParsing替代实现
 class SimpleFaceParsing:
@@ -94,15 +89,30 @@ class SimpleFaceParsing:
     def parse(self, image):
         """兼容parse方法"""
         return self.__call__(image)
+    
+    def parse_batch(self, images):
+        """批量解析（同尺寸图像的mask相同，只计算一次）"""
+        cache = {}
+        masks = []
+        for image in images:
+            shape = image.shape[:2]
+            if shape not in cache:
+                cache[shape] = self.__call__(image)
+            masks.append(cache[shape])
+        return masks
 
 class OptimizedPreprocessor:
     """优化的预处理器 - 修复阴影问题，极速处理"""
     
     def __init__(self):
+        from core.template_stages import MUSETALK_MODEL_SIGNATURE
         self.vae = None
         self.unet = None
         self.pe = None
         self.fp = None
+        self.landmark_fn = None  # 自定义人脸检测 landmark_fn(frames) -> 人脸框列表（替身模型测试用）
+        self.face_encoder = None
+        self.model_signature = MUSETALK_MODEL_SIGNATURE  # 参与阶段哈希（换模型时检测/解析/编码阶段重算）
         self.device = None
         self.weight_dtype = torch.float16
         self.is_initialized = False
@@ -119,8 +129,10 @@ class OptimizedPreprocessor:
             return True
             
         try:
+            print("Optimized Preprocessing V2 - 极速预处理引擎")
             print(f"初始化预处理模型 - 设备: {device}")
             self.device = device
+            from musetalk.utils.utils import load_all_model
             
             # 加载模型 - 添加错误处理
             try:
@@ -162,7 +174,8 @@ class OptimizedPreprocessor:
                 self.pe = pe
             
             # 初始化面部解析 - 优先使用真正的FaceParsing
-            if FACE_PARSING_AVAILABLE:
+            FaceParsing = _import_face_parsing()
+            if FaceParsing is not None:
                 try:
                     self.fp = FaceParsing()
                     print("使用MuseTalk原生FaceParsing")
@@ -294,405 +307,376 @@ class OptimizedPreprocessor:
         except:
             return image
     
-    def preprocess_template_ultra_fast(self, template_path, output_dir, template_id):
-        """极速预处理模板 - 修复阴影问题，优化性能"""
+    def initialize_standin_models(self, device='cpu'):
+        """使用替身模型（CPU测试/性能测试，不需要MuseTalk权重）"""
+        from core.standin_models import build_standin_models, standin_face_boxes
+        models = build_standin_models(device)
+        self.vae, self.unet, self.pe = models['vae'], models['unet'], models['pe']
+        self.fp = SimpleFaceParsing()
+        self.landmark_fn = standin_face_boxes
+        self.model_signature = 'standin'
+        self.device = device
+        self.weight_dtype = torch.float32
+        self.is_initialized = True
+        return True
+    
+    def detect_face_boxes(self, frames):
+        """一块帧的人脸框 [x1,y1,x2,y2]（检测失败的帧为None）
+        
+        检测结果按帧内容哈希缓存（core/landmark_service.py），同一个源重新预处理时不再检测
+        （替身检测函数 landmark_fn 不缓存）；
+        未命中的帧直接以内存中的解码帧整块检测（不写临时图片，多个模板并行预处理互不干扰）
+        """
+        if self.landmark_fn is not None:
+            return self.landmark_fn(frames)
+        
+        from core.landmark_service import get_landmark_service, frame_digest, MISSING
+        digests = [frame_digest(frame) for frame in frames]
+        cache = get_landmark_service().cache(f"face_box_v2_{self.model_signature}", (4,))  # v2: 未检测到人脸的帧经过重新检测
+        boxes = cache.get_many(digests)
+        missing = [i for i, box in enumerate(boxes) if box is MISSING]
+        if missing:
+            detected, failed = self._detect_face_boxes_uncached([frames[i] for i in missing],
+                                                                [digests[i] for i in missing])
+            # 检测器异常的帧不写缓存（不能记成"没有人脸"），下次预处理时重新检测
+            cached = [j for j in range(len(missing)) if j not in failed]
+            cache.put_many([digests[missing[j]] for j in cached], [detected[j] for j in cached])
+            for i, box in zip(missing, detected):
+                boxes[i] = box
+        return [None if box is None else [int(v) for v in box] for box in boxes]
+    
+    def _detect_face_boxes_uncached(self, frames, digests):
+        """检测一组帧的人脸框，返回 (boxes, failed)；failed 为重新检测时检测器出错的帧下标"""
+        from core.landmark_service import musetalk_face_boxes
+        coord_list = musetalk_face_boxes(frames)
+        boxes = [self._face_box_from_landmarks(frame, landmarks) for frame, landmarks in zip(frames, coord_list)]
+        
+        # MuseTalk没有检测到人脸（或关键点全是0）的帧用共享的face_alignment服务整批重新检测（检测器只加载一次）
+        redetect = [i for i, box in enumerate(boxes) if box is REDETECT]
+        failed = set()
+        if redetect:
+            from core.landmark_service import get_landmark_service
+            print(f"警告: {len(redetect)}帧MuseTalk未检测到人脸，使用face_alignment重新检测...")
+            try:
+                predictions = get_landmark_service().get_landmarks([frames[i] for i in redetect],
+                                                                   [digests[i] for i in redetect])
+            except Exception as fa_error:
+                print(f"face_alignment检测失败: {fa_error}")
+                predictions = [None] * len(redetect)
+                failed.update(redetect)
+            for i, landmarks in zip(redetect, predictions):
+                boxes[i] = None if landmarks is None else self._face_box_from_points(
+                    frames[i], landmarks[:, 0], landmarks[:, 1], margin=50)
+        return boxes, failed
+    
+    def _face_box_from_landmarks(self, frame, landmarks):
+        """检测结果 -> 人脸框（边界框直接使用，关键点加边距）
+        
+        没有检测到人脸（None / coord_placeholder / 无效框）或关键点全是0时返回REDETECT，由face_alignment重新检测
+        """
+        if landmarks is None:
+            return REDETECT
+        if isinstance(landmarks, (list, tuple)) or (isinstance(landmarks, np.ndarray) and landmarks.size == 4):
+            box = [int(v) for v in np.asarray(landmarks).flatten()[:4]]
+            if len(box) != 4 or tuple(box) == coord_placeholder or box[2] <= box[0] or box[3] <= box[1]:
+                return REDETECT
+            return box
+        if not isinstance(landmarks, np.ndarray) or landmarks.shape[0] == 0:
+            print(f"警告: 关键点类型不正确: {type(landmarks)}")
+            return None
+        
+        x_coords = landmarks[:, 0]
+        y_coords = landmarks[:, 1]
+        h, w = frame.shape[:2]
+        
+        # 如果坐标全是0，交给face_alignment重新检测
+        if np.max(x_coords) == 0 and np.max(y_coords) == 0:
+            return REDETECT
+        # 如果坐标是归一化的（0-1范围），需要缩放到图像尺寸
+        elif np.max(x_coords) <= 1.0 and np.max(y_coords) <= 1.0:
+            x_coords = x_coords * w
+            y_coords = y_coords * h
+        
+        return self._face_box_from_points(frame, x_coords, y_coords, margin=30)
+    
+    def _face_box_from_points(self, frame, x_coords, y_coords, margin):
+        h, w = frame.shape[:2]
+        return [
+            max(0, int(np.min(x_coords)) - margin),
+            max(0, int(np.min(y_coords)) - margin),
+            min(w, int(np.max(x_coords)) + margin),
+            min(h, int(np.max(y_coords)) + margin),
+        ]
+    
+    def get_face_encoder(self):
+        """批量人脸编码器（裁剪/缩放/编码在预处理设备上完成）"""
+        if self.face_encoder is None or self.face_encoder.vae is not self.vae:
+            from core.face_encoder import BatchedFaceEncoder
+            self.face_encoder = BatchedFaceEncoder(self.vae, self.device or 'cpu')
+        return self.face_encoder
+    
+    def parse_faces(self, crops):
+        """一块人脸裁剪图的面部解析mask（解析器支持parse_batch时整块调用一次）"""
+        if self.fp is not None and hasattr(self.fp, 'parse_batch'):
+            return self.fp.parse_batch(crops)
+        return [self._parse_face(crop) for crop in crops]
+    
+    def _parse_face(self, image):
+        """单张图像的面部解析，失败时返回全白mask"""
+        default_mask = np.ones(image.shape[:2], dtype=np.uint8) * 255
+        try:
+            if self.fp is not None and hasattr(self.fp, '__call__'):
+                try:
+                    result = self.fp(image)
+                except (TypeError, ValueError) as te:
+                    print(f"面部解析调用错误（已处理）: {te}")
+                    return default_mask
+                if isinstance(result, tuple) and len(result) > 0:
+                    result = result[0]
+                if isinstance(result, np.ndarray):
+                    return result
+                if hasattr(result, 'convert'):  # PIL图像
+                    return np.array(result)
+                print(f"面部解析返回未知类型: {type(result)}")
+                return default_mask
+            elif self.fp is not None and hasattr(self.fp, 'parse'):
+                return self.fp.parse(image)
+            elif self.fp is not None and hasattr(self.fp, 'predict'):
+                return self.fp.predict(image)
+            print("面部解析失败: FaceParsing对象没有可用的解析方法")
+            return default_mask
+        except Exception as e:
+            print(f"面部解析出错: {e}")
+            return default_mask
+    
+    def preprocess_template_ultra_fast(self, template_path, output_dir, template_id, bbox_shift=0, progress_fn=None):
+        """极速预处理模板 - 支持图片和视频模板
+        
+        分阶段缓存（core/template_stages.py）: 解码 -> 人脸检测 -> 面部解析 -> VAE编码 -> 融合几何，
+        哈希不变的阶段直接复用，全部复用时不加载模型；
+        视频按块流式处理，每块帧批量检测、解析和编码（core/face_encoder.py），
+        模板帧按块写入 .npy 文件（推理时mmap挂载），融合mask裁剪到crop_box后RLE压缩
+        （core/template_masks.py），内存占用与视频时长无关
+        
+        Args:
+            bbox_shift: 人脸框上边界偏移（与MuseTalk的bbox_shift含义相同）
+            progress_fn: 进度回调 progress_fn(phase, done, total)，phase为 'decode'（解码/检测）或 'encode'（解析/编码/融合）
+        """
+        writers = []
         try:
             start_time = time.time()  # 添加start_time定义
-            print(f"开始极速预处理: {template_id}")
-            
-            # 确保模型已初始化
-            if not self.is_initialized:
-                print("模型未初始化，开始初始化...")
-                if not self.initialize_models():
-                    raise RuntimeError("模型初始化失败")
-            
-            # 再次检查VAE是否存在
-            if self.vae is None:
-                print("VAE未加载，尝试重新加载模型...")
-                from musetalk.utils.utils import load_all_model
-                vae, unet, pe = load_all_model()
-                self.vae = vae
-                self.unet = unet
-                self.pe = pe
-                print("模型重新加载完成")
+            print(f"开始极速预处理: {template_id} (bbox_shift={bbox_shift})")
             
             # 创建输出目录
             template_output_dir = os.path.join(output_dir, template_id)
             os.makedirs(template_output_dir, exist_ok=True)
             print(f"使用缓存目录: {template_output_dir}")
             
-            # 1. 并行读取和处理图像
-            print("读取模板图像...")
-            
-            # 检查是否是直接的图像文件路径
-            template_path_obj = Path(template_path)
-            if template_path_obj.is_file() and template_path_obj.suffix.lower() in ['.jpg', '.jpeg', '.png', '.bmp']:
-                input_image_path = str(template_path_obj)
-                print(f"使用直接图像文件: {input_image_path}")
-            else:
-                # 在目录中搜索图像文件
-                image_files = []
-                for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-                    image_files.extend(template_path_obj.glob(ext))
+            # 1. 模板帧源（单张图片 / 图片序列 / 视频）和各阶段哈希
+            from core.template_frames import (TemplateSource, FrameArrayWriter, iter_array_chunks, iter_frame_chunks,
+                                              get_chunk_size, peak_rss_mb)
+            from core.template_stages import (STAGES, MODEL_STAGES, NO_FACE_BOX, StageManifest,
+                                              compute_stage_hashes, resolve_face_boxes, source_digest)
+            from core.template_masks import PackedMaskWriter, crop_masks
+            from core.encoded_frames import EncodedFrameWriter, get_frame_storage
+            frame_storage = get_frame_storage()
+            source = TemplateSource(template_path)
+            estimated_frames = source.estimate_frame_count()
+            chunk_size = get_chunk_size()
+            print(f"模板源: {source.kind} {source.files[0]}{' 等' + str(len(source.files)) + '张' if len(source.files) > 1 else ''}, "
+                  f"约{estimated_frames}帧, 每块{chunk_size}帧, 帧存储: {frame_storage}")
+            
+            manifest = StageManifest(template_output_dir, template_id, frame_storage)
+            stage_info = compute_stage_hashes(source_digest(source), self.model_signature, bbox_shift)
+            reused = [stage for stage in STAGES if manifest.is_valid(stage, stage_info[stage]['hash'])]
+            pending = [stage for stage in STAGES if stage not in reused]
+            print(f"复用阶段: {', '.join(reused) or '无'}; 重新计算: {', '.join(pending) or '无'}")
+            for stage in pending:
+                manifest.invalidate(stage)
+            
+            # 只有需要重算的阶段用到模型时才加载
+            if any(stage in MODEL_STAGES for stage in pending):
+                if not self.is_initialized:
+                    print("模型未初始化，开始初始化...")
+                    if not self.initialize_models(self.device or 'cuda:0'):
+                        raise RuntimeError("模型初始化失败")
                 
-                if not image_files:
-                    raise ValueError(f"未找到图像文件: {template_path}")
+                # 再次检查VAE是否存在
+                if self.vae is None:
+                    print("VAE未加载，尝试重新加载模型...")
+                    from musetalk.utils.utils import load_all_model
+                    vae, unet, pe = load_all_model()
+                    self.vae = vae
+                    self.unet = unet
+                    self.pe = pe
+                    print("模型重新加载完成")
+            
+            timings = {stage: 0.0 for stage in STAGES}
+            
+            def open_writer(stage, index=0, writer_cls=FrameArrayWriter):
+                writer = writer_cls(manifest.stage_path(stage, index))
+                writers.append(writer)
+                return writer
+            
+            # 2. 第一遍: 解码 + 人脸检测（帧从源文件或已缓存的帧数组按块读取）
+            if 'decode' in pending or 'landmarks' in pending:
+                frame_writer_cls = (FrameArrayWriter if frame_storage == 'npy'
+                                    else lambda path: EncodedFrameWriter(path, frame_storage))
+                frame_writer = open_writer('decode', 0, frame_writer_cls) if 'decode' in pending else None
+                landmark_writer = open_writer('landmarks') if 'landmarks' in pending else None
+                chunks = (source.iter_chunks(chunk_size) if frame_writer is not None
+                          else iter_frame_chunks(manifest.stage_path('decode'), chunk_size))
+                processed = 0
                 
-                # 选择最佳图像（通常是第一张）
-                input_image_path = str(image_files[0])
-                print(f"使用目录中的图像: {input_image_path}")
-            
-            # 🎨 2. 图像预处理和阴影修复
-            print("🎨 图像预处理...")
-            image = cv2.imread(input_image_path)
-            if image is None:
-                raise ValueError(f"无法读取图像: {input_image_path}")
-            
-            # 跳过阴影修复，保持原始颜色
-            # image = self.fix_face_shadows(image)
-            print("保持原始颜色，跳过阴影修复")
-            
-            # 3. 面部检测和关键点提取
-            print("👤 面部检测和关键点提取...")
-            # 保存临时图像文件给get_landmark_and_bbox使用
-            temp_image_path = os.path.join(output_dir, "temp_image.jpg")
-            cv2.imwrite(temp_image_path, image)
-            
-            # 调试：检查图像是否正确保存
-            if os.path.exists(temp_image_path):
-                img_check = cv2.imread(temp_image_path)
-                print(f"临时图像: {img_check.shape if img_check is not None else 'None'}")
-            
-            coord_list, frame_list = get_landmark_and_bbox([temp_image_path])
-            
-            # 调试：打印返回值
-            print(f"coord_list长度: {len(coord_list) if coord_list else 0}")
-            print(f"frame_list长度: {len(frame_list) if frame_list else 0}")
-            if coord_list and len(coord_list) > 0:
-                print(f"第一个coord类型: {type(coord_list[0])}")
-                if hasattr(coord_list[0], 'shape'):
-                    print(f"第一个coord shape: {coord_list[0].shape}")
-                # 打印实际的值看看
-                if isinstance(coord_list[0], np.ndarray):
-                    print(f"前5个关键点: {coord_list[0][:5]}")
-                    print(f"非零值数量: {np.count_nonzero(coord_list[0])}")
-            
-            # 清理临时文件
-            if os.path.exists(temp_image_path):
-                os.remove(temp_image_path)
-            
-            if not coord_list or not frame_list:
-                raise ValueError("面部检测失败")
-            
-            # 4. 面部解析和特征提取
-            print("🎭 面部解析和特征提取...")
-            mask_coords_list, mask_list = [], []
-            face_parsing_masks = []  # 存储面部解析的mask
-            
-            # 使用coord_list作为bbox_list（从get_landmark_and_bbox返回的）
-            for i, (frame, landmarks) in enumerate(zip(frame_list, coord_list)):
-                if landmarks is None:
-                    print(f"警告: 第{i}帧没有检测到人脸")
-                    continue
+                step_start = time.time()
+                for chunk in chunks:
+                    if frame_writer is not None:
+                        frame_writer.write(chunk)
+                    timings['decode'] += time.time() - step_start
                     
-                # coord_list返回的是关键点坐标，不是边界框
-                # 需要从关键点计算边界框
-                if isinstance(landmarks, np.ndarray):
-                    print(f"关键点数据: shape={landmarks.shape}, dtype={landmarks.dtype}")
-                    if landmarks.shape[0] > 0:
-                        # 计算边界框 (x_min, y_min, x_max, y_max)
-                        x_coords = landmarks[:, 0]
-                        y_coords = landmarks[:, 1]
-                        
-                        # 检查坐标范围
-                        print(f"X坐标范围: {np.min(x_coords):.2f} - {np.max(x_coords):.2f}")
-                        print(f"Y坐标范围: {np.min(y_coords):.2f} - {np.max(y_coords):.2f}")
-                        
-                        # 如果坐标全是0，使用整个图像作为人脸区域
-                        if np.max(x_coords) == 0 and np.max(y_coords) == 0:
-                            print("警告: 关键点全是0，尝试使用face_alignment重新检测...")
-                            
-                            # 尝试使用face_alignment直接检测
-                            try:
-                                from face_alignment import FaceAlignment, LandmarksType
-                                fa = FaceAlignment(LandmarksType.TWO_D, flip_input=False, device='cuda')
-                                preds = fa.get_landmarks(frame)
-                                
-                                if preds and len(preds) > 0:
-                                    landmarks_new = preds[0]  # 第一个人脸
-                                    x_coords = landmarks_new[:, 0]
-                                    y_coords = landmarks_new[:, 1]
-                                    print(f"face_alignment检测成功: X范围 {np.min(x_coords):.0f}-{np.max(x_coords):.0f}, Y范围 {np.min(y_coords):.0f}-{np.max(y_coords):.0f}")
-                                    
-                                    x_min = int(np.min(x_coords))
-                                    y_min = int(np.min(y_coords))
-                                    x_max = int(np.max(x_coords))
-                                    y_max = int(np.max(y_coords))
-                                    
-                                    # 添加边距
-                                    margin = 50
-                                    x_min = max(0, x_min - margin)
-                                    y_min = max(0, y_min - margin)
-                                    x_max = min(frame.shape[1], x_max + margin)
-                                    y_max = min(frame.shape[0], y_max + margin)
-                                    
-                                    face_box = [x_min, y_min, x_max, y_max]
-                                    print(f"重新检测的边界框: {face_box}")
-                                else:
-                                    raise Exception("face_alignment未检测到人脸")
-                                    
-                            except Exception as fa_error:
-                                print(f"face_alignment检测失败: {fa_error}")
-                                # 使用默认值
-                                h, w = frame.shape[:2]
-                                margin = min(w, h) // 8
-                                x_min = margin
-                                y_min = margin
-                                x_max = w - margin
-                                y_max = h - margin
-                                face_box = [x_min, y_min, x_max, y_max]
-                                print(f"使用默认边界框: {face_box}")
-                        # 如果坐标是归一化的（0-1范围），需要缩放到图像尺寸
-                        elif np.max(x_coords) <= 1.0 and np.max(y_coords) <= 1.0:
-                            h, w = frame.shape[:2]
-                            x_coords = x_coords * w
-                            y_coords = y_coords * h
-                            print(f"检测到归一化坐标，缩放到图像尺寸: {w}x{h}")
-                            
-                            x_min = int(np.min(x_coords))
-                            y_min = int(np.min(y_coords))
-                            x_max = int(np.max(x_coords))
-                            y_max = int(np.max(y_coords))
-                            
-                            # 添加一些边距
-                            margin = 30
-                            x_min = max(0, x_min - margin)
-                            y_min = max(0, y_min - margin)
-                            x_max = min(frame.shape[1], x_max + margin)
-                            y_max = min(frame.shape[0], y_max + margin)
-                            
-                            face_box = [x_min, y_min, x_max, y_max]
-                        else:
-                            # 正常坐标
-                            x_min = int(np.min(x_coords))
-                            y_min = int(np.min(y_coords))
-                            x_max = int(np.max(x_coords))
-                            y_max = int(np.max(y_coords))
-                            
-                            # 添加一些边距
-                            margin = 30
-                            x_min = max(0, x_min - margin)
-                            y_min = max(0, y_min - margin)
-                            x_max = min(frame.shape[1], x_max + margin)
-                            y_max = min(frame.shape[0], y_max + margin)
-                            
-                            face_box = [x_min, y_min, x_max, y_max]
-                        
-                        print(f"计算的边界框: {face_box}")
-                    else:
-                        print(f"警告: 关键点为空")
-                        continue
-                else:
-                    print(f"警告: 关键点类型不正确: {type(landmarks)}")
-                    continue
-                
-                # 面部解析 - 使用正确的方法调用
-                try:
-                    # 尝试常见的面部解析方法
-                    if self.fp is not None and hasattr(self.fp, '__call__'):
-                        try:
-                            result = self.fp(frame)
-                            # 检查返回值类型并正确处理
-                            if result is None:
-                                print("面部解析返回None，使用默认mask")
-                                mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                            elif isinstance(result, tuple) and len(result) > 0:
-                                mask_out = result[0] if isinstance(result[0], np.ndarray) else np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                            elif isinstance(result, np.ndarray):
-                                mask_out = result
-                            elif isinstance(result, (int, float)):
-                                # 如果返回数字，创建默认mask
-                                print(f"面部解析返回数字: {result}")
-                                mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                            else:
-                                print(f"面部解析返回未知类型: {type(result)}")
-                                mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                        except (TypeError, ValueError) as te:
-                            print(f"面部解析调用错误（已处理）: {te}")
-                            mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                    elif self.fp is not None and hasattr(self.fp, 'parse'):
-                        mask_out = self.fp.parse(frame)
-                    elif self.fp is not None and hasattr(self.fp, 'predict'):
-                        mask_out = self.fp.predict(frame)
-                    else:
-                        print("面部解析失败: FaceParsing对象没有可用的解析方法")
-                        # 使用默认mask（全白，表示整个面部区域）
-                        mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                except Exception as e:
-                    print(f"面部解析出错: {e}")
-                    # 使用默认mask
-                    mask_out = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-                
-                # 保存面部解析的mask
-                face_parsing_masks.append(mask_out)
+                    step_start = time.time()
+                    if landmark_writer is not None:
+                        face_boxes = self.detect_face_boxes(chunk)
+                        landmark_writer.write([np.asarray(box if box is not None else NO_FACE_BOX, dtype=np.int32)
+                                               for box in face_boxes])
+                    timings['landmarks'] += time.time() - step_start
+                    
+                    processed += len(chunk)
+                    print(f"  [解码/检测] {processed}/{estimated_frames} 帧 "
+                          f"({processed / (time.time() - start_time):.1f} 帧/秒)")
+                    if progress_fn is not None:
+                        progress_fn('decode', processed, max(processed, estimated_frames))
+                    step_start = time.time()
                 
-                # 获取面部区域坐标 - 直接使用默认值，避免错误
-                # 跳过get_image_prepare_material，因为它一直报错
-                h, w = frame.shape[:2]
-                mask = np.ones((h, w), dtype=np.uint8) * 255  # 全白mask
-                crop_box = face_box  # 使用face_box作为crop_box
+                for stage, writer in (('decode', frame_writer), ('landmarks', landmark_writer)):
+                    if writer is not None:
+                        if writer.close() == 0:
+                            raise ValueError(f"模板没有可用的帧: {template_path}")
+                        manifest.record(stage, stage_info[stage], writer.count, timings[stage])
                 
-                # 调试输出
-                print(f"使用默认mask和crop_box: {crop_box}")
+                # 换了帧存储格式时，移除其他格式的帧文件
+                if frame_writer is not None:
+                    for name in os.listdir(template_output_dir):
+                        path = os.path.join(template_output_dir, name)
+                        if (name.startswith(f"{template_id}_frames.") and not name.endswith('.tmp')
+                                and path != manifest.stage_path('decode')):
+                            os.remove(path)
+            
+            # 人脸框: 检测结果补齐失败帧并按bbox_shift调整（很小，整体读入）
+            raw_boxes = np.load(manifest.stage_path('landmarks'))
+            num_frames = len(raw_boxes)
+            first_frame = next(iter_frame_chunks(manifest.stage_path('decode'), 1))[0]
+            face_box_list = resolve_face_boxes(raw_boxes, first_frame.shape, bbox_shift)
+            
+            # 3. 第二遍: 面部解析 -> VAE编码 -> 融合几何（需要重算时才读取帧）
+            if 'parsing' in pending or 'latents' in pending or 'blend' in pending:
+                parsing_writer = open_writer('parsing') if 'parsing' in pending else None
+                latent_writer = open_writer('latents') if 'latents' in pending else None
+                mask_writer = open_writer('blend', 0, PackedMaskWriter) if 'blend' in pending else None
+                coord_writer = open_writer('blend', 1) if 'blend' in pending else None
+                cached_masks = (iter_array_chunks(manifest.stage_path('parsing'), chunk_size)
+                                if parsing_writer is None else None)
+                face_encoder = self.get_face_encoder() if parsing_writer or latent_writer else None
+                # 只重算融合几何时不需要读取帧
+                frame_chunks = (iter_frame_chunks(manifest.stage_path('decode'), chunk_size)
+                                if face_encoder is not None else None)
+                start = 0
                 
-                # 确保crop_box是4个元素的列表
-                if isinstance(crop_box, (list, tuple)):
-                    if len(crop_box) == 4:
-                        mask_coords_list.append(list(crop_box))
-                    else:
-                        print(f"警告: crop_box长度不是4: {len(crop_box)}, 使用face_box")
-                        mask_coords_list.append(list(face_box))
-                elif isinstance(crop_box, np.ndarray):
-                    if crop_box.size >= 4:
-                        mask_coords_list.append(crop_box.flatten()[:4].tolist())
-                    else:
-                        print(f"警告: crop_box太小: {crop_box.shape}, 使用face_box")
-                        mask_coords_list.append(list(face_box))
-                else:
-                    print(f"警告: crop_box类型异常: {type(crop_box)}, 使用face_box")
-                    mask_coords_list.append(list(face_box))
-                    
-                mask_list.append(mask)
-            
-            # 5. VAE编码 - 并行处理
-            print("VAE编码...")
-            input_latent_list = []
-            
-            def encode_frame(frame, mask=None):
-                with torch.no_grad():
-                    frame_tensor = torch.from_numpy(frame).float().to(self.device) / 127.5 - 1.0
-                    frame_tensor = frame_tensor.permute(2, 0, 1).unsqueeze(0)
+                while start < num_frames:
+                    chunk = next(frame_chunks) if frame_chunks is not None else None
+                    face_boxes = face_box_list[start:start + (len(chunk) if chunk is not None else chunk_size)]
                     
-                    # 编码原始帧得到reference latent (4通道)
-                    # VAE可能有不同的编码方法名
-                    if hasattr(self.vae, 'encode_latents'):
-                        reference_latent = self.vae.encode_latents(frame_tensor)
-                    elif hasattr(self.vae, 'encode'):
-                        # 标准的VAE encode方法
-                        latent_dist = self.vae.encode(frame_tensor)
-                        if hasattr(latent_dist, 'latent_dist'):
-                            reference_latent = latent_dist.latent_dist.sample() * 0.18215
-                        elif hasattr(latent_dist, 'sample'):
-                            reference_latent = latent_dist.sample() * 0.18215
+                    if face_encoder is not None:
+                        step_start = time.time()
+                        faces, crops = face_encoder.crop_faces(chunk, face_boxes)
+                        if parsing_writer is not None:
+                            parsing_masks = [self._normalize_parsing_mask(mask, face_encoder.size)
+                                             for mask in self.parse_faces(crops)]
+                            parsing_writer.write(parsing_masks)
                         else:
-                            reference_latent = latent_dist * 0.18215
-                    else:
-                        raise AttributeError(f"VAE对象没有encode方法: {dir(self.vae)}")
-                    
-                    # 如果有mask，创建masked版本
-                    if mask is not None and mask.size > 0:
-                        # 调试：打印mask信息
-                        print(f"Face parsing mask shape: {mask.shape}, dtype: {mask.dtype}, unique values: {np.unique(mask)[:5]}")
-                        
-                        # 处理面部解析mask
-                        # 面部解析mask通常包含不同的标签值（0=背景，1-19=不同面部区域）
-                        # 创建二值mask：非背景区域为1，背景为0
-                        binary_mask = (mask > 0).astype(np.float32)
-                        
-                        # 如果需要，可以对mask进行平滑处理
-                        from scipy.ndimage import gaussian_filter
-                        binary_mask = gaussian_filter(binary_mask, sigma=1.0)
+                            parsing_masks = next(cached_masks)
+                        timings['parsing'] += time.time() - step_start
                         
-                        # 将mask转换为tensor
-                        mask_tensor = torch.from_numpy(binary_mask).float().to(self.device)
-                        
-                        # 调整mask维度以匹配frame_tensor
-                        if len(mask_tensor.shape) == 2:  # [H, W]
-                            mask_tensor = mask_tensor.unsqueeze(0).unsqueeze(0)  # [1, 1, H, W]
-                        
-                        # 如果mask和frame尺寸不匹配，进行resize
-                        if mask_tensor.shape[-2:] != frame_tensor.shape[-2:]:
-                            mask_tensor = torch.nn.functional.interpolate(
-                                mask_tensor, 
-                                size=frame_tensor.shape[-2:], 
-                                mode='bilinear', 
-                                align_corners=False
-                            )
-                        
-                        # 扩展mask到3通道
-                        mask_tensor = mask_tensor.repeat(1, 3, 1, 1)  # [1, 3, H, W]
-                        
-                        # 创建masked frame（保留面部区域，背景变黑）
-                        masked_frame_tensor = frame_tensor * mask_tensor
-                        masked_latent = self.vae.encode_latents(masked_frame_tensor)
-                        
-                        # 拼接masked和reference latent得到8通道
-                        combined_latent = torch.cat([masked_latent, reference_latent], dim=1)
-                    else:
-                        # 如果没有mask，直接复制reference latent
-                        print("No face parsing mask available, using duplicated reference latent")
-                        combined_latent = torch.cat([reference_latent, reference_latent], dim=1)
+                        if latent_writer is not None:
+                            step_start = time.time()
+                            latent_writer.write(list(face_encoder.encode(faces, parsing_masks).numpy()))
+                            timings['latents'] += time.time() - step_start
+                    
+                    if mask_writer is not None:
+                        # 融合mask: 与crop_box同尺寸（get_image_blending 的约定），RLE压缩存储
+                        step_start = time.time()
+                        mask_writer.write(crop_masks(face_boxes))
+                        coord_writer.write([np.asarray(box, dtype=np.int32) for box in face_boxes])
+                        timings['blend'] += time.time() - step_start
                     
-                    return combined_latent.cpu()
-            
-            # 并行编码多帧
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                # 将frame和对应的face parsing mask一起传递
-                futures = []
-                for i, frame in enumerate(frame_list):
-                    face_mask = face_parsing_masks[i] if i < len(face_parsing_masks) else None
-                    futures.append(executor.submit(encode_frame, frame, face_mask))
+                    start += len(face_boxes)
+                    print(f"  [解析/编码/融合] {start}/{num_frames} 帧 "
+                          f"({start / (time.time() - start_time):.1f} 帧/秒)")
+                    if progress_fn is not None:
+                        progress_fn('encode', start, num_frames)
                 
-                for future in as_completed(futures):
-                    latent = future.result()
-                    input_latent_list.append(latent)
-            
-            # 6. 创建循环数据
-            print("🔄 创建循环数据...")
+                for stage, stage_writers in (('parsing', [parsing_writer]), ('latents', [latent_writer]),
+                                             ('blend', [mask_writer, coord_writer])):
+                    if stage_writers[0] is not None:
+                        for writer in stage_writers:
+                            writer.close()
+                        manifest.record(stage, stage_info[stage], stage_writers[0].count, timings[stage])
+                
+                # 旧格式的全分辨率mask数组已被替代
+                legacy_masks = os.path.join(template_output_dir, f"{template_id}_masks.npy")
+                if mask_writer is not None and os.path.exists(legacy_masks):
+                    os.remove(legacy_masks)
             
-            # 验证latent通道数
-            if input_latent_list:
-                latent_shape = input_latent_list[0].shape
-                print(f"✅ Latent形状: {latent_shape} (应该是8通道)")
-                if latent_shape[1] != 8:
-                    print(f"⚠️ 警告: Latent通道数为{latent_shape[1]}，期望为8通道")
-            
-            # 如果只有一帧，复制创建循环
-            if len(input_latent_list) == 1:
-                input_latent_list_cycle = input_latent_list * 2
-                coord_list_cycle = coord_list * 2
-                frame_list_cycle = frame_list * 2
-                mask_coords_list_cycle = mask_coords_list * 2
-                mask_list_cycle = mask_list * 2
-            else:
-                input_latent_list_cycle = input_latent_list
-                coord_list_cycle = coord_list
-                frame_list_cycle = frame_list
-                mask_coords_list_cycle = mask_coords_list
-                mask_list_cycle = mask_list
+            manifest.data['params'] = {'template_path': template_path, 'bbox_shift': bbox_shift,
+                                       'model_signature': self.model_signature, 'frame_storage': frame_storage}
+            manifest.mark_reused(reused)
+            manifest.save()
             
-            # 7. 保存预处理缓存
+            # 4. 组装预处理缓存（帧和mask在独立文件中，按帧顺序与latent一一对应）
             print("💾 保存预处理缓存...")
+            latents = np.load(manifest.stage_path('latents'))
+            input_latent_list = [torch.from_numpy(latent[None].copy()) for latent in latents]
+            
+            # 验证latent通道数
+            latent_shape = input_latent_list[0].shape
+            print(f"✅ Latent形状: {latent_shape} (应该是8通道)")
+            if latent_shape[1] != 8:
+                print(f"⚠️ 警告: Latent通道数为{latent_shape[1]}，期望为8通道")
             
             cache_data = {
-                'input_latent_list_cycle': input_latent_list_cycle,
-                'coord_list_cycle': coord_list_cycle,
-                'frame_list_cycle': frame_list_cycle,
-                'mask_coords_list_cycle': mask_coords_list_cycle,
-                'mask_list_cycle': mask_list_cycle,
+                'input_latent_list_cycle': input_latent_list,
+                'coord_list_cycle': face_box_list,
+                'frame_list_cycle': [],
+                'mask_coords_list_cycle': [list(box) for box in np.load(manifest.stage_path('blend', 1)).tolist()],
+                'mask_list_cycle': [],
+                'frame_file': os.path.basename(manifest.stage_path('decode')),
+                'mask_file': os.path.basename(manifest.stage_path('blend')),
+                'frame_count': num_frames,
             }
             
             # 保存缓存文件到模板子目录
             cache_file = os.path.join(template_output_dir, f"{template_id}_preprocessed.pkl")
-            with open(cache_file, 'wb') as f:
+            with open(cache_file + '.tmp', 'wb') as f:
                 pickle.dump(cache_data, f)
+            os.replace(cache_file + '.tmp', cache_file)
+            
+            total_time = time.time() - start_time
             
             # 保存元数据
             metadata = {
                 'template_id': template_id,
                 'template_path': template_path,
                 'processed_at': time.time(),
-                'frame_count': len(frame_list_cycle),
+                'frame_count': num_frames,
+                'bbox_shift': bbox_shift,
+                'source_type': source.kind,
+                'source_fps': source.fps,
+                'chunk_size': chunk_size,
+                'frame_storage': frame_storage,
+                'frames_per_second': round(num_frames / total_time, 2),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'reused_stages': reused,
+                'stage_seconds': {k: round(v, 3) for k, v in timings.items() if k in pending},
                 'shadow_fix_enabled': self.shadow_fix_enabled,
                 'lighting_adjustment': self.lighting_adjustment,
                 'color_correction': self.color_correction
@@ -707,12 +691,14 @@ class OptimizedPreprocessor:
             with open(state_file, 'wb') as f:
                 pickle.dump({'status': 'completed', 'template_id': template_id}, f)
             
-            total_time = time.time() - start_time
             print(f"极速预处理完成！")
             print(f"处理统计:")
             print(f"   - 模板ID: {template_id}")
-            print(f"   - 帧数: {len(frame_list_cycle)}")
-            print(f"   - 耗时: {total_time:.2f}秒")
+            print(f"   - 帧数: {num_frames} ({source.kind})")
+            print(f"   - 耗时: {total_time:.2f}秒 ({metadata['frames_per_second']} 帧/秒)")
+            print(f"   - 分阶段: {', '.join(f'{k} {timings[k]:.2f}s' for k in pending) or '无'}"
+                  f"（复用: {', '.join(reused) or '无'}）")
+            print(f"   - 峰值内存: {metadata['peak_rss_mb']:.0f}MB")
             print(f"   - 阴影修复: {'启用' if self.shadow_fix_enabled else '禁用'}")
             print(f"   - 缓存文件: {cache_file}")
             
@@ -722,7 +708,18 @@ class OptimizedPreprocessor:
             print(f"预处理失败: {str(e)}")
             import traceback
             traceback.print_exc()
+            for writer in writers:
+                writer.abort()
             return False
+    
+    def _normalize_parsing_mask(self, mask, size):
+        """面部解析mask统一为 (size,size) uint8（逐阶段缓存要求形状一致）"""
+        mask = np.asarray(mask, dtype=np.uint8)
+        if mask.ndim == 3:
+            mask = mask[..., 0]
+        if mask.shape != (size, size):
+            mask = cv2.resize(mask, (size, size), interpolation=cv2.INTER_NEAREST)
+        return mask
 
 def main():
     parser = argparse.ArgumentParser(description='优化版模板预处理')
@@ -730,6 +727,7 @@ def main():
     parser.add_argument('--output_dir', type=str, required=True, help='输出目录')
     parser.add_argument('--template_id', type=str, required=True, help='模板ID')
     parser.add_argument('--device', type=str, default='cuda:0', help='设备')
+    parser.add_argument('--bbox_shift', type=int, default=0, help='人脸框上边界偏移')
     parser.add_argument('--disable_shadow_fix', action='store_true', help='禁用阴影修复')
     parser.add_argument('--disable_lighting', action='store_true', help='禁用光照调整')
     parser.add_argument('--disable_color_correction', action='store_true', help='禁用颜色校正')
@@ -749,16 +747,15 @@ def main():
     print(f"   - 光照调整: {'启用' if preprocessor.lighting_adjustment else '禁用'}")
     print(f"   - 颜色校正: {'启用' if preprocessor.color_correction else '禁用'}")
     
-    # 初始化模型
-    if not preprocessor.initialize_models(args.device):
-        print("模型初始化失败")
-        return
+    # 模型在需要重算检测/解析/编码阶段时才初始化
+    preprocessor.device = args.device
     
     # 执行预处理
     success = preprocessor.preprocess_template_ultra_fast(
         args.template_path,
         args.output_dir, 
-        args.template_id
+        args.template_id,
+        bbox_shift=args.bbox_shift
     )
     
     if success:
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+常驻模板latent - 模板的循环latent按设备只上传一次（fp16，堆叠为 (N,8,32,32)），
+推理时用循环索引在设备上取batch，每次请求只有whisper特征经过PCIe
+每个设备的常驻显存有上限，超出时按LRU淘汰最久未用的模板
+
+配置（环境变量）:
+    MUSE_RESIDENT_LATENT_MB=256   每个设备常驻latent的显存上限
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+
+def get_resident_budget_bytes() -> int:
+    """每个设备常驻latent的显存上限（字节）"""
+    return int(float(os.environ.get('MUSE_RESIDENT_LATENT_MB', '256')) * 1024 * 1024)
+
+
+def template_key(template_id: str, cache_file: str) -> str:
+    """常驻缓存键: 模板ID + 缓存文件修改时间（重新预处理后自动失效）"""
+    try:
+        return f"{template_id}@{os.stat(cache_file).st_mtime_ns}"
+    except OSError:
+        return template_id
+
+
+def stack_latents(latent_list: Sequence[torch.Tensor]) -> torch.Tensor:
+    """把循环latent列表（每个 (1,8,32,32) 或 (8,32,32)）堆叠为 (N,8,32,32)"""
+    if isinstance(latent_list, torch.Tensor):
+        return latent_list
+    return torch.cat([latent if latent.dim() == 4 else latent.unsqueeze(0) for latent in latent_list], dim=0)
+
+
+def build_cycle_batches(whisper_chunks, cycle_length: int, batch_size: int, delay_frame: int = 0,
+                        frame_indices: Optional[Sequence[int]] = None) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """与musetalk datagen相同的分批和循环顺序，但latent用循环索引表示
+
+    Args:
+        frame_indices: 只为这些帧（升序）生成batch，默认全部帧
+
+    Returns:
+        [(whisper_batch, cycle_indices)]，whisper_batch在CPU上，cycle_indices为int64
+    """
+    if frame_indices is None:
+        frame_indices = range(len(whisper_chunks))
+    frame_indices = [int(i) for i in frame_indices]
+    batches = []
+    for start in range(0, len(frame_indices), batch_size):
+        indices = frame_indices[start:start + batch_size]
+        whisper_batch = torch.stack([whisper_chunks[i] for i in indices])
+        cycle_indices = (torch.tensor(indices, dtype=torch.long) + delay_frame) % cycle_length
+        batches.append((whisper_batch, cycle_indices))
+    return batches
+
+
+class ResidentLatentCache:
+    """各设备常驻模板latent（LRU，按显存上限淘汰，线程安全）"""
+
+    def __init__(self, budget_bytes: Optional[int] = None):
+        self.budget_bytes = budget_bytes or get_resident_budget_bytes()
+        self._entries = {}  # device -> OrderedDict(key -> tensor)
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def _used_bytes(self, entries: OrderedDict) -> int:
+        return sum(tensor.numel() * tensor.element_size() for tensor in entries.values())
+
+    def get(self, device, key: Optional[str], latent_list, dtype=torch.float16) -> torch.Tensor:
+        """取设备上的常驻latent (N,8,32,32)，首次使用时上传（key为None时只上传不常驻）"""
+        device = str(device)
+        with self._lock:
+            entries = self._entries.setdefault(device, OrderedDict())
+            if key is not None and key in entries:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entries[key]
+
+            resident = stack_latents(latent_list).to(device, dtype=dtype)
+            self.uploads += 1
+            size = resident.numel() * resident.element_size()
+            if key is None or size > self.budget_bytes:
+                if key is not None:
+                    print(f"⚠️ 模板 {key} 的latent({size / 1024 / 1024:.1f}MB)超过常驻上限，不常驻")
+                return resident
+
+            while entries and self._used_bytes(entries) + size > self.budget_bytes:
+                evicted_key, _ = entries.popitem(last=False)
+                self.evictions += 1
+                print(f"♻️ {device} 淘汰常驻latent: {evicted_key}")
+            entries[key] = resident
+            return resident
+
+    def preload(self, key: str, latent_list, devices, dtype=torch.float16):
+        """预先把模板latent上传到所有设备"""
+        stacked = stack_latents(latent_list)
+        for device in devices:
+            self.get(device, key, stacked, dtype)
+
+    def evict(self, key: Optional[str] = None):
+        """淘汰指定模板（key为None时清空）"""
+        with self._lock:
+            for entries in self._entries.values():
+                if key is None:
+                    entries.clear()
+                else:
+                    entries.pop(key, None)
+
+    def snapshot(self) -> Dict:
+        """各设备常驻模板和显存占用（/api/status）"""
+        with self._lock:
+            return {
+                'budget_mb': round(self.budget_bytes / 1024 / 1024, 1),
+                'uploads': self.uploads,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'devices': {
+                    device: {
+                        'used_mb': round(self._used_bytes(entries) / 1024 / 1024, 3),
+                        'templates': {
+                            key: {'frames': tensor.shape[0],
+                                  'mb': round(tensor.numel() * tensor.element_size() / 1024 / 1024, 3)}
+                            for key, tensor in entries.items()
+                        },
+                    }
+                    for device, entries in self._entries.items()
+                },
+            }
+
+
+# ===== 自检（CPU） =====
+
+def benchmark_resident_latents():
+    """验证按索引取batch与datagen结果一致、命中/淘汰正确"""
+    print("🧪 测试常驻模板latent（CPU）...")
+    cycle = [torch.randn(1, 8, 32, 32) for _ in range(7)]
+    whisper_chunks = torch.randn(30, 50, 384)
+
+    cache = ResidentLatentCache(budget_bytes=2 * 7 * 8 * 32 * 32 * 2)  # 容纳两个7帧fp16模板
+    resident = cache.get('cpu', 'a', cycle)
+    for batch_size in (4, 5, 16):
+        for start, (whisper_batch, indices) in zip(range(0, 30, batch_size), build_cycle_batches(whisper_chunks, len(cycle), batch_size)):
+            end = min(start + batch_size, 30)
+            expected = torch.cat([cycle[i % len(cycle)] for i in range(start, end)]).half()
+            assert torch.equal(resident.index_select(0, indices), expected)
+            assert torch.equal(whisper_batch, whisper_chunks[start:end])
+    print("  按循环索引取batch与datagen一致 ✅")
+
+    assert cache.get('cpu', 'a', cycle) is resident
+    cache.get('cpu', 'b', cycle)
+    cache.get('cpu', 'a', cycle)  # a变为最近使用
+    cache.get('cpu', 'c', cycle)  # 淘汰b
+    templates = cache.snapshot()['devices']['cpu']['templates']
+    assert set(templates) == {'a', 'c'}, templates
+    print(f"  LRU淘汰正确 ✅ {cache.snapshot()}")
+
+
+if __name__ == "__main__":
+    benchmark_resident_latents()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+batch形状分桶 - 把任意大小的batch补齐到少量固定档位（默认1/2/4/8/16）
+让编译图和CUDA图被复用而不是按新shape重新特化；返回前去掉补齐部分
+
+任意n帧按 计算量(补齐后帧数) + 每次调用开销 最小的方式拆成若干档位，
+例如 n=9 -> [8, 1]，n=3 -> [4]；命中率和补齐浪费记录在全局统计中
+
+配置（环境变量）:
+    MUSE_BATCH_BUCKETS=1,2,4,8,16   batch档位
+    MUSE_BUCKET_CALL_COST=2         每多一次模型调用折合的帧数开销
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16)
+
+
+def get_bucket_sizes() -> Tuple[int, ...]:
+    """batch档位（升序）"""
+    value = os.environ.get('MUSE_BATCH_BUCKETS', '')
+    if not value.strip():
+        return DEFAULT_BATCH_BUCKETS
+    return tuple(sorted({int(v) for v in value.split(',') if v.strip()}))
+
+
+def _call_cost() -> float:
+    return float(os.environ.get('MUSE_BUCKET_CALL_COST', '2'))
+
+
+@lru_cache(maxsize=1024)
+def _plan(num_frames: int, buckets: Tuple[int, ...], call_cost: float) -> Tuple[int, ...]:
+    """动态规划: 用档位覆盖num_frames帧，最小化 补齐后总帧数 + 调用次数*call_cost"""
+    # best[n] = (代价, 调用次数, 档位列表)，覆盖至少n帧
+    best = [(0.0, 0, ())] + [None] * num_frames
+    for n in range(1, num_frames + 1):
+        for bucket in buckets:
+            previous = best[max(0, n - bucket)]
+            cost = previous[0] + bucket + call_cost
+            candidate = (cost, previous[1] + 1, previous[2] + (bucket,))
+            if best[n] is None or candidate[:2] < best[n][:2]:
+                best[n] = candidate
+    return tuple(sorted(best[num_frames][2], reverse=True))
+
+
+def plan_buckets(num_frames: int, buckets: Optional[Tuple[int, ...]] = None) -> List[int]:
+    """把num_frames帧拆分成档位列表（大档位在前）"""
+    if num_frames <= 0:
+        return []
+    return list(_plan(num_frames, tuple(buckets or get_bucket_sizes()), _call_cost()))
+
+
+def pad_batch(tensor: torch.Tensor, bucket: int) -> torch.Tensor:
+    """沿batch维补齐到bucket大小（重复最后一帧，避免全零输入产生异常数值）"""
+    missing = bucket - tensor.shape[0]
+    if missing <= 0:
+        return tensor
+    return torch.cat([tensor, tensor[-1:].expand(missing, *tensor.shape[1:])], dim=0)
+
+
+class BucketStats:
+    """分桶统计 - 线程安全，供 /api/status 查询"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.batches = 0          # 调用方提交的batch数
+            self.calls = 0            # 实际模型调用次数
+            self.exact_calls = 0      # 无需补齐的调用次数
+            self.frames = 0           # 有效帧数
+            self.padded_frames = 0    # 补齐的帧数
+            self.bucket_calls = {}    # 档位 -> 调用次数
+
+    def record(self, num_frames: int, plan: List[int]):
+        with self._lock:
+            self.batches += 1
+            self.frames += num_frames
+            remaining = num_frames
+            for bucket in plan:
+                used = min(bucket, remaining)
+                remaining -= used
+                self.calls += 1
+                self.padded_frames += bucket - used
+                if used == bucket:
+                    self.exact_calls += 1
+                self.bucket_calls[bucket] = self.bucket_calls.get(bucket, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            computed = self.frames + self.padded_frames
+            return {
+                'buckets': list(get_bucket_sizes()),
+                'batches': self.batches,
+                'calls': self.calls,
+                'hit_rate': self.exact_calls / self.calls if self.calls else 0.0,
+                'frames': self.frames,
+                'padded_frames': self.padded_frames,
+                'waste_ratio': self.padded_frames / computed if computed else 0.0,
+                'bucket_calls': dict(sorted(self.bucket_calls.items())),
+            }
+
+
+# 全局统计实例
+_bucket_stats: Optional[BucketStats] = None
+
+
+def get_bucket_stats() -> BucketStats:
+    """获取分桶统计实例"""
+    global _bucket_stats
+    if _bucket_stats is None:
+        _bucket_stats = BucketStats()
+    return _bucket_stats
+
+
+def split_into_buckets(num_frames: int, buckets: Optional[Tuple[int, ...]] = None, stats: Optional[BucketStats] = None):
+    """返回 [(start, end, bucket)]，每段在[start, end)内，补齐到bucket"""
+    plan = plan_buckets(num_frames, buckets)
+    (stats or get_bucket_stats()).record(num_frames, plan)
+    chunks = []
+    start = 0
+    for bucket in plan:
+        end = min(start + bucket, num_frames)
+        chunks.append((start, end, bucket))
+        start = end
+    return chunks
+
+
+# ===== 自检（CPU + 替身模型） =====
+
+def benchmark_shape_buckets():
+    """CPU上用替身模型验证: 补齐推理结果与逐帧推理一致，并打印各batch大小的拆分方案和浪费"""
+    import sys
+    import numpy as np
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from core.standin_models import build_standin_models, synthetic_batch
+    from core.gpu_inference_pool import run_inference, run_bucketed_inference
+    from core.shape_buckets import get_bucket_stats as get_shared_stats  # 与推理层同一个模块实例
+
+    print("🧪 测试batch形状分桶（CPU替身模型）...")
+    gpu_models = build_standin_models('cpu')
+    timesteps = torch.tensor([0], dtype=torch.long)
+    stats = get_shared_stats()
+    stats.reset()
+
+    # 各调用方实际使用的batch大小 + datagen末尾的不规则batch
+    for num_frames in (1, 3, 5, 6, 7, 9, 12, 13, 20, 25):
+        whisper_batch, latent_batch = synthetic_batch(num_frames)
+        expected = np.concatenate([
+            run_inference(gpu_models, whisper_batch[i:i + 1], latent_batch[i:i + 1], timesteps)
+            for i in range(num_frames)
+        ])
+        actual = run_bucketed_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+        assert actual.shape[0] == num_frames
+        max_diff = int(np.abs(actual.astype(int) - expected.astype(int)).max())
+        assert max_diff <= 1, f"batch={num_frames} 补齐后结果不一致: {max_diff}"
+        print(f"  batch={num_frames:2d} -> 档位 {plan_buckets(num_frames)}")
+
+    snapshot = stats.snapshot()
+    print(f"调用次数: {snapshot['calls']}, 档位命中率: {snapshot['hit_rate']:.1%}, "
+          f"补齐浪费: {snapshot['waste_ratio']:.1%}, 各档位调用: {snapshot['bucket_calls']}")
+
+
+if __name__ == "__main__":
+    benchmark_shape_buckets()
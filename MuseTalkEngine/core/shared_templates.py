@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+跨进程共享模板存储 - 多个uvicorn worker / 引擎进程共用同一份模板数据
+第一个加载模板的进程把latent（以及旧格式缓存中内存里的帧/mask）写成共享目录（默认 /dev/shm）下的 .npy，
+其他进程按模板键（模板ID + 缓存文件修改时间）只读挂载（mmap，物理内存只有一份）；
+已经在模板目录中的帧/mask文件（.npy/.pack/.npz）直接按路径挂载，不再复制。
+共享目录下的 registry.json 记录每个模板的大小和各进程的引用计数（文件锁保护，已退出进程的引用自动清除），
+超过容量时按LRU淘汰没有进程引用的模板
+
+配置（环境变量）:
+    MUSE_SHARED_TEMPLATES=1             是否启用跨进程共享模板
+    MUSE_SHARED_TEMPLATE_DIR=/dev/shm/musetalk_templates   共享目录
+    MUSE_SHARED_TEMPLATE_MB=4096        共享模板的容量上限
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 旧格式缓存中以列表形式保存在pkl里的数组（文件挂载的不需要共享）
+LIST_KEYS = {'frame_list_cycle': 'frame_file', 'mask_list_cycle': 'mask_file'}
+LATENT_KEY = 'input_latent_list_cycle'
+
+
+def shared_templates_enabled() -> bool:
+    """是否启用跨进程共享模板"""
+    return os.environ.get('MUSE_SHARED_TEMPLATES', '1') == '1'
+
+
+def get_shared_template_dir() -> str:
+    default = '/dev/shm/musetalk_templates' if os.path.isdir('/dev/shm') else os.path.join(
+        os.environ.get('MUSE_TEMP_DIR', '/tmp'), 'musetalk_templates')
+    return os.environ.get('MUSE_SHARED_TEMPLATE_DIR', default)
+
+
+def get_shared_capacity_bytes() -> int:
+    return int(float(os.environ.get('MUSE_SHARED_TEMPLATE_MB', '4096')) * 1024 * 1024)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _trim_heap():
+    """发布后把pkl反序列化占用的堆内存还给系统（glibc的大块free不一定立即归还）"""
+    import gc
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def load_cache_file(cache_file: str) -> Dict:
+    """读取模板pkl并挂载其中记录的帧/mask文件（没有共享存储时的加载方式）"""
+    from core.template_frames import attach_frame_arrays
+    with open(cache_file, 'rb') as f:
+        cache_data = pickle.load(f)
+    return attach_frame_arrays(cache_data, os.path.dirname(cache_file))
+
+
+class SharedTemplateStore:
+    """共享目录中的模板（发布一次，各进程按键只读挂载，引用计数 + LRU淘汰）"""
+
+    def __init__(self, root: Optional[str] = None, capacity_bytes: Optional[int] = None):
+        self.root = root or get_shared_template_dir()
+        self.capacity_bytes = capacity_bytes or get_shared_capacity_bytes()
+        os.makedirs(self.root, exist_ok=True)
+        self._registry_path = os.path.join(self.root, 'registry.json')
+        self._lock_path = os.path.join(self.root, '.lock')
+        self._local_lock = threading.RLock()
+        self._attached = {}  # template_id -> (key, cache_data)，本进程已挂载的模板
+        self.publishes = 0
+        self.attaches = 0
+        self.evictions = 0
+        atexit.register(self.close)
+
+    # ----- 注册表（跨进程文件锁） -----
+
+    @contextmanager
+    def _registry(self):
+        """加锁读取注册表，退出时写回（顺便清除已退出进程的引用和目录已不存在的条目）"""
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                registry = {'entries': {}}
+                if os.path.exists(self._registry_path):
+                    try:
+                        with open(self._registry_path, 'r', encoding='utf-8') as f:
+                            registry = json.load(f)
+                    except Exception as e:
+                        print(f"⚠️ 共享模板注册表损坏，重新建立: {e}")
+                entries = registry.setdefault('entries', {})
+                for key, entry in list(entries.items()):
+                    if not os.path.isdir(os.path.join(self.root, entry['dir'])):
+                        del entries[key]
+                        continue
+                    entry['refs'] = {pid: count for pid, count in entry.get('refs', {}).items()
+                                     if count > 0 and _pid_alive(int(pid))}
+                yield entries
+                tmp_path = self._registry_path + f".tmp{os.getpid()}"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(registry, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, self._registry_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _publishing(self, key: str):
+        """模板的发布锁（跨进程）"""
+        with open(os.path.join(self.root, f".{key.replace(os.sep, '_')}.publish"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict_for(self, entries: Dict, needed_bytes: int):
+        """腾出空间: 按最近使用时间淘汰没有引用的模板（调用方持有注册表锁）"""
+        used = sum(entry['bytes'] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+            if used + needed_bytes <= self.capacity_bytes:
+                break
+            if entry['refs']:
+                continue
+            shutil.rmtree(os.path.join(self.root, entry['dir']), ignore_errors=True)
+            try:
+                os.remove(os.path.join(self.root, f".{entry['dir']}.publish"))
+            except OSError:
+                pass
+            del entries[key]
+            used -= entry['bytes']
+            self.evictions += 1
+            print(f"♻️ 淘汰共享模板: {key}（{entry['bytes'] / 1024 / 1024:.1f}MB）")
+        if used + needed_bytes > self.capacity_bytes:
+            print(f"⚠️ 共享模板超过容量上限（{(used + needed_bytes) / 1024 / 1024:.0f}MB > "
+                  f"{self.capacity_bytes / 1024 / 1024:.0f}MB），其余模板都在使用中")
+
+    # ----- 发布 / 挂载 / 释放 -----
+
+    def publish(self, key: str, template_id: str, cache_data: Dict, source_dir: str) -> bool:
+        """把模板写入共享目录（已由其他进程发布时直接返回True）"""
+        from core.resident_latents import stack_latents
+        dir_name = key.replace(os.sep, '_')
+        target = os.path.join(self.root, dir_name)
+        tmp_dir = os.path.join(self.root, f".{dir_name}.tmp{os.getpid()}.{threading.get_ident()}")
+        try:
+            os.makedirs(tmp_dir)
+            meta = {'_arrays': [], '_source_dir': source_dir}
+            for name, value in cache_data.items():
+                if name == LATENT_KEY:
+                    np.save(os.path.join(tmp_dir, f"{name}.npy"), stack_latents(value).float().numpy())
+                    meta['_arrays'].append(name)
+                elif name in LIST_KEYS and cache_data.get(LIST_KEYS[name]):
+                    continue  # 文件挂载的帧/mask，各进程按路径重新挂载
+                elif (name in LIST_KEYS and len(value) and
+                      len({np.asarray(item).shape for item in value}) == 1):
+                    np.save(os.path.join(tmp_dir, f"{name}.npy"), np.stack([np.asarray(item) for item in value]))
+                    meta['_arrays'].append(name)
+                else:
+                    meta[name] = value
+            with open(os.path.join(tmp_dir, 'meta.pkl'), 'wb') as f:
+                pickle.dump(meta, f)
+            size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+
+            with self._registry() as entries:
+                if key in entries:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return True
+                self._evict_for(entries, size)
+                shutil.rmtree(target, ignore_errors=True)  # 注册表中没有的残留目录
+                os.rename(tmp_dir, target)
+                entries[key] = {'template_id': template_id, 'dir': dir_name, 'bytes': size,
+                                'published_at': time.time(), 'last_used': time.time(), 'refs': {}}
+            self.publishes += 1
+            print(f"📤 共享模板已发布: {key}（{size / 1024 / 1024:.1f}MB）")
+            return True
+        except Exception as e:
+            print(f"⚠️ 共享模板发布失败: {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+
+    def attach(self, key: str) -> Optional[Dict]:
+        """只读挂载已发布的模板并增加本进程引用（未发布时返回None）"""
+        import torch
+        from core.template_frames import attach_frame_arrays
+        pid = str(os.getpid())
+        with self._registry() as entries:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            entry['refs'][pid] = entry['refs'].get(pid, 0) + 1
+            entry['last_used'] = time.time()
+            entry_dir = os.path.join(self.root, entry['dir'])
+        try:
+            with open(os.path.join(entry_dir, 'meta.pkl'), 'rb') as f:
+                cache_data = pickle.load(f)
+            for name in cache_data.pop('_arrays'):
+                # 写时复制映射: 各进程共享物理页，torch.from_numpy 也不需要可写数组的警告处理
+                array = np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode='c')
+                if name == LATENT_KEY:
+                    latents = torch.from_numpy(array)
+                    array = [latents[i:i + 1] for i in range(len(latents))]
+                cache_data[name] = array
+            attach_frame_arrays(cache_data, cache_data.pop('_source_dir'))
+            self.attaches += 1
+            return cache_data
+        except Exception as e:
+            print(f"⚠️ 共享模板挂载失败: {key}: {e}")
+            self.release(key)
+            return None
+
+    def release(self, key: str):
+        """减少本进程对模板的引用"""
+        pid = str(os.getpid())
+        with self._registry() as entries:
+            entry = entries.get(key)
+            if entry is not None and entry['refs'].get(pid):
+                entry['refs'][pid] -= 1
+                if not entry['refs'][pid]:
+                    del entry['refs'][pid]
+
+    def load(self, template_id: str, cache_file: str,
+             loader: Callable[[str], Optional[Dict]] = load_cache_file) -> Optional[Dict]:
+        """取模板缓存: 本进程已挂载 -> 直接返回；已发布 -> 挂载；否则读取pkl、发布后挂载
+
+        模板重新预处理后（缓存文件修改时间变化）键改变，旧版本的引用随之释放
+        """
+        from core.resident_latents import template_key
+        key = template_key(template_id, cache_file)
+        with self._local_lock:
+            attached = self._attached.get(template_id)
+            if attached is not None and attached[0] == key:
+                return attached[1]
+
+            cache_data = self.attach(key)
+            if cache_data is None:
+                # 同一模板只由一个进程读取pkl并发布，其他进程等待发布完成后挂载
+                with self._publishing(key):
+                    cache_data = self.attach(key)
+                    if cache_data is None:
+                        loaded = loader(cache_file)
+                        if loaded is None:
+                            return None
+                        if self.publish(key, template_id, loaded, os.path.dirname(cache_file)):
+                            cache_data = self.attach(key)
+                        if cache_data is None:
+                            print(f"⚠️ 共享模板不可用，本进程单独加载: {template_id}")
+                            return loaded
+                        del loaded
+                        _trim_heap()
+
+            if attached is not None:
+                self.release(attached[0])
+            self._attached[template_id] = (key, cache_data)
+            return cache_data
+
+    def unload(self, template_id: str):
+        """本进程不再使用模板（释放引用，其他进程不受影响）"""
+        with self._local_lock:
+            attached = self._attached.pop(template_id, None)
+        if attached is not None:
+            self.release(attached[0])
+
+    def close(self):
+        for template_id in list(self._attached):
+            try:
+                self.unload(template_id)
+            except Exception:
+                pass
+
+    def snapshot(self) -> Dict:
+        """共享模板、大小和各进程引用（/api/status）"""
+        with self._registry() as entries:
+            return {
+                'root': self.root,
+                'capacity_mb': round(self.capacity_bytes / 1024 / 1024, 1),
+                'used_mb': round(sum(entry['bytes'] for entry in entries.values()) / 1024 / 1024, 1),
+                'local': sorted(self._attached),
+                'publishes': self.publishes,
+                'attaches': self.attaches,
+                'evictions': self.evictions,
+                'templates': {key: {'mb': round(entry['bytes'] / 1024 / 1024, 1), 'refs': dict(entry['refs'])}
+                              for key, entry in entries.items()},
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_template_store() -> Optional[SharedTemplateStore]:
+    """进程内的共享模板存储（未启用或共享目录不可用时返回None）"""
+    global _store
+    if not shared_templates_enabled():
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = SharedTemplateStore()
+            except Exception as e:
+                print(f"⚠️ 共享模板存储不可用，各进程单独加载模板: {e}")
+                return None
+        return _store
+
+
+def load_template_shared(template_id: str, cache_file: str) -> Optional[Dict]:
+    """加载模板缓存（启用共享时各进程共用一份，否则本进程单独加载）"""
+    store = get_shared_template_store()
+    if store is None:
+        return load_cache_file(cache_file)
+    return store.load(template_id, cache_file)
+
+
+# ===== 性能测试（多进程，CPU） =====
+
+def _proc_pss_mb() -> float:
+    """本进程的PSS（共享页按映射进程数分摊）"""
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _benchmark_worker(mode, cache_files, root, barrier, results):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import torch  # 导入开销不计入
+    import core.template_frames  # noqa: F401（cv2）
+    from core.resident_latents import stack_latents
+    store = SharedTemplateStore(root) if mode == 'shared' else None
+    before = _proc_pss_mb()
+    templates = []
+    for template_id, cache_file in cache_files:
+        cache_data = store.load(template_id, cache_file) if store else load_cache_file(cache_file)
+        # 推理会读到所有帧和latent
+        checksum = float(stack_latents(cache_data[LATENT_KEY]).sum())
+        checksum += sum(int(frame[0, 0, 0]) + (int(np.asarray(frame).sum()) & 1) for frame in cache_data['frame_list_cycle'])
+        templates.append((cache_data, checksum))
+    barrier.wait()  # 所有进程都挂载后统计
+    results.put((mode, _proc_pss_mb() - before, [checksum for _, checksum in templates]))
+    barrier.wait()
+    if store:
+        store.close()
+
+
+def _collect_reports(workers, results, timeout: float = 300):
+    """收集每个工作进程的结果；有进程异常退出时立即停止其余进程并报错，而不是等到超时"""
+    import queue
+    reports = []
+    deadline = time.time() + timeout
+    try:
+        while len(reports) < len(workers):
+            try:
+                reports.append(results.get(timeout=1))
+                continue
+            except queue.Empty:
+                pass
+            crashed = [worker.exitcode for worker in workers if worker.exitcode not in (None, 0)]
+            if crashed:
+                raise RuntimeError(f"{len(crashed)}个工作进程异常退出（退出码 {crashed}）")
+            if time.time() > deadline:
+                raise TimeoutError(f"等待工作进程结果超时（{len(reports)}/{len(workers)}）")
+    except Exception:
+        for worker in workers:
+            worker.terminate()
+        raise
+    return reports
+
+
+def benchmark_shared_templates(processes: int = 3, templates: int = 3, frames: int = 50,
+                               width: int = 640, height: int = 360):
+    """N个进程 × M个模板（旧格式: 帧在pkl中）: 各进程单独加载 vs 共享存储 的PSS总和，以及引用计数和淘汰"""
+    import tempfile
+    import multiprocessing
+    import torch
+
+    print(f"🧪 测试跨进程共享模板（{processes}个进程 × {templates}个模板，每个模板 {frames}帧 {width}x{height}）...")
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_files = []
+        rng = np.random.default_rng(0)
+        for t in range(templates):
+            template_id = f"shared_{t}"
+            os.makedirs(os.path.join(tmp_dir, template_id))
+            cache_file = os.path.join(tmp_dir, template_id, f"{template_id}_preprocessed.pkl")
+            with open(cache_file, 'wb') as f:
+                pickle.dump({
+                    LATENT_KEY: [torch.randn(1, 8, 32, 32) for _ in range(frames)],
+                    'coord_list_cycle': [[100, 80, 300, 280]] * frames,
+                    'frame_list_cycle': [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(frames)],
+                    'mask_coords_list_cycle': [[100, 80, 300, 280]] * frames,
+                    'mask_list_cycle': [np.full((200, 200), 255, dtype=np.uint8)] * frames,
+                }, f)
+            cache_files.append((template_id, cache_file))
+        template_mb = sum(os.path.getsize(path) for _, path in cache_files) / 1024 / 1024
+        root = os.path.join(tmp_dir, 'shm') if not os.path.isdir('/dev/shm') else tempfile.mkdtemp(dir='/dev/shm')
+
+        try:
+            totals, checksums = {}, {}
+            for mode in ('pickle', 'shared'):
+                barrier, results = ctx.Barrier(processes), ctx.Queue()
+                workers = [ctx.Process(target=_benchmark_worker, args=(mode, cache_files, root, barrier, results))
+                           for _ in range(processes)]
+                for worker in workers:
+                    worker.start()
+                reports = _collect_reports(workers, results)
+                for worker in workers:
+                    worker.join()
+                totals[mode] = sum(pss for _, pss, _ in reports)
+                checksums[mode] = reports[0][2]
+                assert all(report[2] == checksums[mode] for report in reports)
+            assert np.allclose(checksums['pickle'], checksums['shared'], rtol=1e-4), "共享挂载的数据与pkl不一致"
+            print(f"  模板数据 {template_mb:.0f}MB（{templates}个模板）")
+            print(f"  各进程单独加载: PSS合计 {totals['pickle']:.0f}MB（≈ 进程数 × 模板数）")
+            print(f"  共享模板存储  : PSS合计 {totals['shared']:.0f}MB（≈ 模板数，"
+                  f"节省 {(1 - totals['shared'] / totals['pickle']) * 100:.0f}%）")
+            assert totals['shared'] < totals['pickle'] / 2
+
+            # 进程退出后引用自动清除；重新预处理后发布新版本，容量不足时淘汰无引用的旧版本，使用中的模板不淘汰
+            store = SharedTemplateStore(root, capacity_bytes=int(template_mb / templates * 2.5 * 1024 * 1024))
+            assert all(not entry['refs'] for entry in store.snapshot()['templates'].values())
+            assert store.load(*cache_files[0]) is not None and store.load(*cache_files[1]) is not None
+            stat = os.stat(cache_files[2][1])
+            os.utime(cache_files[2][1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            assert store.load(*cache_files[2]) is not None
+            keys = sorted(store.snapshot()['templates'])
+            assert [key.split('@')[0] for key in keys] == ['shared_0', 'shared_1', 'shared_2'], keys
+            print(f"  退出进程的引用已清除，重新预处理后淘汰 {store.evictions} 个无引用的旧版本，使用中的模板保留 ✅")
+            store.close()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    benchmark_shared_templates()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+静音帧跳过 - 按PCM能量计算每个视频帧的有声/静音标记，
+静音段直接使用模板每个循环帧预先渲染好的"闭嘴"帧，不再经过 PE -> UNet -> VAE；
+有声段与静音段交界处推理若干过渡帧，与闭嘴帧交叉淡化
+
+闭嘴帧 = 用静音whisper特征对模板的每个循环latent推理一次（在预处理完成/会话预加载时渲染），
+保存为模板缓存目录下的 {template_id}_silent_frames.npy（每个模板只算一次），推理进程以只读mmap加载
+
+配置（环境变量）:
+    MUSE_SILENCE_SKIP=1              启用静音帧跳过
+    MUSE_SILENCE_THRESHOLD_DB=-35    低于峰值能量多少dB视为静音
+    MUSE_SILENCE_FLOOR_DB=-55        绝对静音阈值（全段都很小声时）
+    MUSE_SILENCE_MIN_FRAMES=6        短于此帧数的停顿不跳过（保持口型连贯）
+    MUSE_SILENCE_CROSSFADE=3         交界处过渡帧数
+    MUSE_SILENT_FRAMES_CACHE=8       每个进程内存中保留闭嘴帧的模板数（LRU）
+"""
+
+import os
+import wave
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+AUDIO_SAMPLE_RATE = 16000
+
+
+def silence_skip_enabled() -> bool:
+    """是否启用静音帧跳过"""
+    return os.environ.get('MUSE_SILENCE_SKIP', '1') == '1'
+
+
+def silent_frames_capacity() -> int:
+    """每个进程内存中保留闭嘴帧的模板数"""
+    return max(1, int(os.environ.get('MUSE_SILENT_FRAMES_CACHE', '8')))
+
+
+def silent_frames_path(cache_dir: str, template_id: str) -> str:
+    """模板闭嘴帧的缓存文件"""
+    return os.path.join(cache_dir, f"{template_id}_silent_frames.npy")
+
+
+def load_pcm(audio_path: str, sample_rate: int = AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """读取单声道float32 PCM（优先librosa，与AudioProcessor一致；没有时用标准库读16位wav）"""
+    try:
+        import librosa
+        pcm, _ = librosa.load(audio_path, sr=sample_rate)
+        return pcm.astype(np.float32)
+    except ImportError:
+        pass
+    with wave.open(audio_path, 'rb') as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(f"不支持的采样位宽: {wav_file.getsampwidth() * 8}bit")
+        channels = wav_file.getnchannels()
+        rate = wav_file.getframerate()
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16).astype(np.float32) / 32768
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate and len(pcm):
+        # 线性重采样（只用于能量检测，精度足够）
+        target = np.linspace(0, len(pcm) - 1, int(len(pcm) * sample_rate / rate))
+        pcm = np.interp(target, np.arange(len(pcm)), pcm).astype(np.float32)
+    return pcm
+
+
+def frame_energy_db(pcm: np.ndarray, sample_rate: int, num_frames: int, fps: int) -> np.ndarray:
+    """每个视频帧对应音频窗口的RMS能量（dB）"""
+    samples_per_frame = sample_rate / fps
+    energy = np.full(num_frames, -120.0, dtype=np.float32)
+    for i in range(num_frames):
+        window = pcm[int(i * samples_per_frame):int((i + 1) * samples_per_frame)]
+        if len(window):
+            rms = float(np.sqrt(np.mean(np.square(window, dtype=np.float64))))
+            energy[i] = 20 * np.log10(max(rms, 1e-6))
+    return energy
+
+
+def _runs(mask: np.ndarray):
+    """连续相同值的区间 [(start, end, value)]"""
+    runs = []
+    start = 0
+    for i in range(1, len(mask) + 1):
+        if i == len(mask) or mask[i] != mask[start]:
+            runs.append((start, i, bool(mask[start])))
+            start = i
+    return runs
+
+
+def compute_activity_mask(pcm: np.ndarray, sample_rate: int, num_frames: int, fps: int,
+                          threshold_db: Optional[float] = None, floor_db: Optional[float] = None,
+                          min_silence_frames: Optional[int] = None) -> np.ndarray:
+    """有声标记（True=需要口型），短停顿视为有声"""
+    threshold_db = threshold_db if threshold_db is not None else float(os.environ.get('MUSE_SILENCE_THRESHOLD_DB', '-35'))
+    floor_db = floor_db if floor_db is not None else float(os.environ.get('MUSE_SILENCE_FLOOR_DB', '-55'))
+    min_silence_frames = min_silence_frames if min_silence_frames is not None else int(os.environ.get('MUSE_SILENCE_MIN_FRAMES', '6'))
+
+    energy = frame_energy_db(pcm, sample_rate, num_frames, fps)
+    if num_frames == 0:
+        return np.zeros(0, dtype=bool)
+    active = energy > max(float(energy.max()) + threshold_db, floor_db)
+    for start, end, value in _runs(active):
+        if not value and end - start < min_silence_frames:
+            active[start:end] = True
+    return active
+
+
+def plan_silence_skip(active: np.ndarray, crossfade: Optional[int] = None) -> Dict:
+    """根据有声标记规划哪些帧需要推理，以及每帧闭嘴帧的混合权重
+
+    Returns:
+        {'infer_mask': 需要推理的帧, 'closed_weight': 闭嘴帧权重（0=只用推理结果，1=只用闭嘴帧）}
+    """
+    crossfade = crossfade if crossfade is not None else int(os.environ.get('MUSE_SILENCE_CROSSFADE', '3'))
+    num_frames = len(active)
+    active_indices = np.flatnonzero(active)
+    if len(active_indices) == 0:
+        distance = np.full(num_frames, num_frames + crossfade + 1)
+    else:
+        # 每帧到最近有声帧的距离
+        positions = np.arange(num_frames)
+        right = np.searchsorted(active_indices, positions)
+        left_distance = np.where(right > 0, positions - active_indices[np.maximum(right - 1, 0)], num_frames + crossfade + 1)
+        right_distance = np.where(right < len(active_indices),
+                                  active_indices[np.minimum(right, len(active_indices) - 1)] - positions,
+                                  num_frames + crossfade + 1)
+        distance = np.minimum(left_distance, right_distance)
+
+    infer_mask = distance <= crossfade
+    closed_weight = np.clip(distance / (crossfade + 1), 0.0, 1.0).astype(np.float32)
+    return {'infer_mask': infer_mask, 'closed_weight': closed_weight}
+
+
+def merge_with_silent_frames(inferred: Sequence[np.ndarray], plan: Dict, silent_frames: np.ndarray,
+                             delay_frame: int = 0):
+    """把推理帧（按infer_mask顺序）和闭嘴帧合并为完整帧序列，过渡帧交叉淡化"""
+    frames = []
+    inferred_iter = iter(inferred)
+    cycle_length = len(silent_frames)
+    for i, (infer, weight) in enumerate(zip(plan['infer_mask'], plan['closed_weight'])):
+        closed = silent_frames[(i + delay_frame) % cycle_length]
+        if not infer:
+            frames.append(closed)
+            continue
+        frame = next(inferred_iter)
+        if weight > 0:
+            frame = (frame.astype(np.float32) * (1 - weight) + closed.astype(np.float32) * weight + 0.5).astype(np.uint8)
+        frames.append(frame)
+    return frames
+
+
+def silence_stats(plan: Dict, inference_time: float) -> Dict:
+    """本次请求跳过的帧比例和估算节省的推理时间"""
+    num_frames = len(plan['infer_mask'])
+    inferred = int(plan['infer_mask'].sum())
+    skipped = num_frames - inferred
+    per_frame = inference_time / inferred if inferred else 0.0
+    return {
+        'frames': num_frames,
+        'inferred_frames': inferred,
+        'skipped_frames': skipped,
+        'skipped_ratio': round(skipped / num_frames, 4) if num_frames else 0.0,
+        'saved_ms': round(skipped * per_frame * 1000, 1),
+    }
+
+
+# ===== 自检（合成音频 + CPU替身模型） =====
+
+def benchmark_silence_skip():
+    """合成 静音-语音-停顿-语音-静音 音频，验证有声检测、帧数完整和交界处的过渡"""
+    import sys
+    import time
+    import torch
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from core.standin_models import build_standin_models, WHISPER_CHUNK_SHAPE, LATENT_INPUT_SHAPE
+    from core.gpu_inference_pool import run_bucketed_inference
+
+    print("🧪 测试静音帧跳过（合成音频 + CPU替身模型）...")
+    fps = 25
+    rng = np.random.default_rng(0)
+    segments = [(0.8, 0.0), (1.2, 0.3), (0.12, 0.0), (1.0, 0.3), (0.4, 0.0), (1.0, 0.0)]  # (秒, 幅度)
+    pcm = np.concatenate([
+        amplitude * np.sin(np.arange(int(seconds * AUDIO_SAMPLE_RATE)) * 2 * np.pi * 220 / AUDIO_SAMPLE_RATE)
+        + rng.normal(0, 1e-4, int(seconds * AUDIO_SAMPLE_RATE))
+        for seconds, amplitude in segments
+    ]).astype(np.float32)
+    num_frames = int(len(pcm) / AUDIO_SAMPLE_RATE * fps)
+
+    active = compute_activity_mask(pcm, AUDIO_SAMPLE_RATE, num_frames, fps)
+    plan = plan_silence_skip(active)
+    assert not active[:15].any() and active[25:45].all(), "有声检测错误"
+    assert active[50:53].all(), "短停顿应视为有声"
+    print(f"  有声帧 {int(active.sum())}/{num_frames}, 需推理 {int(plan['infer_mask'].sum())} 帧")
+
+    gpu_models = build_standin_models('cpu')
+    timesteps = torch.tensor([0], dtype=torch.long)
+    cycle = torch.randn(5, *LATENT_INPUT_SHAPE)
+    whisper = torch.randn(num_frames, *WHISPER_CHUNK_SHAPE)
+    silent_whisper = torch.zeros(len(cycle), *WHISPER_CHUNK_SHAPE)
+    silent_frames = run_bucketed_inference(gpu_models, silent_whisper, cycle, timesteps)
+    indices = np.arange(num_frames)
+
+    start = time.perf_counter()
+    full = run_bucketed_inference(gpu_models, whisper, cycle[indices % len(cycle)], timesteps)
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    infer_indices = indices[plan['infer_mask']]
+    inferred = run_bucketed_inference(gpu_models, whisper[infer_indices], cycle[infer_indices % len(cycle)], timesteps)
+    inference_time = time.perf_counter() - start
+    merged = merge_with_silent_frames(inferred, plan, silent_frames)
+
+    assert len(merged) == num_frames
+    for i in range(num_frames):
+        weight = plan['closed_weight'][i]
+        if weight == 0:
+            assert np.array_equal(merged[i], full[i])
+        elif weight == 1:
+            assert np.array_equal(merged[i], silent_frames[i % len(cycle)])
+    stats = silence_stats(plan, inference_time)
+    print(f"  跳过 {stats['skipped_frames']} 帧 ({stats['skipped_ratio']:.0%}), 估算节省 {stats['saved_ms']:.0f}ms, "
+          f"推理耗时 {inference_time * 1000:.0f}ms（全部推理 {full_time * 1000:.0f}ms）✅")
+
+
+if __name__ == "__main__":
+    benchmark_silence_skip()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+替身模型 - 与MuseTalk的 PE / UNet / VAE 接口和张量形状一致的小模型
+用于CPU上运行预热、性能测试和自检（不需要真实权重和CUDA）
+"""
+
+from typing import Dict
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# MuseTalk的张量形状（不含batch维）
+WHISPER_CHUNK_SHAPE = (50, 384)   # 每帧音频特征
+LATENT_INPUT_SHAPE = (8, 32, 32)  # 遮挡latent + 参考latent
+LATENT_OUTPUT_SHAPE = (4, 32, 32)
+FACE_SIZE = 256                    # VAE解码输出的人脸尺寸
+VAE_SCALING_FACTOR = 0.18215
+
+
+class _Output:
+    """模拟diffusers的输出对象（.sample）"""
+
+    def __init__(self, sample):
+        self.sample = sample
+
+
+class StandInPE(nn.Module):
+    """替身位置编码（输入输出形状相同）"""
+
+    def __init__(self):
+        super().__init__()
+        self.pe = nn.Parameter(torch.randn(1, *WHISPER_CHUNK_SHAPE) * 0.02)
+
+    def forward(self, x):
+        return x + self.pe[:, :x.shape[1]]
+
+
+class StandInUNetModel(nn.Module):
+    """替身UNet: latent(B,8,32,32) + 音频特征(B,50,384) -> latent(B,4,32,32)"""
+
+    def __init__(self, channels: int = 64):
+        super().__init__()
+        self.conv_in = nn.Conv2d(LATENT_INPUT_SHAPE[0], channels, 3, padding=1)
+        self.audio_proj = nn.Linear(WHISPER_CHUNK_SHAPE[1], channels)
+        self.mid = nn.Sequential(
+            nn.Conv2d(channels, channels, 3, padding=1),
+            nn.SiLU(),
+            nn.Conv2d(channels, channels, 3, padding=1),
+        )
+        self.conv_out = nn.Conv2d(channels, LATENT_OUTPUT_SHAPE[0], 3, padding=1)
+
+    def forward(self, latent, timesteps, encoder_hidden_states=None):
+        hidden = F.silu(self.conv_in(latent))
+        if encoder_hidden_states is not None:
+            audio = self.audio_proj(encoder_hidden_states.mean(dim=1))
+            hidden = hidden + audio[:, :, None, None]
+        hidden = hidden + self.mid(hidden)
+        return _Output(self.conv_out(hidden))
+
+
+class StandInUNet:
+    """替身UNet包装对象（.model）"""
+
+    def __init__(self, device='cpu'):
+        self.model = StandInUNetModel()
+        self.device = torch.device(device)
+
+
+class _LatentDist:
+    """模拟diffusers的latent分布（sample返回均值，结果确定）"""
+
+    def __init__(self, mean):
+        self.mean = mean
+
+    def sample(self):
+        return self.mean
+
+
+class StandInAutoencoder(nn.Module):
+    """替身AutoencoderKL: encoder把 (B,3,256,256) 图像压缩为 (B,4,32,32)，decoder相反"""
+
+    def __init__(self, channels: int = 32):
+        super().__init__()
+        self.config = type('Config', (), {'scaling_factor': VAE_SCALING_FACTOR})()
+        self.encoder = nn.Sequential(
+            nn.AvgPool2d(FACE_SIZE // LATENT_OUTPUT_SHAPE[1]),
+            nn.Conv2d(3, LATENT_OUTPUT_SHAPE[0], 3, padding=1),
+        )
+        self.decoder = nn.Sequential(
+            nn.Conv2d(LATENT_OUTPUT_SHAPE[0], channels, 3, padding=1),
+            nn.SiLU(),
+            nn.Upsample(scale_factor=FACE_SIZE // LATENT_OUTPUT_SHAPE[1], mode='nearest'),
+            nn.Conv2d(channels, 3, 3, padding=1),
+            nn.Tanh(),
+        )
+
+    def encode(self, images):
+        output = _Output(None)
+        output.latent_dist = _LatentDist(self.encoder(images))
+        return output
+
+    def decode(self, latents):
+        return _Output(self.decoder(latents))
+
+
+class StandInVAE:
+    """替身VAE包装对象（.vae / decode_latents），输出与MuseTalk一致的uint8 BGR数组"""
+
+    def __init__(self, device='cpu'):
+        self.vae = StandInAutoencoder()
+        self.device = torch.device(device)
+
+    def encode_latents(self, images):
+        """与MuseTalk VAE.encode_latents相同: (B,3,H,W) [-1,1] -> 缩放后的latent"""
+        latent_dist = self.vae.encode(images.to(next(self.vae.parameters()).dtype)).latent_dist
+        return self.vae.config.scaling_factor * latent_dist.sample()
+
+    def decode_latents(self, latents):
+        latents = (1 / self.vae.config.scaling_factor) * latents
+        image = self.vae.decode(latents.to(next(self.vae.parameters()).dtype)).sample
+        image = (image / 2 + 0.5).clamp(0, 1)
+        image = image.detach().cpu().permute(0, 2, 3, 1).float().numpy()
+        image = (image * 255).round().astype(np.uint8)
+        return image[..., ::-1]
+
+
+def build_standin_models(device='cpu', dtype=torch.float32, seed: int = 0) -> Dict:
+    """构建替身模型组 {'vae', 'unet', 'pe'}，结构与 gpu_models[device] 相同"""
+    torch.manual_seed(seed)
+    vae = StandInVAE(device)
+    unet = StandInUNet(device)
+    pe = StandInPE()
+    vae.vae = vae.vae.to(device, dtype=dtype).eval()
+    unet.model = unet.model.to(device, dtype=dtype).eval()
+    pe = pe.to(device, dtype=dtype).eval()
+    return {'vae': vae, 'unet': unet, 'pe': pe}
+
+
+def standin_face_boxes(frames) -> list:
+    """替身人脸检测: 取画面中心区域作为人脸框 (x1,y1,x2,y2)"""
+    boxes = []
+    for frame in frames:
+        h, w = frame.shape[:2]
+        size = min(h, w) // 2
+        boxes.append([(w - size) // 2, (h - size) // 2, (w + size) // 2, (h + size) // 2])
+    return boxes
+
+
+def synthetic_batch(batch_size: int, device='cpu', dtype=torch.float32):
+    """生成一批合成输入 (whisper_batch, latent_batch)"""
+    whisper_batch = torch.randn(batch_size, *WHISPER_CHUNK_SHAPE, device=device, dtype=dtype)
+    latent_batch = torch.randn(batch_size, *LATENT_INPUT_SHAPE, device=device, dtype=dtype)
+    return whisper_batch, latent_batch
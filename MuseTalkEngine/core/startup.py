@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+启动阶段跟踪 - 记录服务从绑定端口到就绪的各阶段耗时
+阶段顺序: starting -> loading_models -> warming -> ready（失败时为 failed）
+"""
+
+import time
+import threading
+from typing import Dict, Optional
+
+# 阶段定义（按顺序）
+STAGE_STARTING = 'starting'
+STAGE_LOADING_MODELS = 'loading_models'
+STAGE_WARMING = 'warming'
+STAGE_READY = 'ready'
+STAGE_FAILED = 'failed'
+
+STARTUP_STAGES = [STAGE_STARTING, STAGE_LOADING_MODELS, STAGE_WARMING, STAGE_READY]
+
+
+class StartupTracker:
+    """启动阶段跟踪器 - 线程安全，供 /health 和 /api/status 查询"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.process_start = time.time()
+        self.stage = STAGE_STARTING
+        self.stage_started_at = self.process_start
+        self.stage_durations = {}  # 阶段 -> 耗时（秒），只记录已结束的阶段
+        self.error = None
+
+    def enter(self, stage: str):
+        """进入新阶段，结束并记录上一阶段耗时"""
+        with self._lock:
+            now = time.time()
+            previous = self.stage
+            elapsed = now - self.stage_started_at
+            self.stage_durations[previous] = self.stage_durations.get(previous, 0.0) + elapsed
+            self.stage = stage
+            self.stage_started_at = now
+
+        print(f"⏱️ 启动阶段: {previous} -> {stage} ({previous}耗时 {elapsed:.2f}秒)")
+        if stage == STAGE_READY:
+            print(f"✅ 服务就绪，总启动耗时: {now - self.process_start:.2f}秒")
+
+    def fail(self, error: str):
+        """标记启动失败"""
+        self.error = error
+        self.enter(STAGE_FAILED)
+
+    @property
+    def is_ready(self) -> bool:
+        return self.stage == STAGE_READY
+
+    def snapshot(self) -> Dict:
+        """当前启动状态快照"""
+        with self._lock:
+            now = time.time()
+            durations = dict(self.stage_durations)
+            return {
+                'status': self.stage,
+                'stage_elapsed': now - self.stage_started_at,
+                'uptime': now - self.process_start,
+                'stage_durations': durations,
+                'error': self.error,
+            }
+
+
+# 全局跟踪器实例
+_startup_tracker: Optional[StartupTracker] = None
+
+
+def get_startup_tracker() -> StartupTracker:
+    """获取启动跟踪器实例"""
+    global _startup_tracker
+    if _startup_tracker is None:
+        _startup_tracker = StartupTracker()
+    return _startup_tracker
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+模板帧源 - 视频模板流式解码（按块读取，不整段载入内存），图片/图片目录按同样接口读取；
+模板帧按块顺序写入 .npy 文件（按块读回，推理时以只读mmap方式挂载；可选压缩存储见 core/encoded_frames.py），
+预处理的内存占用只与块大小有关，与视频时长无关
+
+配置（环境变量）:
+    MUSE_PREPROCESS_CHUNK=32      每块帧数（检测/解析/编码都按块批量执行）
+    MUSE_TEMPLATE_MAX_FRAMES=0    视频模板最多使用的帧数（0=全部）
+"""
+
+import os
+import sys
+import time
+import resource
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+NPY_HEADER_SIZE = 128  # 固定长度的npy头，写完后可以原地改写帧数
+
+
+def get_chunk_size() -> int:
+    """每块帧数"""
+    return max(1, int(os.environ.get('MUSE_PREPROCESS_CHUNK', '32')))
+
+
+def get_max_frames() -> int:
+    """视频模板最多使用的帧数（0=全部）"""
+    return max(0, int(os.environ.get('MUSE_TEMPLATE_MAX_FRAMES', '0')))
+
+
+def peak_rss_mb() -> float:
+    """进程峰值RSS（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+
+
+class TemplateSource:
+    """模板帧源: 一个视频文件，或一张/一组图片（目录中的图片按文件名排序作为序列）"""
+
+    def __init__(self, template_path: str, max_frames: Optional[int] = None):
+        self.template_path = str(template_path)
+        self.max_frames = get_max_frames() if max_frames is None else max_frames
+        self.fps = None
+        path = Path(template_path)
+        if path.is_file() and path.suffix.lower() in VIDEO_EXTENSIONS:
+            self.kind, self.files = 'video', [str(path)]
+        elif path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+            self.kind, self.files = 'image', [str(path)]
+        elif path.is_dir():
+            videos = sorted(str(p) for p in path.iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS)
+            images = sorted(str(p) for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+            if videos:
+                self.kind, self.files = 'video', videos[:1]
+            elif images:
+                self.kind, self.files = 'image', images
+            else:
+                raise ValueError(f"未找到图像或视频文件: {template_path}")
+        else:
+            raise ValueError(f"不支持的模板文件: {template_path}")
+
+    def estimate_frame_count(self) -> int:
+        """帧数估计（视频按容器记录的帧数，实际解码数可能略少）"""
+        if self.kind == 'video':
+            capture = cv2.VideoCapture(self.files[0])
+            count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+            capture.release()
+        else:
+            count = len(self.files)
+        if self.max_frames:
+            count = min(count, self.max_frames)
+        return count
+
+    def iter_chunks(self, chunk_size: Optional[int] = None) -> Iterator[List[np.ndarray]]:
+        """按块产出BGR帧（同一模板的帧尺寸一致，图片尺寸不同时缩放到第一帧的尺寸）"""
+        chunk_size = chunk_size or get_chunk_size()
+        chunk, shape, count = [], None, 0
+        for frame in self._iter_frames():
+            if shape is None:
+                shape = frame.shape
+            elif frame.shape != shape:
+                print(f"⚠️ 帧尺寸 {frame.shape[:2]} 与第一帧 {shape[:2]} 不一致，缩放")
+                frame = cv2.resize(frame, (shape[1], shape[0]))
+            chunk.append(frame)
+            count += 1
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+            if self.max_frames and count >= self.max_frames:
+                break
+        if chunk:
+            yield chunk
+
+    def _iter_frames(self) -> Iterator[np.ndarray]:
+        if self.kind == 'video':
+            capture = cv2.VideoCapture(self.files[0])
+            if not capture.isOpened():
+                raise ValueError(f"无法打开视频: {self.files[0]}")
+            try:
+                while True:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    yield frame
+            finally:
+                capture.release()
+        else:
+            for image_file in self.files:
+                frame = cv2.imread(image_file)
+                if frame is None:
+                    raise ValueError(f"无法读取图像: {image_file}")
+                yield frame
+
+
+def _npy_header(shape: Tuple[int, ...], dtype) -> bytes:
+    """npy 1.0格式头，补齐到固定长度（帧数改变时可以原地改写）"""
+    header = repr({'descr': np.dtype(dtype).str, 'fortran_order': False, 'shape': tuple(shape)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    if len(header) + 10 != NPY_HEADER_SIZE:
+        raise ValueError(f"npy头过长: {shape}")
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class FrameArrayWriter:
+    """按块顺序写入 (N,...) 数组到 .npy 文件（普通文件写，不占用进程内存），关闭时写入实际帧数"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.frame_shape = None
+        self.dtype = None
+        self._file = None
+
+    def write(self, frames):
+        if not len(frames):
+            return
+        if self._file is None:
+            self.frame_shape = tuple(frames[0].shape)
+            self.dtype = np.asarray(frames[0]).dtype
+            self._file = open(self.path + '.tmp', 'wb')
+            self._file.write(_npy_header((0, *self.frame_shape), self.dtype))
+        for frame in frames:
+            frame = np.ascontiguousarray(frame, dtype=self.dtype)
+            if frame.shape != self.frame_shape:
+                raise ValueError(f"帧形状 {frame.shape} 与 {self.frame_shape} 不一致")
+            self._file.write(frame.tobytes())
+            self.count += 1
+
+    def close(self) -> int:
+        """写入帧数并原子替换目标文件，返回帧数"""
+        if self._file is None:
+            return 0
+        self._file.seek(0)
+        self._file.write(_npy_header((self.count, *self.frame_shape), self.dtype))
+        self._file.close()
+        self._file = None
+        os.replace(self.path + '.tmp', self.path)
+        return self.count
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self.path + '.tmp'):
+                os.remove(self.path + '.tmp')
+
+
+def iter_array_chunks(path: str, chunk_size: Optional[int] = None) -> Iterator[List[np.ndarray]]:
+    """按块读取 .npy 数组（普通文件读，不mmap，读过的块不常驻内存）"""
+    chunk_size = chunk_size or get_chunk_size()
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        frame_size = int(np.prod(shape[1:], dtype=np.int64))
+        for start in range(0, shape[0], chunk_size):
+            count = min(chunk_size, shape[0] - start)
+            data = np.fromfile(f, dtype=dtype, count=count * frame_size)
+            if data.size != count * frame_size:
+                raise ValueError(f"数组文件不完整: {path}")
+            yield list(data.reshape(count, *shape[1:]))
+
+
+def iter_frame_chunks(path: str, chunk_size: Optional[int] = None) -> Iterator[List[np.ndarray]]:
+    """按块读取模板帧文件（.npy 原始帧或 .pack 压缩帧）"""
+    if path.endswith('.pack'):
+        from core.encoded_frames import iter_pack_chunks
+        return iter_pack_chunks(path, chunk_size or get_chunk_size())
+    return iter_array_chunks(path, chunk_size)
+
+
+def attach_frame_arrays(cache_data: Dict, cache_dir: str) -> Dict:
+    """缓存中记录了帧/mask数组文件时，以只读mmap挂载为 frame_list_cycle / mask_list_cycle
+    （.pack 的帧是压缩格式，挂载为后台预取解码的 EncodedFrameCycle；
+    .npz 的mask是裁剪+RLE格式，挂载为按下标解码的 PackedMaskCycle）"""
+    for key, file_key in (('frame_list_cycle', 'frame_file'), ('mask_list_cycle', 'mask_file')):
+        file_name = cache_data.get(file_key)
+        if file_name and file_name.endswith('.pack'):
+            from core.encoded_frames import EncodedFrameCycle
+            cache_data[key] = EncodedFrameCycle(os.path.join(cache_dir, file_name))
+        elif file_name and file_name.endswith('.npz'):
+            from core.template_masks import PackedMaskCycle
+            cache_data[key] = PackedMaskCycle(os.path.join(cache_dir, file_name))
+        elif file_name:
+            cache_data[key] = np.load(os.path.join(cache_dir, file_name), mmap_mode='r')
+    return cache_data
+
+
+# ===== 性能测试（合成视频 + CPU替身模型） =====
+
+def write_synthetic_video(path: str, seconds: float = 10.0, width: int = 1920, height: int = 1080, fps: int = 25):
+    """合成说话人视频: 静态背景 + 轻微移动、眨眼的"人脸"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    background = np.full((height, width, 3), (90, 100, 110), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        frame = background.copy()
+        cx = width // 2 + int(20 * np.sin(i / 25))
+        cy = height // 2 + int(10 * np.cos(i / 30))
+        cv2.ellipse(frame, (cx, cy), (width // 10, height // 4), 0, 0, 360, (150, 170, 210), -1)
+        eye_h = 2 if i % 75 < 4 else 12  # 眨眼
+        for dx in (-width // 30, width // 30):
+            cv2.ellipse(frame, (cx + dx, cy - height // 14), (width // 80, eye_h), 0, 0, 360, (50, 50, 50), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def benchmark_video_preprocessing(seconds: float = 10.0, width: int = 1920, height: int = 1080):
+    """视频模板预处理吞吐（帧/秒）和峰值RSS，验证缓存可以挂载且循环顺序正确"""
+    import pickle
+    import tempfile
+    from core.preprocessing import OptimizedPreprocessor
+
+    print(f"🧪 测试视频模板预处理（{seconds:.0f}秒 {width}x{height} 合成视频 + CPU替身模型）...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'template.mp4')
+        write_synthetic_video(video_path, seconds, width, height)
+        rss_before = peak_rss_mb()
+
+        preprocessor = OptimizedPreprocessor()
+        preprocessor.initialize_standin_models('cpu')
+        start = time.perf_counter()
+        assert preprocessor.preprocess_template_ultra_fast(video_path, tmp_dir, 'video_template')
+        elapsed = time.perf_counter() - start
+
+        cache_dir = os.path.join(tmp_dir, 'video_template')
+        with open(os.path.join(cache_dir, 'video_template_preprocessed.pkl'), 'rb') as f:
+            cache_data = attach_frame_arrays(pickle.load(f), cache_dir)
+        num_frames = len(cache_data['frame_list_cycle'])
+        assert num_frames == int(seconds * 25), num_frames
+        assert len(cache_data['input_latent_list_cycle']) == len(cache_data['coord_list_cycle']) == num_frames
+        # 循环顺序: 缓存帧与源视频逐帧一致
+        source_chunk = next(TemplateSource(video_path).iter_chunks(8))
+        assert all(np.array_equal(a, b) for a, b in zip(source_chunk, cache_data['frame_list_cycle'][:8]))
+
+        cache_size = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
+        raw_size = num_frames * height * width * 3
+        print(f"  {num_frames}帧, 耗时 {elapsed:.1f}秒, 吞吐 {num_frames / elapsed:.1f} 帧/秒")
+        print(f"  峰值RSS {peak_rss_mb():.0f}MB（预处理前 {rss_before:.0f}MB，全部帧常驻内存需 {raw_size / 1024 / 1024:.0f}MB）")
+        print(f"  缓存 {cache_size / 1024 / 1024:.0f}MB, 循环顺序正确 ✅")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='视频模板预处理性能测试')
+    parser.add_argument('--seconds', type=float, default=10.0, help='合成视频时长（60秒需要约12GB磁盘）')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+    benchmark_video_preprocessing(args.seconds, args.width, args.height)
@@ -2,6 +2,11 @@
 """
 模板管理器 - 通用核心功能
 处理模板的预处理、删除、验证等操作
+
+批量导入: preprocess-batch 读取目录或清单（CSV/JSON: 模板ID -> 图片/视频路径），
+用预处理工作池（core/preprocess_pool.py）并行处理；缓存与源文件和参数一致的模板直接跳过，
+中断后重新执行即可继续（已完成的模板跳过，未完成的模板复用已完成的阶段）。
+list / verify 不加载模型，多线程并行检查
 """
 
 import os
@@ -10,7 +15,10 @@ import json
 import shutil
 import pickle
 import argparse
+import time
+import csv
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -19,7 +27,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DEFAULT_TEMPLATE_CACHE_DIR = os.environ.get('MUSE_TEMPLATE_CACHE_DIR', '/opt/musetalk/template_cache')
 
 def preprocess_template(template_id, image_path, output_dir=None, bbox_shift=0):
-    """预处理模板"""
+    """预处理模板（分阶段缓存: 只重算输入或参数变化的阶段，全部复用时不加载模型）"""
     try:
         from core.preprocessing import OptimizedPreprocessor
         
@@ -28,15 +36,15 @@ def preprocess_template(template_id, image_path, output_dir=None, bbox_shift=0):
         
         print(f"🔄 开始预处理模板: {template_id}")
         
-        # 创建预处理器并初始化模型
+        # 创建预处理器（模型在需要重算的阶段用到时才初始化）
         preprocessor = OptimizedPreprocessor()
-        preprocessor.initialize_models()
         
         # 执行预处理
         success = preprocessor.preprocess_template_ultra_fast(
             template_path=image_path,
             output_dir=output_dir,
-            template_id=template_id
+            template_id=template_id,
+            bbox_shift=bbox_shift
         )
         
         if success:
@@ -71,8 +79,8 @@ def delete_template(template_id, templates_dir=None):
         print(f"⚠️ 模板不存在: {template_id}")
         return False
 
-def verify_template(template_id, templates_dir=None):
-    """验证模板预处理数据是否完整"""
+def verify_template(template_id, templates_dir=None, quiet=False):
+    """验证模板预处理数据是否完整（必要文件存在，帧/mask数组帧数与元数据一致，不加载模型）"""
     if templates_dir is None:
         templates_dir = DEFAULT_TEMPLATE_CACHE_DIR
     
@@ -92,14 +100,81 @@ def verify_template(template_id, templates_dir=None):
             missing_files.append(file)
     
     if missing_files:
-        print(f"❌ 模板 {template_id} 缺少文件: {missing_files}")
+        if not quiet:
+            print(f"❌ 模板 {template_id} 缺少文件: {missing_files}")
+        return False
+    
+    # 帧数组（分阶段缓存）只读npy头检查帧数
+    problem = _check_frame_arrays(template_dir, template_id)
+    if problem:
+        if not quiet:
+            print(f"❌ 模板 {template_id} {problem}")
         return False
     
-    print(f"✅ 模板 {template_id} 验证通过")
+    if not quiet:
+        print(f"✅ 模板 {template_id} 验证通过")
     return True
 
-def list_templates(templates_dir=None):
-    """列出所有已预处理的模板"""
+def _check_frame_arrays(template_dir, template_id):
+    """帧/mask/latent数组与元数据帧数一致，返回问题描述（没有问题返回None）"""
+    import numpy as np
+    try:
+        with open(os.path.join(template_dir, f"{template_id}_metadata.json"), 'r', encoding='utf-8') as f:
+            frame_count = json.load(f).get('frame_count')
+    except Exception as e:
+        return f"元数据无法读取: {e}"
+    for name in ('frames', 'masks', 'latents'):
+        path = os.path.join(template_dir, f"{template_id}_{name}.npy")
+        if not os.path.exists(path):
+            continue  # 旧格式缓存（帧在pkl中）
+        try:
+            with open(path, 'rb') as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, _ = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, _ = np.lib.format.read_array_header_2_0(f)
+        except Exception as e:
+            return f"{name}数组损坏: {e}"
+        if frame_count is not None and shape[0] != frame_count:
+            return f"{name}数组帧数 {shape[0]} 与元数据 {frame_count} 不一致"
+    for name in os.listdir(template_dir):
+        if name.startswith(f"{template_id}_frames.") and name.endswith('.pack'):
+            from core.encoded_frames import read_pack_index
+            try:
+                count = read_pack_index(os.path.join(template_dir, name))['count']
+            except Exception as e:
+                return f"压缩帧文件损坏: {e}"
+            if frame_count is not None and count != frame_count:
+                return f"压缩帧数 {count} 与元数据 {frame_count} 不一致"
+    mask_path = os.path.join(template_dir, f"{template_id}_masks.npz")
+    if os.path.exists(mask_path):
+        try:
+            with np.load(mask_path) as data:
+                mask_count = len(data['shapes'])
+        except Exception as e:
+            return f"mask数据损坏: {e}"
+        if frame_count is not None and mask_count != frame_count:
+            return f"mask帧数 {mask_count} 与元数据 {frame_count} 不一致"
+    return None
+
+def verify_templates(template_ids=None, templates_dir=None, workers=8):
+    """并行验证多个模板（不指定时验证目录下所有模板），返回 {template_id: 是否通过}"""
+    if templates_dir is None:
+        templates_dir = DEFAULT_TEMPLATE_CACHE_DIR
+    if template_ids is None:
+        if not os.path.exists(templates_dir):
+            print(f"⚠️ 模板目录不存在: {templates_dir}")
+            return {}
+        template_ids = sorted(item for item in os.listdir(templates_dir)
+                              if os.path.isdir(os.path.join(templates_dir, item)) and not item.startswith('.'))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        quiet = len(template_ids) > 1
+        results = executor.map(lambda t: verify_template(t, templates_dir, quiet=quiet), template_ids)
+        return dict(zip(template_ids, results))
+
+def list_templates(templates_dir=None, workers=8):
+    """列出所有已预处理的模板（并行验证）"""
     if templates_dir is None:
         templates_dir = DEFAULT_TEMPLATE_CACHE_DIR
     
@@ -107,24 +182,139 @@ def list_templates(templates_dir=None):
         print(f"⚠️ 模板目录不存在: {templates_dir}")
         return []
     
-    templates = []
-    for item in os.listdir(templates_dir):
-        item_path = os.path.join(templates_dir, item)
-        if os.path.isdir(item_path):
-            # 验证是否为有效模板
-            if verify_template(item, templates_dir):
-                templates.append(item)
+    results = verify_templates(None, templates_dir, workers)
+    return [template_id for template_id, ok in results.items() if ok]
+
+def load_batch_entries(source, default_bbox_shift=0):
+    """批量导入的模板列表 [(template_id, 模板路径, bbox_shift)]
+    
+    source 可以是:
+      - 目录: 每个图片/视频文件（ID为文件名）或子目录（ID为目录名）是一个模板
+      - CSV: 列 template_id(或id), path(或image_path/template_path), 可选 bbox_shift
+      - JSON: {"ID": "路径"} 或 [{"template_id": ..., "path": ..., "bbox_shift": ...}]
+    相对路径按清单文件所在目录解析
+    """
+    from core.template_frames import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+    
+    if os.path.isdir(source):
+        entries = []
+        for item in sorted(os.listdir(source)):
+            path = os.path.join(source, item)
+            if os.path.isdir(path) or Path(item).suffix.lower() in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+                entries.append((Path(item).stem if os.path.isfile(path) else item, path, default_bbox_shift))
+        return entries
     
-    return templates
+    base_dir = os.path.dirname(os.path.abspath(source))
+    if source.lower().endswith('.json'):
+        with open(source, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and 'templates' in data:
+            data = data['templates']
+        rows = ([{'template_id': k, 'path': v} for k, v in data.items()] if isinstance(data, dict) else data)
+    else:
+        with open(source, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+    
+    entries = []
+    for row in rows:
+        template_id = row.get('template_id') or row.get('id')
+        path = row.get('path') or row.get('image_path') or row.get('template_path')
+        if not template_id or not path:
+            print(f"⚠️ 跳过无效的清单行: {row}")
+            continue
+        bbox_shift = row.get('bbox_shift')
+        bbox_shift = int(bbox_shift) if bbox_shift not in (None, '') else default_bbox_shift
+        entries.append((str(template_id), os.path.join(base_dir, path), bbox_shift))
+    return entries
+
+def preprocess_batch(source, output_dir=None, workers=None, devices=None, bbox_shift=0, force=False,
+                     preprocessor_factory=None, model_signature=None):
+    """批量预处理模板，返回汇总 {'total','skipped','completed','failed','seconds','frames',...}
+    
+    Args:
+        source: 目录或CSV/JSON清单
+        workers: 每个设备的工作线程数（默认 MUSE_PREPROCESS_WORKERS_PER_DEVICE）
+        devices: 预处理设备列表（默认 MUSE_PREPROCESS_DEVICES / 所有GPU）
+        force: 不跳过已是最新的模板（仍按阶段哈希复用）
+    """
+    from core.preprocess_pool import PreprocessWorkerPool, default_preprocessor_factory
+    from core.template_stages import template_up_to_date, MUSETALK_MODEL_SIGNATURE
+    
+    if output_dir is None:
+        output_dir = DEFAULT_TEMPLATE_CACHE_DIR
+    start = time.time()
+    entries = load_batch_entries(source, bbox_shift)
+    print(f"📦 批量预处理: {len(entries)} 个模板 -> {output_dir}")
+    
+    # 1. 跳过已是最新的模板（只读清单和源文件哈希，不加载模型，并行检查）
+    if model_signature is None:
+        model_signature = MUSETALK_MODEL_SIGNATURE
+    if force:
+        pending = entries
+    else:
+        def is_pending(entry):
+            template_id, path, shift = entry
+            return not template_up_to_date(os.path.join(output_dir, template_id), template_id, path,
+                                           shift, model_signature)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            flags = list(executor.map(is_pending, entries))
+        pending = [entry for entry, flag in zip(entries, flags) if flag]
+    skipped = len(entries) - len(pending)
+    print(f"⏭️ 已是最新: {skipped} 个, 待处理: {len(pending)} 个")
+    
+    # 2. 工作池并行处理
+    jobs = []
+    if pending:
+        pool = PreprocessWorkerPool(devices, workers, preprocessor_factory or default_preprocessor_factory)
+        try:
+            jobs = [pool.submit(template_id, path, output_dir, bbox_shift=shift)
+                    for template_id, path, shift in pending]
+            for index, job in enumerate(jobs, 1):
+                job.wait()
+                print(f"[{index}/{len(jobs)}] {'✅' if job.success else '❌'} {job.template_id}"
+                      f" ({job.snapshot()['run_seconds']:.1f}秒{', ' + job.error if job.error else ''})")
+        finally:
+            pool.shutdown()
+    
+    # 3. 汇总吞吐
+    elapsed = time.time() - start
+    completed = [job for job in jobs if job.success]
+    failed = [job.template_id for job in jobs if not job.success]
+    frames = 0
+    for job in completed:
+        try:
+            with open(os.path.join(output_dir, job.template_id, f"{job.template_id}_metadata.json"), 'r', encoding='utf-8') as f:
+                frames += json.load(f).get('frame_count', 0)
+        except Exception:
+            pass
+    summary = {
+        'total': len(entries),
+        'skipped': skipped,
+        'completed': len(completed),
+        'failed': failed,
+        'seconds': round(elapsed, 2),
+        'frames': frames,
+        'templates_per_second': round(len(completed) / elapsed, 3) if elapsed > 0 else 0.0,
+        'frames_per_second': round(frames / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    print(f"📊 批量预处理完成: {len(completed)} 成功, {len(failed)} 失败, {skipped} 跳过, "
+          f"耗时 {elapsed:.1f}秒, {summary['templates_per_second']} 模板/秒, {summary['frames_per_second']} 帧/秒")
+    if failed:
+        print(f"❌ 失败的模板: {failed}")
+    return summary
 
 def main():
     parser = argparse.ArgumentParser(description='模板管理工具')
-    parser.add_argument('action', choices=['preprocess', 'delete', 'verify', 'list'],
+    parser.add_argument('action', choices=['preprocess', 'preprocess-batch', 'delete', 'verify', 'list'],
                         help='要执行的操作')
     parser.add_argument('--template_id', help='模板ID')
     parser.add_argument('--image_path', help='模板图片路径')
     parser.add_argument('--output_dir', help='输出目录', default=DEFAULT_TEMPLATE_CACHE_DIR)
-    parser.add_argument('--bbox_shift', type=int, default=0, help='边界框偏移')
+    parser.add_argument('--bbox_shift', type=int, default=0, help='人脸框上边界偏移（修改后只重算解析/编码/融合阶段）')
+    parser.add_argument('--source', help='批量预处理: 模板目录或CSV/JSON清单')
+    parser.add_argument('--workers', type=int, default=None, help='批量预处理: 每个设备的工作线程数; list/verify: 并行检查线程数')
+    parser.add_argument('--devices', default=None, help='批量预处理设备，逗号分隔（默认所有GPU）')
+    parser.add_argument('--force', action='store_true', help='批量预处理: 不跳过已是最新的模板')
     
     args = parser.parse_args()
     
@@ -135,6 +325,14 @@ def main():
         success = preprocess_template(args.template_id, args.image_path, args.output_dir, args.bbox_shift)
         sys.exit(0 if success else 1)
     
+    elif args.action == 'preprocess-batch':
+        if not args.source:
+            print("❌ 批量预处理需要提供 --source（目录或CSV/JSON清单）")
+            sys.exit(1)
+        devices = args.devices.split(',') if args.devices else None
+        summary = preprocess_batch(args.source, args.output_dir, args.workers, devices, args.bbox_shift, args.force)
+        sys.exit(0 if not summary['failed'] else 1)
+    
     elif args.action == 'delete':
         if not args.template_id:
             print("❌ 删除需要提供 --template_id")
@@ -143,17 +341,20 @@ def main():
         sys.exit(0 if success else 1)
     
     elif args.action == 'verify':
-        if not args.template_id:
-            print("❌ 验证需要提供 --template_id")
-            sys.exit(1)
-        success = verify_template(args.template_id, args.output_dir)
-        sys.exit(0 if success else 1)
+        # 不指定 --template_id 时验证所有模板
+        template_ids = [args.template_id] if args.template_id else None
+        results = verify_templates(template_ids, args.output_dir, args.workers or 8)
+        for template_id, ok in results.items():
+            print(f"  {'✅' if ok else '❌'} {template_id}")
+        failed = [t for t, ok in results.items() if not ok]
+        print(f"📋 验证 {len(results)} 个模板: {len(results) - len(failed)} 通过, {len(failed)} 失败")
+        sys.exit(0 if results and not failed else 1)
     
     elif args.action == 'list':
-        templates = list_templates(args.output_dir)
+        templates = list_templates(args.output_dir, args.workers or 8)
         print(f"📋 找到 {len(templates)} 个模板:")
         for t in templates:
             print(f"  - {t}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
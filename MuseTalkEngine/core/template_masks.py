@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+模板融合mask的紧凑存储 - 每帧mask裁剪到crop_box（与 get_image_blending 的 mask_array 尺寸一致），
+二值化后按行优先游程编码（RLE），整个模板的mask存为一个 .npz；
+推理时 PackedMaskCycle 按循环帧下标解码，解码结果按下标缓存（LRU）
+
+配置（环境变量）:
+    MUSE_MASK_CACHE_FRAMES=64   每个模板缓存的已解码mask帧数
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MASK_FORMAT = 'rle'
+
+
+def get_mask_cache_frames() -> int:
+    """每个模板缓存的已解码mask帧数"""
+    return max(1, int(os.environ.get('MUSE_MASK_CACHE_FRAMES', '64')))
+
+
+def encode_mask_rle(mask: np.ndarray) -> Tuple[int, np.ndarray]:
+    """二值mask（>=128为前景）-> (第一段的值 0/1, 各段长度 uint32)"""
+    flat = np.asarray(mask).ravel() >= 128
+    if flat.size == 0:
+        return 0, np.zeros(0, dtype=np.uint32)
+    boundaries = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]))
+    return int(flat[0]), np.diff(boundaries).astype(np.uint32)
+
+
+def decode_mask_rle(first: int, runs: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """RLE -> uint8 mask (h,w)，前景255"""
+    values = ((np.arange(len(runs)) + first) % 2).astype(np.uint8) * 255
+    return np.repeat(values, runs).reshape(shape)
+
+
+class PackedMaskWriter:
+    """按块写入每帧（尺寸可以不同的）mask，关闭时写出一个 .npz（游程数据很小，在内存中累积）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._shapes: List[Tuple[int, int]] = []
+        self._firsts: List[int] = []
+        self._runs: List[np.ndarray] = []
+
+    def write(self, masks):
+        for mask in masks:
+            mask = np.asarray(mask)
+            if mask.ndim == 3:
+                mask = mask[..., 0]
+            first, runs = encode_mask_rle(mask)
+            self._shapes.append(mask.shape)
+            self._firsts.append(first)
+            self._runs.append(runs)
+            self.count += 1
+
+    def close(self) -> int:
+        """写出并原子替换目标文件，返回帧数"""
+        if self.count == 0:
+            return 0
+        lengths = np.array([len(runs) for runs in self._runs], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        with open(self.path + '.tmp', 'wb') as f:
+            np.savez(f, format=np.array(MASK_FORMAT),
+                     shapes=np.array(self._shapes, dtype=np.int32),
+                     firsts=np.array(self._firsts, dtype=np.uint8),
+                     offsets=offsets,
+                     runs=np.concatenate(self._runs) if self._runs else np.zeros(0, dtype=np.uint32))
+        os.replace(self.path + '.tmp', self.path)
+        return self.count
+
+    def abort(self):
+        self._shapes, self._firsts, self._runs = [], [], []
+        if os.path.exists(self.path + '.tmp'):
+            os.remove(self.path + '.tmp')
+
+
+class PackedMaskCycle:
+    """模板的mask循环序列: mask_list_cycle[i] 解码出 uint8 mask（get_image_blending 直接使用），
+    float_mask(i) 给出 [0,1] float32 mask（数值融合使用），两者都按下标LRU缓存"""
+
+    def __init__(self, path: str, cache_frames: Optional[int] = None):
+        with np.load(path) as data:
+            if str(data['format']) != MASK_FORMAT:
+                raise ValueError(f"不支持的mask格式: {data['format']}")
+            self.shapes = data['shapes']
+            self.firsts = data['firsts']
+            self.offsets = data['offsets']
+            self.runs = data['runs']
+        self.path = path
+        self.cache_frames = cache_frames or get_mask_cache_frames()
+        self._cache = OrderedDict()  # (下标, 是否float) -> mask
+        self._lock = threading.Lock()  # 合成线程池并发读取
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self._get(index, False)
+
+    def float_mask(self, index: int) -> np.ndarray:
+        return self._get(index, True)
+
+    def _get(self, index: int, as_float: bool) -> np.ndarray:
+        if index < 0:
+            index += len(self)
+        key = (index, as_float)
+        with self._lock:
+            mask = self._cache.get(key)
+            if mask is not None:
+                self._cache.move_to_end(key)
+                return mask
+        start, end = self.offsets[index], self.offsets[index + 1]
+        mask = decode_mask_rle(int(self.firsts[index]), self.runs[start:end], tuple(self.shapes[index]))
+        if as_float:
+            mask = mask.astype(np.float32) / 255.0
+        mask.setflags(write=False)  # 缓存共享，调用方不能原地修改
+        with self._lock:
+            self._cache[key] = mask
+            while len(self._cache) > self.cache_frames:
+                self._cache.popitem(last=False)
+        return mask
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.shapes.nbytes + self.firsts.nbytes + self.offsets.nbytes + self.runs.nbytes)
+
+
+def crop_masks(face_boxes: Sequence[Sequence[int]]) -> List[np.ndarray]:
+    """每帧融合mask: 与crop_box同尺寸的全白mask（融合区域由crop_box决定）"""
+    return [np.full((max(1, y2 - y1), max(1, x2 - x1)), 255, dtype=np.uint8) for x1, y1, x2, y2 in face_boxes]
+
+
+# ===== 性能测试（合成视频 + CPU替身模型） =====
+
+def benchmark_mask_storage(seconds: float = 4.0, width: int = 1920, height: int = 1080):
+    """样例模板: 全分辨率uint8 mask vs 裁剪+RLE 的缓存大小、解码耗时和缓存命中"""
+    import time
+    import pickle
+    import tempfile
+    from core.preprocessing import OptimizedPreprocessor
+    from core.template_frames import write_synthetic_video, attach_frame_arrays
+    from core.template_masks import PackedMaskCycle  # 直接运行本文件时与挂载用的是同一个类
+
+    print(f"🧪 测试融合mask紧凑存储（{seconds:.0f}秒 {width}x{height} 合成视频 + CPU替身模型）...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'template.mp4')
+        write_synthetic_video(video_path, seconds, width, height)
+        preprocessor = OptimizedPreprocessor()
+        preprocessor.initialize_standin_models('cpu')
+        assert preprocessor.preprocess_template_ultra_fast(video_path, tmp_dir, 'masks')
+
+        cache_dir = os.path.join(tmp_dir, 'masks')
+        with open(os.path.join(cache_dir, 'masks_preprocessed.pkl'), 'rb') as f:
+            cache_data = attach_frame_arrays(pickle.load(f), cache_dir)
+        masks = cache_data['mask_list_cycle']
+        assert isinstance(masks, PackedMaskCycle)
+        num_frames = len(masks)
+
+        packed_size = os.path.getsize(os.path.join(cache_dir, cache_data['mask_file']))
+        full_size = num_frames * height * width  # 原来每帧一个全分辨率uint8 mask
+
+        # 与 get_image_blending 的约定一致: mask尺寸 == crop_box尺寸
+        for i in range(num_frames):
+            x1, y1, x2, y2 = cache_data['mask_coords_list_cycle'][i]
+            assert masks[i].shape == (y2 - y1, x2 - x1) and masks[i].dtype == np.uint8
+        float_mask = masks.float_mask(0)
+        assert float_mask.dtype == np.float32 and float_mask.max() == 1.0
+
+        cold = PackedMaskCycle(os.path.join(cache_dir, cache_data['mask_file']))
+        start = time.perf_counter()
+        for i in range(num_frames):
+            cold.float_mask(i)
+        decode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(num_frames - min(num_frames, cold.cache_frames), num_frames):
+            cold.float_mask(i)
+        cached_time = time.perf_counter() - start
+
+    # 非平凡mask（椭圆人脸区域）编解码无损
+    import cv2
+    ellipse = np.zeros((320, 256), dtype=np.uint8)
+    cv2.ellipse(ellipse, (128, 170), (110, 140), 0, 0, 360, 255, -1)
+    first, runs = encode_mask_rle(ellipse)
+    assert np.array_equal(decode_mask_rle(first, runs, ellipse.shape), ellipse)
+
+    print(f"  全分辨率uint8 mask: {full_size / 1024 / 1024:.1f}MB")
+    print(f"  裁剪 + RLE        : {packed_size / 1024:.1f}KB（缩小 {full_size / packed_size:.0f} 倍）")
+    print(f"  椭圆mask {ellipse.size}B -> RLE {runs.nbytes}B, 编解码无损")
+    print(f"  解码 {num_frames}帧float mask: {decode_time * 1000:.1f}ms, 缓存命中: {cached_time * 1000:.2f}ms ✅")
+
+
+if __name__ == "__main__":
+    benchmark_mask_storage()
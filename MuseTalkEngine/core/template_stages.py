@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+模板预处理分阶段缓存 - 解码 → 人脸检测 → 面部解析 → VAE编码 → 融合几何
+每个阶段的输出是模板目录下的 .npy 文件（融合mask是裁剪+RLE的 .npz），阶段哈希由上游阶段哈希和本阶段参数计算
+（解码阶段的上游是模板源文件内容）；哈希不变的阶段直接复用，
+修改下游参数（如 bbox_shift）只重跑下游阶段。
+模板目录下的 {template_id}_manifest.json 记录各阶段哈希、参数、帧数和耗时
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ('decode', 'landmarks', 'parsing', 'latents', 'blend')
+
+# 各阶段的输出文件（{template_id}_xxx，没有扩展名的是 .npy；解码阶段的文件名由帧存储格式决定）
+STAGE_FILES = {
+    'decode': ('frames',),
+    'landmarks': ('landmarks',),
+    'parsing': ('parsing',),
+    'latents': ('latents',),
+    'blend': ('masks.npz', 'mask_coords'),
+}
+
+# 需要模型的阶段（全部复用时不加载模型）
+MODEL_STAGES = ('landmarks', 'parsing', 'latents')
+
+NO_FACE_BOX = (-1, -1, -1, -1)  # 人脸检测结果中表示检测失败
+
+MUSETALK_MODEL_SIGNATURE = 'musetalk'  # MuseTalk模型的阶段哈希签名（不导入torch即可读取）
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    """文件内容的sha1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_digest(source) -> str:
+    """模板源（TemplateSource）的内容哈希: 所有源文件内容 + 帧数上限"""
+    digest = hashlib.sha1()
+    for path in source.files:
+        digest.update(file_digest(path).encode())
+    digest.update(f"max_frames={source.max_frames}".encode())
+    return digest.hexdigest()
+
+
+def stage_hash(stage: str, upstream: str, params: Dict) -> str:
+    """阶段哈希 = hash(阶段名, 上游哈希, 本阶段参数)"""
+    payload = json.dumps({'stage': stage, 'upstream': upstream, 'params': params}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def compute_stage_hashes(source_hash: str, model_signature: str, bbox_shift: int = 0,
+                         face_size: int = 256) -> Dict[str, Dict]:
+    """各阶段的 {'hash', 'params'}
+
+    依赖关系: decode <- 源文件; landmarks <- decode; parsing/blend <- landmarks + bbox_shift;
+    latents <- parsing（VAE编码用到裁剪图和解析mask）
+    """
+    params = {
+        'decode': ({'source': source_hash}, ''),
+        'landmarks': ({'detector': model_signature, 'redetect': 'face_alignment'}, 'decode'),
+        'parsing': ({'parser': model_signature, 'bbox_shift': bbox_shift, 'face_size': face_size, 'box': 'clamped'},
+                    'landmarks'),
+        'latents': ({'vae': model_signature}, 'parsing'),
+        'blend': ({'bbox_shift': bbox_shift, 'mask_format': 'rle', 'box': 'clamped'}, 'landmarks'),
+    }
+    hashes = {}
+    for stage in STAGES:
+        stage_params, upstream = params[stage]
+        upstream_hash = hashes[upstream]['hash'] if upstream else ''
+        hashes[stage] = {'hash': stage_hash(stage, upstream_hash, stage_params), 'params': stage_params}
+    return hashes
+
+
+def apply_bbox_shift(box: Sequence[int], bbox_shift: int, height: int) -> List[int]:
+    """上边界按 bbox_shift 移动（与MuseTalk get_landmark_and_bbox(upperbondrange) 一致:
+    半脸中心下移 bbox_shift，上边界随之移动 2×bbox_shift）"""
+    x1, y1, x2, y2 = [int(v) for v in box]
+    if bbox_shift:
+        y1 = int(np.clip(y1 + 2 * bbox_shift, 0, min(height, y2) - 1))
+    return [x1, y1, x2, y2]
+
+
+def clamp_box(box: Sequence[int], height: int, width: int) -> List[int]:
+    """人脸框限制在帧内（至少1像素宽高），避免负坐标切片从帧的另一侧取到空图"""
+    x1, y1, x2, y2 = [int(v) for v in box]
+    x1 = int(np.clip(x1, 0, width - 1))
+    y1 = int(np.clip(y1, 0, height - 1))
+    x2 = int(np.clip(x2, x1 + 1, width))
+    y2 = int(np.clip(y2, y1 + 1, height))
+    return [x1, y1, x2, y2]
+
+
+def resolve_face_boxes(raw_boxes: np.ndarray, frame_shape, bbox_shift: int = 0) -> List[List[int]]:
+    """人脸检测结果 -> 每帧的人脸框
+
+    检测失败的帧沿用前一帧的人脸框（开头几帧失败时用第一个有效框，全部失败时用默认边界框），
+    然后按 bbox_shift 调整上边界，最后限制在帧内
+    """
+    h, w = frame_shape[:2]
+    valid = [tuple(int(v) for v in box) != NO_FACE_BOX for box in raw_boxes]
+    first_valid = next((list(box) for box, ok in zip(raw_boxes, valid) if ok), None)
+    if first_valid is None:
+        margin = min(w, h) // 8
+        first_valid = [margin, margin, w - margin, h - margin]
+        print(f"警告: 没有检测到人脸，使用默认边界框: {first_valid}")
+    elif not all(valid):
+        print(f"警告: {valid.count(False)}帧没有检测到人脸，沿用相邻帧的人脸框")
+
+    boxes, last_box = [], first_valid
+    for box, ok in zip(raw_boxes, valid):
+        if ok:
+            last_box = [int(v) for v in box]
+        boxes.append(clamp_box(apply_bbox_shift(last_box, bbox_shift, h), h, w))
+    return boxes
+
+
+class StageManifest:
+    """模板目录下的阶段清单（阶段哈希/参数/帧数/耗时）"""
+
+    def __init__(self, template_dir: str, template_id: str, frame_storage: str = 'npy'):
+        self.template_dir = template_dir
+        self.template_id = template_id
+        self.frame_storage = frame_storage
+        self.path = os.path.join(template_dir, f"{template_id}_manifest.json")
+        self.data = {'template_id': template_id, 'params': {}, 'stages': {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except Exception as e:
+                print(f"⚠️ 阶段清单读取失败，全部阶段重新计算: {e}")
+
+    @property
+    def params(self) -> Dict:
+        return self.data.get('params', {})
+
+    @property
+    def stages(self) -> Dict:
+        return self.data.setdefault('stages', {})
+
+    def stage_path(self, stage: str, index: int = 0) -> str:
+        name = STAGE_FILES[stage][index]
+        if stage == 'decode':
+            # 帧存储格式不参与阶段哈希: 换格式只重跑解码阶段（新格式的文件不存在），下游阶段照常复用
+            from core.encoded_frames import frame_file_name
+            name = frame_file_name(self.frame_storage)
+        return os.path.join(self.template_dir, f"{self.template_id}_{name}{'' if '.' in name else '.npy'}")
+
+    def is_valid(self, stage: str, expected_hash: str) -> bool:
+        """阶段哈希一致且输出文件都存在"""
+        entry = self.stages.get(stage)
+        if not entry or entry.get('hash') != expected_hash:
+            return False
+        return all(os.path.exists(self.stage_path(stage, i)) for i in range(len(STAGE_FILES[stage])))
+
+    def invalidate(self, stage: str):
+        """重算前先移除记录（中途失败时不会误用写了一半的输出）"""
+        if self.stages.pop(stage, None) is not None:
+            self.save()
+
+    def record(self, stage: str, stage_info: Dict, frames: int, seconds: float):
+        self.stages[stage] = {
+            'hash': stage_info['hash'],
+            'params': stage_info['params'],
+            'frames': frames,
+            'seconds': round(seconds, 3),
+            'updated_at': time.time(),
+        }
+        self.save()
+
+    def mark_reused(self, stages: Sequence[str]):
+        for stage in STAGES:
+            if stage in self.stages:
+                self.stages[stage]['reused'] = stage in stages
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def load_manifest_params(template_dir: str, template_id: str) -> Optional[Dict]:
+    """已完成预处理的参数（没有清单时返回None）"""
+    path = os.path.join(template_dir, f"{template_id}_manifest.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('params', {})
+    except Exception:
+        return None
+
+
+def template_up_to_date(template_dir: str, template_id: str, template_path: str, bbox_shift: int = 0,
+                        model_signature: str = MUSETALK_MODEL_SIGNATURE) -> bool:
+    """模板缓存是否与源文件和参数一致（所有阶段哈希匹配且缓存文件存在，不加载模型）"""
+    from core.template_frames import TemplateSource
+    from core.encoded_frames import get_frame_storage
+    if not os.path.exists(os.path.join(template_dir, f"{template_id}_preprocessed.pkl")):
+        return False
+    manifest = StageManifest(template_dir, template_id, get_frame_storage())
+    if manifest.params.get('bbox_shift', 0) != bbox_shift:
+        return False
+    try:
+        hashes = compute_stage_hashes(source_digest(TemplateSource(template_path)), model_signature, bbox_shift)
+    except (OSError, ValueError):
+        return False
+    return all(manifest.is_valid(stage, hashes[stage]['hash']) for stage in STAGES)
+
+
+# ===== 性能测试（合成视频 + CPU替身模型） =====
+
+def benchmark_incremental_preprocessing(seconds: float = 4.0, width: int = 1280, height: int = 720):
+    """首次预处理 / 全部复用 / 只改bbox_shift 三次运行的耗时和重跑的阶段"""
+    import pickle
+    import tempfile
+    from core.preprocessing import OptimizedPreprocessor
+    from core.template_frames import write_synthetic_video, attach_frame_arrays
+
+    print(f"🧪 测试分阶段增量预处理（{seconds:.0f}秒 {width}x{height} 合成视频 + CPU替身模型）...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'template.mp4')
+        write_synthetic_video(video_path, seconds, width, height)
+        template_dir = os.path.join(tmp_dir, 'staged')
+
+        def run(label, bbox_shift):
+            preprocessor = OptimizedPreprocessor()
+            preprocessor.initialize_standin_models('cpu')
+            start = time.perf_counter()
+            assert preprocessor.preprocess_template_ultra_fast(video_path, tmp_dir, 'staged', bbox_shift=bbox_shift)
+            elapsed = time.perf_counter() - start
+            stages = StageManifest(template_dir, 'staged').stages
+            rerun = [stage for stage in STAGES if not stages[stage].get('reused')]
+            print(f"  {label}: {elapsed:.2f}秒, 重跑阶段: {', '.join(rerun) or '无'}")
+            with open(os.path.join(template_dir, 'staged_preprocessed.pkl'), 'rb') as f:
+                return attach_frame_arrays(pickle.load(f), template_dir), rerun
+
+        first, rerun = run('首次预处理        ', 0)
+        assert rerun == list(STAGES)
+        _, rerun = run('参数不变（全部复用）', 0)
+        assert rerun == []
+        shifted, rerun = run('bbox_shift=5       ', 5)
+        assert rerun == ['parsing', 'latents', 'blend'], rerun
+        assert shifted['coord_list_cycle'][0][1] == first['coord_list_cycle'][0][1] + 10
+        assert len(shifted['input_latent_list_cycle']) == len(first['frame_list_cycle']) == int(seconds * 25)
+        print("  只重跑下游阶段，缓存与全量预处理一致 ✅")
+
+
+if __name__ == "__main__":
+    benchmark_incremental_preprocessing()
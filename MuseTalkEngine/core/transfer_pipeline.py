@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+传输流水线 - 每个设备三缓冲（锁页内存）+ 独立的上传/计算/下载CUDA流，
+batch N+1 的上传和 batch N-1 的下载与 batch N 的 PE/UNet/VAE 计算重叠
+
+原来的路径从可分页内存 non_blocking 上传（实际同步），计算完后在默认流上逐帧拷回；
+CPU设备或关闭流水线时退化为逐batch顺序执行，输出与流水线完全相同
+
+配置（环境变量）:
+    MUSE_TRANSFER_PIPELINE=0   关闭流水线（逐batch顺序执行）
+    MUSE_PIPELINE_DEPTH=3      缓冲槽数（上传/计算/下载各占一个）
+"""
+
+import os
+import sys
+import time
+import contextlib
+from collections import deque
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.gpu_inference_pool import (
+    run_bucketed_inference, run_inference, run_latent_inference, infer_frames, predict_latents, model_dtype
+)
+
+
+def pipeline_enabled() -> bool:
+    """是否启用传输流水线"""
+    return os.environ.get('MUSE_TRANSFER_PIPELINE', '1') == '1'
+
+
+def get_pipeline_depth() -> int:
+    """缓冲槽数（至少1）"""
+    return max(1, int(os.environ.get('MUSE_PIPELINE_DEPTH', '3')))
+
+
+class _Slot:
+    """一个缓冲槽: 主机端输入/输出缓冲 + 下载完成事件"""
+
+    def __init__(self):
+        self.whisper = None
+        self.latent = None
+        self.frames = None
+        self.downloaded = None
+
+
+class TransferPipeline:
+    """单个设备的传输流水线（必须在该设备的专用推理线程中使用）"""
+
+    def __init__(self, device, gpu_models: dict, depth: Optional[int] = None, pipelined: Optional[bool] = None):
+        self.device = torch.device(device)
+        self.gpu_models = gpu_models
+        self.is_cuda = self.device.type == 'cuda'
+        self.depth = depth or get_pipeline_depth()
+        self.pipelined = pipeline_enabled() if pipelined is None else pipelined
+        self.dtype = model_dtype(gpu_models)
+        self.slots = [_Slot() for _ in range(self.depth)]
+        self.h2d_stream = self.compute_stream = self.d2h_stream = None
+        if self.is_cuda:
+            self.h2d_stream = torch.cuda.Stream(self.device)
+            self.compute_stream = torch.cuda.Stream(self.device)
+            self.d2h_stream = torch.cuda.Stream(self.device)
+        self.last_run = None
+
+    # ===== 流/事件（CPU上为空操作） =====
+
+    def _stream(self, stream):
+        return torch.cuda.stream(stream) if stream is not None else contextlib.nullcontext()
+
+    def _record(self, stream):
+        return stream.record_event() if stream is not None else None
+
+    def _wait(self, stream, event):
+        if stream is not None and event is not None:
+            stream.wait_event(event)
+
+    def _host_buffer(self, current: Optional[torch.Tensor], shape, dtype) -> torch.Tensor:
+        """复用槽位的主机缓冲（CUDA时为锁页内存），容量不够时按需扩大"""
+        if current is not None and current.dtype == dtype and current.shape[0] >= shape[0] \
+                and current.shape[1:] == tuple(shape[1:]):
+            return current
+        return torch.empty(tuple(shape), dtype=dtype, pin_memory=self.is_cuda)
+
+    # ===== 执行 =====
+
+    def run(self, batches: Iterable[Tuple[torch.Tensor, torch.Tensor]], timesteps,
+            resident_latents: Optional[torch.Tensor] = None, latents_only: bool = False) -> Iterator[np.ndarray]:
+        """按输入顺序逐个产出每个batch的uint8 BGR帧 (B,H,W,3)
+
+        Args:
+            batches: [(whisper_batch, latent_batch)]；给出resident_latents时第二项为循环索引
+            resident_latents: 设备上常驻的模板latent (N,8,32,32)，latent只按索引在设备上取
+            latents_only: 不做VAE解码，产出预测latent (B,4,32,32)（latent插值模式）
+        """
+        start = time.perf_counter()
+        stats = {'mode': 'pipelined' if self.pipelined else 'sequential', 'batches': 0, 'frames': 0}
+        timesteps = timesteps.to(self.device)
+        if self.pipelined:
+            outputs = self._run_pipelined(batches, timesteps, resident_latents, latents_only)
+        else:
+            outputs = self._run_sequential(batches, timesteps, resident_latents, latents_only)
+        for frames in outputs:
+            stats['batches'] += 1
+            stats['frames'] += len(frames)
+            yield frames
+        stats['seconds'] = round(time.perf_counter() - start, 4)
+        self.last_run = stats
+
+    def _run_sequential(self, batches, timesteps, resident_latents=None, latents_only=False):
+        """顺序路径: 上传 -> 计算 -> 解码拷回，逐batch执行"""
+        infer_fn = run_latent_inference if latents_only else run_inference
+        for whisper_batch, latent_batch in batches:
+            whisper_batch = whisper_batch.to(self.device, dtype=self.dtype)
+            if resident_latents is not None:
+                latent_batch = resident_latents.index_select(0, latent_batch.to(self.device))
+            else:
+                latent_batch = latent_batch.to(self.device, dtype=self.dtype)
+            yield run_bucketed_inference(self.gpu_models, whisper_batch, latent_batch, timesteps, infer_fn=infer_fn)
+
+    def _run_pipelined(self, batches, timesteps, resident_latents=None, latents_only=False):
+        """流水线路径: 最多depth个batch在途，槽位轮换复用"""
+        pending = deque()
+        infer_fn = predict_latents if latents_only else infer_frames
+        latent_dtype = torch.long if resident_latents is not None else self.dtype
+        if self.is_cuda:
+            # timesteps、常驻latent等输入在默认流上准备
+            self.compute_stream.wait_stream(torch.cuda.current_stream(self.device))
+
+        for index, (whisper_batch, latent_batch) in enumerate(batches):
+            # 槽位满时先取走最早的batch（它占用的正是本次要复用的槽位）
+            if len(pending) == self.depth:
+                yield self._finish(*pending.popleft())
+            slot = self.slots[index % self.depth]
+            num_frames = whisper_batch.shape[0]
+
+            # 1. 写入锁页缓冲，在上传流上异步上传
+            slot.whisper = self._host_buffer(slot.whisper, whisper_batch.shape, self.dtype)
+            slot.latent = self._host_buffer(slot.latent, latent_batch.shape, latent_dtype)
+            slot.whisper[:num_frames].copy_(whisper_batch)
+            slot.latent[:num_frames].copy_(latent_batch)
+            with self._stream(self.h2d_stream):
+                whisper_device = slot.whisper[:num_frames].to(self.device, non_blocking=True)
+                latent_device = slot.latent[:num_frames].to(self.device, non_blocking=True)
+            uploaded = self._record(self.h2d_stream)
+
+            # 2. 计算流等待上传完成后推理（按档位补齐，复用编译图）
+            self._wait(self.compute_stream, uploaded)
+            with self._stream(self.compute_stream):
+                if resident_latents is not None:
+                    latent_device = resident_latents.index_select(0, latent_device)
+                frames = run_bucketed_inference(self.gpu_models, whisper_device, latent_device, timesteps,
+                                                infer_fn=infer_fn)
+            computed = self._record(self.compute_stream)
+            if self.is_cuda:
+                # 上传流分配的张量在计算流上使用，避免被提前回收
+                whisper_device.record_stream(self.compute_stream)
+                latent_device.record_stream(self.compute_stream)
+
+            # 3. 下载流等待计算完成后把整批uint8帧（或预测latent）拷回锁页缓冲
+            self._wait(self.d2h_stream, computed)
+            slot.frames = self._host_buffer(slot.frames, frames.shape, frames.dtype)
+            with self._stream(self.d2h_stream):
+                slot.frames[:num_frames].copy_(frames, non_blocking=True)
+            if self.is_cuda:
+                frames.record_stream(self.d2h_stream)
+            slot.downloaded = self._record(self.d2h_stream)
+            pending.append((slot, num_frames))
+
+        while pending:
+            yield self._finish(*pending.popleft())
+
+    def _finish(self, slot: _Slot, num_frames: int) -> np.ndarray:
+        """等待槽位下载完成，返回uint8 BGR帧（复制一份，锁页缓冲会被下一个batch复用）"""
+        if slot.downloaded is not None:
+            slot.downloaded.synchronize()
+        return slot.frames[:num_frames].numpy().copy()
+
+
+# ===== 自检（CPU + 替身模型；有CUDA时同时测试GPU） =====
+
+def benchmark_transfer_pipeline():
+    """验证流水线与顺序路径输出完全一致（多种batch大小、槽位复用），并比较耗时"""
+    from core.standin_models import build_standin_models, synthetic_batch
+    from core.resident_latents import build_cycle_batches
+
+    print("🧪 测试传输流水线（替身模型）...")
+    devices = ['cpu'] + (['cuda:0'] if torch.cuda.is_available() else [])
+    batch_sizes = [5, 16, 3, 9, 16, 1, 7, 16, 12, 2]
+    for device in devices:
+        dtype = torch.float16 if device.startswith('cuda') else torch.float32
+        gpu_models = build_standin_models(device, dtype)
+        timesteps = torch.tensor([0], dtype=torch.long)
+        batches = [synthetic_batch(bs) for bs in batch_sizes]
+
+        with torch.no_grad():
+            sequential = TransferPipeline(device, gpu_models, pipelined=False)
+            expected = list(sequential.run(batches, timesteps))
+            results = {'sequential': sequential.last_run}
+            for depth in (1, 2, 3):
+                pipeline = TransferPipeline(device, gpu_models, depth=depth, pipelined=True)
+                actual = list(pipeline.run(batches, timesteps))
+                assert len(actual) == len(expected)
+                for bs, a, e in zip(batch_sizes, actual, expected):
+                    assert a.shape == e.shape == (bs, *e.shape[1:]), (a.shape, e.shape)
+                    assert np.array_equal(a, e), f"{device} depth={depth} 输出与顺序路径不一致"
+                results[f'pipelined(depth={depth})'] = pipeline.last_run
+
+            # 常驻latent: 只传循环索引，结果应与直接传latent一致
+            cycle = torch.randn(7, *batches[0][1].shape[1:])
+            indexed = build_cycle_batches(torch.cat([w for w, _ in batches]), len(cycle), 16)
+            resident = cycle.to(device, dtype=dtype)
+            direct = [(w, cycle[i]) for w, i in indexed]
+            expected = list(sequential.run(direct, timesteps))
+            for pipelined in (False, True):
+                pipeline = TransferPipeline(device, gpu_models, pipelined=pipelined)
+                actual = list(pipeline.run(indexed, timesteps, resident_latents=resident))
+                assert all(np.array_equal(a, e) for a, e in zip(actual, expected)), f"{device} 常驻latent输出不一致"
+
+            # 只取预测latent: 流水线与顺序路径一致
+            expected = list(sequential.run(batches, timesteps, latents_only=True))
+            pipeline = TransferPipeline(device, gpu_models, pipelined=True)
+            actual = list(pipeline.run(batches, timesteps, latents_only=True))
+            assert all(a.shape == e.shape and np.array_equal(a, e) for a, e in zip(actual, expected)), f"{device} 预测latent不一致"
+
+        print(f"  {device}: 输出一致 ✅ ({sum(batch_sizes)}帧, {len(batch_sizes)}个batch)")
+        for mode, stats in results.items():
+            print(f"    {mode}: {stats['seconds'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    benchmark_transfer_pipeline()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+推理预热 - 启动时在每个设备上按调度器会用到的每个batch大小跑一遍完整推理图
+PE -> UNet -> VAE解码，再做一次图像合成和视频编码，
+让cuDNN自动调优、torch.compile特化和内存池分配都在用户请求之前完成
+
+配置（环境变量）:
+    MUSE_SKIP_WARMUP=1            跳过预热
+    MUSE_WARMUP_BATCH_SIZES=1,2,4 预热的batch大小（默认MUSE_BATCH_BUCKETS）
+    MUSE_WARMUP_RUNS=2            每个batch大小热启动测量次数
+"""
+
+import os
+import sys
+import time
+import wave
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.gpu_inference_pool import run_inference
+from core.standin_models import WHISPER_CHUNK_SHAPE, LATENT_INPUT_SHAPE, FACE_SIZE
+from core.shape_buckets import get_bucket_sizes
+
+
+def warmup_disabled() -> bool:
+    """是否通过环境变量跳过预热"""
+    return os.environ.get('MUSE_SKIP_WARMUP', '0') == '1'
+
+
+def get_warmup_batch_sizes() -> List[int]:
+    """预热的batch大小列表（默认为推理分桶档位，所有请求最终都补齐到这些大小）"""
+    value = os.environ.get('MUSE_WARMUP_BATCH_SIZES', '')
+    if not value.strip():
+        return list(get_bucket_sizes())
+    return sorted({int(v) for v in value.split(',') if v.strip()})
+
+
+def _model_dtype(gpu_models: Dict):
+    """从UNet参数推断模型精度"""
+    try:
+        return next(gpu_models['unet'].model.parameters()).dtype
+    except (StopIteration, AttributeError, KeyError):
+        return torch.float32
+
+
+def _synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def _timed(fn) -> float:
+    """执行并返回耗时（毫秒）"""
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def warmup_device(device, gpu_models: Dict, timesteps, batch_sizes: List[int], runs: int = 2) -> Tuple[Dict, object]:
+    """在单个设备上按每个batch大小预热，返回 ({batch: {'cold_ms', 'warm_ms'}}, 最后一批解码帧)"""
+    dtype = _model_dtype(gpu_models)
+    timesteps = timesteps.to(device) if timesteps is not None else torch.tensor([0], device=device, dtype=torch.long)
+    results = {}
+    last_frames = None
+
+    for batch_size in batch_sizes:
+        whisper_batch = torch.randn(batch_size, *WHISPER_CHUNK_SHAPE, device=device, dtype=dtype)
+        latent_batch = torch.randn(batch_size, *LATENT_INPUT_SHAPE, device=device, dtype=dtype)
+
+        def step():
+            nonlocal last_frames
+            last_frames = run_inference(gpu_models, whisper_batch, latent_batch, timesteps)
+            _synchronize(device)
+
+        cold_ms = _timed(step)
+        warm_ms = sum(_timed(step) for _ in range(max(1, runs))) / max(1, runs)
+        results[batch_size] = {'cold_ms': round(cold_ms, 2), 'warm_ms': round(warm_ms, 2)}
+        print(f"  🔥 {device} batch={batch_size}: 冷启动 {cold_ms:.1f}ms -> 热启动 {warm_ms:.1f}ms")
+
+    return results, last_frames
+
+
+def run_warmup(
+    gpu_models_by_device: Dict,
+    timesteps=None,
+    batch_sizes: Optional[List[int]] = None,
+    compose_fn: Optional[Callable] = None,
+    encode_fn: Optional[Callable] = None,
+    runs: Optional[int] = None,
+    run_on_device: Optional[Callable] = None,
+) -> Dict:
+    """预热所有设备，并用最后一批解码结果做一次合成和编码
+
+    Args:
+        gpu_models_by_device: {device: {'vae', 'unet', 'pe'}}
+        compose_fn: frames -> composed_frames（可选）
+        encode_fn: composed_frames -> None（可选）
+        run_on_device: (device, fn, *args) -> 结果，在设备专用推理线程中执行（可选，默认当前线程）
+
+    Returns:
+        预热报告 {'devices': {device: {batch: {...}}}, 'compose': {...}, 'encode': {...}, 'total_time': 秒}
+    """
+    if batch_sizes is None:
+        batch_sizes = get_warmup_batch_sizes()
+    if runs is None:
+        runs = int(os.environ.get('MUSE_WARMUP_RUNS', '2'))
+
+    start = time.time()
+    report = {'skipped': False, 'batch_sizes': batch_sizes, 'devices': {}, 'errors': {}}
+    print(f"🔥 开始完整推理预热: {len(gpu_models_by_device)}个设备, batch={batch_sizes}")
+
+    if run_on_device is None:
+        run_on_device = lambda device, fn, *args: fn(*args)
+
+    frames = None
+    for device, gpu_models in gpu_models_by_device.items():
+        try:
+            report['devices'][str(device)], frames = run_on_device(
+                device, warmup_device, device, gpu_models, timesteps, batch_sizes, runs
+            )
+        except Exception as e:
+            print(f"  ⚠️ {device} 预热失败: {e}")
+            report['errors'][str(device)] = str(e)
+
+    if frames is not None:
+        frames = [frames[i] for i in range(len(frames))]
+        composed = frames
+        for stage, fn in (('compose', compose_fn), ('encode', encode_fn)):
+            if fn is None:
+                continue
+            try:
+                stage_start = time.perf_counter()
+                output = fn(composed)
+                cold_ms = (time.perf_counter() - stage_start) * 1000
+                warm_ms = _timed(lambda: fn(composed))
+                report[stage] = {'cold_ms': round(cold_ms, 2), 'warm_ms': round(warm_ms, 2), 'frames': len(composed)}
+                print(f"  🔥 {stage}: 冷启动 {cold_ms:.1f}ms -> 热启动 {warm_ms:.1f}ms")
+                if stage == 'compose' and output:
+                    composed = output
+            except Exception as e:
+                print(f"  ⚠️ {stage} 预热失败: {e}")
+                report['errors'][stage] = str(e)
+
+    report['total_time'] = round(time.time() - start, 3)
+    print(f"✅ 完整推理预热完成: {report['total_time']:.2f}秒")
+    return report
+
+
+def synthetic_cache_data(frame_size: int = 512) -> Dict:
+    """合成的模板缓存（一帧），结构与预处理生成的cache_data一致"""
+    frame = np.full((frame_size, frame_size, 3), 128, dtype=np.uint8)
+    face_box = [frame_size // 4, frame_size // 4, frame_size * 3 // 4, frame_size * 3 // 4]
+    crop_box = [frame_size // 8, frame_size // 8, frame_size * 7 // 8, frame_size * 7 // 8]
+    crop_size = crop_box[2] - crop_box[0]
+    mask = np.zeros((crop_size, crop_size, 3), dtype=np.uint8)
+    mask[crop_size // 2:, :] = 255
+    return {
+        'coord_list_cycle': [face_box],
+        'frame_list_cycle': [frame],
+        'mask_coords_list_cycle': [crop_box],
+        'mask_list_cycle': [mask],
+    }
+
+
+def write_silent_wav(path: str, seconds: float = 1.0, sample_rate: int = 16000):
+    """写入静音wav（只用标准库）"""
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+
+
+# ===== 性能测试（CPU + 替身模型） =====
+
+def _standin_compose(frames):
+    """替身合成: 把人脸缩放后贴回合成模板帧"""
+    import cv2
+    cache_data = synthetic_cache_data()
+    x1, y1, x2, y2 = cache_data['coord_list_cycle'][0]
+    composed = []
+    for face in frames:
+        frame = cache_data['frame_list_cycle'][0].copy()
+        frame[y1:y2, x1:x2] = cv2.resize(face, (x2 - x1, y2 - y1))
+        composed.append(frame)
+    return composed
+
+
+def _standin_encode(frames):
+    """替身编码: 用OpenCV写临时mp4"""
+    import cv2
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        h, w = frames[0].shape[:2]
+        writer = cv2.VideoWriter(os.path.join(tmp_dir, 'warmup.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 25, (w, h))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+
+
+def benchmark_warmup():
+    """在CPU上用替身模型运行完整预热，打印冷/热启动延迟"""
+    from core.standin_models import build_standin_models
+
+    print("🧪 测试完整推理预热（CPU替身模型）...")
+    gpu_models_by_device = {'cpu': build_standin_models('cpu')}
+    report = run_warmup(
+        gpu_models_by_device,
+        timesteps=torch.tensor([0], dtype=torch.long),
+        compose_fn=_standin_compose,
+        encode_fn=_standin_encode,
+    )
+
+    for device, results in report['devices'].items():
+        print(f"设备: {device}")
+        for batch_size, timing in results.items():
+            print(f"  - batch={batch_size}: 冷启动 {timing['cold_ms']:.1f}ms, 热启动 {timing['warm_ms']:.1f}ms")
+    for stage in ('compose', 'encode'):
+        if stage in report:
+            print(f"{stage}: 冷启动 {report[stage]['cold_ms']:.1f}ms, 热启动 {report[stage]['warm_ms']:.1f}ms")
+    assert not report['errors'], report['errors']
+    print(f"人脸尺寸: {FACE_SIZE}x{FACE_SIZE}, 总耗时: {report['total_time']:.2f}秒")
+
+
+if __name__ == "__main__":
+    benchmark_warmup()
@@ -8,55 +8,42 @@ Ultra Fast Realtime Inference V2
 import os
 import sys
 import json
-import pickle
-import torch
-import cv2
 import numpy as np
 import time
 import gc
 import threading
 import queue
 import socket
-import struct
-from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
-import multiprocessing as mp
-from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import copy
-import gc
-try:
-    from transformers import WhisperModel
-    WHISPER_AVAILABLE = True
-except ImportError:
-    print("警告: transformers.WhisperModel不可用，将跳过Whisper初始化")
-    WHISPER_AVAILABLE = False
-import imageio
 import warnings
 warnings.filterwarnings("ignore")
 
-# GPU配置 - 直接定义，不从外部导入
-GPU_MEMORY_CONFIG = {'batch_size': {'default': 4}}
-print("使用默认GPU配置")
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.keyframes import select_keyframes
+from core.shared_templates import load_template_shared
+from core.silence_skip import (
+    silence_skip_enabled, silent_frames_path, silent_frames_capacity, load_pcm, compute_activity_mask,
+    plan_silence_skip, merge_with_silent_frames, silence_stats, AUDIO_SAMPLE_RATE
+)
 
-# 设置模型路径
-os.environ['MODEL_PATH'] = '/opt/musetalk/models'
-os.environ['MUSETALK_MODEL_PATH'] = '/opt/musetalk/models'
+# MuseTalk模块路径
+MUSETALK_REPO_DIR = '/opt/musetalk/repo/MuseTalk'
 
-# 添加MuseTalk模块路径
-sys.path.append('/opt/musetalk/repo/MuseTalk')
+# 注意：transformers / imageio / musetalk.* 等重量级依赖在首次使用时才导入，
+# 模块导入本身不设置环境变量、不创建服务实例
 
-from musetalk.utils.face_parsing import FaceParsing
-from musetalk.utils.utils import datagen, load_all_model
-from musetalk.utils.preprocessing import get_landmark_and_bbox, read_imgs
-from musetalk.utils.blending import get_image, get_image_blending, get_image_prepare_material
-from musetalk.utils.audio_processor import AudioProcessor
 
-# 性能监控 - 已移除，使用简单的时间记录
-PERFORMANCE_MONITORING = False
-print("性能监控已禁用")
+def setup_musetalk_env():
+    """设置模型路径环境变量和MuseTalk模块路径（首次加载模型前调用，可重复调用）"""
+    os.environ['MODEL_PATH'] = '/opt/musetalk/models'
+    os.environ['MUSETALK_MODEL_PATH'] = '/opt/musetalk/models'
+    if MUSETALK_REPO_DIR not in sys.path:
+        sys.path.append(MUSETALK_REPO_DIR)
 
-print("Ultra Fast Realtime Inference V2 - 毫秒级响应引擎")
-sys.stdout.flush()
 
 class UltraFastMuseTalkService:
     """极致优化的MuseTalk服务 - 毫秒级响应"""
@@ -72,9 +59,14 @@ class UltraFastMuseTalkService:
         return cls._instance
     
     def __init__(self):
+        import torch
+        from core.model_registry import ModelRegistry
+        from core.resident_latents import ResidentLatentCache
         if hasattr(self, '_initialized'):
             return
-            
+        
+        print("Ultra Fast Realtime Inference V2 - 毫秒级响应引擎")
+        
         # GPU架构 - 自动适配单GPU或多GPU
         self.gpu_count = torch.cuda.device_count() if torch.cuda.is_available() else 0
         if self.gpu_count == 0:
@@ -97,6 +89,22 @@ class UltraFastMuseTalkService:
         self.shared_fp = None
         self.weight_dtype = torch.float16  # 使用半精度提速
         self.timesteps = None
+        self.init_stage_times = {}  # 启动各阶段耗时（秒）
+        self.warmup_report = None  # 完整推理预热报告（冷/热启动延迟）
+        self.model_registry = ModelRegistry()  # 权重只读取一次，按GPU克隆
+        self.inference_pool = None  # 每GPU专用推理线程（编译/预热/推理在同一线程）
+        self.compile_manager = None  # 按batch档位编译，状态见 /api/status
+        self.batch_autotuner = None  # 各设备batch大小profile，调度器按延迟目标选择
+        self.batch_limits = {}  # 各设备自适应安全batch上限（OOM时降低，连续成功后回升）
+        self.transfer_pipelines = {}  # 各设备的传输流水线（锁页缓冲跨请求复用）
+        self.resident_latents = ResidentLatentCache()  # 模板latent按设备常驻，请求只传whisper特征
+        self.silent_frames_cache = OrderedDict()  # 模板key -> 各循环帧的闭嘴渲染（只读mmap，LRU，静音段直接使用）
+        self.silent_frames_capacity = silent_frames_capacity()
+        self.silent_render_executor = ThreadPoolExecutor(max_workers=1)  # 请求路径上缺少闭嘴帧时在后台渲染
+        self.silent_renders = {}  # 模板key -> 正在渲染的Future（同一模板只渲染一次）
+        self._silent_lock = threading.Lock()
+        self.silent_whisper_chunks = {}  # fps -> 静音音频的whisper特征
+        self.frame_interpolator = None  # 关键帧模式的人脸裁剪图插值器
         
         # 内存池和缓存优化
         self.template_cache = {}
@@ -123,7 +131,11 @@ class UltraFastMuseTalkService:
         sys.stdout.flush()
     
     def initialize_models_ultra_fast(self):
-        """极速初始化所有模型 - 并行加载到所有GPU"""
+        """极速初始化所有模型 - 权重只从磁盘读取一次，再并行复制到所有GPU"""
+        import torch
+        from core.gpu_inference_pool import GPUInferencePool
+        from core.compile_manager import CompileManager
+        from core.batch_autotuner import BatchAutotuner
         if self.is_initialized and len(self.gpu_models) > 0:
             print("模型已初始化，跳过重复初始化")
             return True
@@ -131,326 +143,55 @@ class UltraFastMuseTalkService:
         # 重置初始化状态，强制重新初始化
         self.is_initialized = False
         self.gpu_models = {}
+        self.init_stage_times = {}
             
         try:
             print(f"开始极速初始化 - {self.gpu_count}GPU并行加载...")
             start_time = time.time()
             
-            # 并行初始化所有GPU模型
-            def init_gpu_model(device_id):
-                import os  # Fix: import os at function start
-                import platform
-                import copy
-                device = f'cuda:{device_id}'
-                print(f"🎮 GPU{device_id} 开始初始化...")
-                
-                with torch.cuda.device(device_id):
-                    # 加载模型到指定GPU - 只使用可用的sd-vae
-                    try:
-                        print(f"GPU{device_id} 开始加载模型...")
-                        
-                        # 设置模型路径环境变量
-                        os.environ['DISABLE_TORCH_COMPILE'] = '1'
-                        
-                        # 设置正确的模型路径
-                        os.environ['MODEL_PATH'] = '/opt/musetalk/models'
-                        os.environ['VAE_PATH'] = '/opt/musetalk/models/sd-vae'
-                        os.environ['UNET_PATH'] = '/opt/musetalk/models/musetalk/pytorch_model.bin'
-                        os.environ['PE_PATH'] = '/opt/musetalk/models/musetalk/pytorch_model.bin'
-                        
-                        # 改变工作目录到有models链接的地方
-                        original_cwd = os.getcwd()
-                        
-                        # 先尝试创建符号链接
-                        if not os.path.exists('/opt/musetalk/repo/models'):
-                            try:
-                                os.symlink('/opt/musetalk/models', '/opt/musetalk/repo/models')
-                                print(f"GPU{device_id} 创建了models符号链接")
-                            except:
-                                pass
-                        
-                        # 切换到有models的目录
-                        os.chdir('/opt/musetalk/repo')
-                        
-                        print(f"GPU{device_id} 当前工作目录: {os.getcwd()}")
-                        print(f"GPU{device_id} models目录存在: {os.path.exists('models')}")
-                        print(f"GPU{device_id} sd-vae路径存在: {os.path.exists('models/sd-vae')}")
-                        
-                        # 直接加载模型，不检查config
-                        try:
-                            # 尝试默认加载
-                            audio_processor, vae, unet, pe = load_all_model()
-                            print(f"GPU{device_id} 模型加载成功!")
-                            
-                            # 恢复原始工作目录
-                            os.chdir(original_cwd)
-                            
-                            # 存储模型到对应的GPU
-                            self.gpu_models[device] = {
-                                'vae': vae,
-                                'unet': unet,
-                                'pe': pe,
-                                'device': device
-                            }
-                            print(f"GPU{device_id} 模型加载完成")
-                            return device_id
-                        except Exception as e:
-                            # 如果失败，尝试不指定VAE类型
-                            print(f"GPU{device_id} 默认加载失败: {e}")
-                            print(f"GPU{device_id} 尝试备用加载方式...")
-                            
-                            # 设置环境变量指向模型
-                            os.environ['VAE_PATH'] = sd_vae_path
-                            os.environ['UNET_PATH'] = '/opt/musetalk/models/musetalk'
-                            
-                            # 再次尝试
-                            audio_processor, vae, unet, pe = load_all_model()
-                            print(f"GPU{device_id} 模型加载成功（备用方式）")
-                            
-                            # 恢复原始工作目录
-                            os.chdir(original_cwd)
-                            
-                            # 存储模型到对应的GPU
-                            self.gpu_models[device] = {
-                                'vae': vae,
-                                'unet': unet,
-                                'pe': pe,
-                                'device': device
-                            }
-                            print(f"GPU{device_id} 模型加载完成")
-                            return device_id
-                    
-                    except Exception as e:
-                        print(f"GPU{device_id} 模型加载失败: {e}")
-                        # 检查是否是UNet模型问题
-                        if "meta tensor" in str(e) or "Cannot copy out" in str(e):
-                            print(f"GPU{device_id} UNet模型文件可能损坏，尝试重新加载...")
-                            try:
-                                # 强制清理GPU内存
-                                torch.cuda.empty_cache()
-                                # 重新尝试加载
-                                audio_processor, vae, unet, pe = load_all_model(vae_type="sd-vae")
-                                print(f"GPU{device_id} 重新加载成功")
-                                # 恢复原始工作目录
-                                os.chdir(original_cwd)
-                                # 存储模型到对应的GPU
-                                self.gpu_models[device] = {
-                                    'vae': vae,
-                                    'unet': unet,
-                                    'pe': pe,
-                                    'device': device
-                                }
-                                print(f"GPU{device_id} 模型加载完成")
-                                return device_id
-                            except Exception as e3:
-                                print(f"GPU{device_id} 重新加载也失败: {e3}")
-                                return None
-                        else:
-                            print(f"GPU{device_id} 其他错误，跳过此GPU")
-                            return None
-                    
-                    # 优化模型 - 半精度+编译优化 (修复模型对象兼容性)
-                    print(f"GPU{device_id} 开始模型优化...")
-                    
-                    # 修复VAE对象 - 使用.vae属性
-                    if hasattr(vae, 'vae'):
-                        vae.vae = vae.vae.to(device).half().eval()
-                    elif hasattr(vae, 'to'):
-                        vae = vae.to(device).half().eval()
-                    else:
-                        print(f"警告: VAE对象结构不明，跳过优化")
-                    
-                    # 修复UNet对象 - 使用.model属性  
-                    if hasattr(unet, 'model'):
-                        unet.model = unet.model.to(device).half().eval()
-                    elif hasattr(unet, 'to'):
-                        unet = unet.to(device).half().eval()
-                    else:
-                        print(f"警告: UNet对象结构不明，跳过优化")
-                    
-                    # 修复PE对象
-                    if hasattr(pe, 'to'):
-                        pe = pe.to(device).half().eval()
-                    else:
-                        print(f"警告: PE对象没有.to()方法，跳过优化")
-                    
-                    print(f"GPU{device_id} 半精度转换完成")
-                    
-                    # 智能模型编译 - 使用更安全的编译模式
-                    import platform
-                    import os
-                    
-                    # 检查是否禁用torch.compile
-                    disable_compile = os.environ.get('DISABLE_TORCH_COMPILE', '0') == '1'
-                    
-                    if disable_compile:
-                        print(f"GPU{device_id} torch.compile已禁用（DISABLE_TORCH_COMPILE=1）")
-                    elif hasattr(torch, 'compile') and platform.system() != 'Windows':
-                        try:
-                            print(f"GPU{device_id} 开始模型优化编译...")
-                            
-                            # 使用更安全的编译模式，避免CUDA图错误
-                            # mode选项：
-                            # - "default": 平衡模式
-                            # - "reduce-overhead": 最激进优化（可能导致错误）
-                            # - "max-autotune": 最大性能但编译慢
-                            # - "max-autotune-no-cudagraphs": 禁用CUDA图，避免TLS错误
-                            
-                            # 尝试不同的编译策略
-                            compile_strategies = [
-                                # 策略1：默认模式（快速编译，适中优化）
-                                {
-                                    "mode": "default",
-                                    "fullgraph": False,
-                                },
-                                # 策略2：减少开销（最快编译）
-                                {
-                                    "mode": "reduce-overhead",
-                                    "fullgraph": False,
-                                    "disable_cudagraphs": True,
-                                },
-                                # 策略3：最大调优（慢编译，最优性能）- 备选
-                                {
-                                    "mode": "max-autotune-no-cudagraphs",
-                                    "fullgraph": False,
-                                    "dynamic": True,
-                                },
-                            ]
-                            
-                            # 尝试找到可用的编译策略
-                            compile_options = None
-                            for idx, strategy in enumerate(compile_strategies):
-                                try:
-                                    # 测试编译一个小模型
-                                    test_model = torch.nn.Linear(10, 10).to(device)
-                                    torch.compile(test_model, **strategy)
-                                    compile_options = strategy
-                                    print(f"  使用编译策略 {idx+1}: {strategy['mode']}")
-                                    break
-                                except:
-                                    continue
-                            
-                            if compile_options is None:
-                                print(f"  所有编译策略都失败，跳过编译")
-                                raise RuntimeError("无法找到可用的编译策略")
-                            
-                            # 编译选项：可以启用CUDA图了！
-                            # 因为我们会使用专用线程池，每个GPU一个线程
-                            use_cuda_graphs = os.environ.get('ENABLE_CUDA_GRAPHS', '0') == '1'
-                            
-                            if use_cuda_graphs:
-                                # 启用CUDA图的最优配置
-                                realtime_compile_options = {
-                                    "backend": "inductor",
-                                    "mode": "max-autotune",     # 最激进优化
-                                    "fullgraph": False,
-                                    "disable": False,
-                                }
-                                print(f"  GPU{device_id} 使用最大优化编译（含CUDA图）")
-                            else:
-                                # 保守模式（兼容现有多线程）
-                                realtime_compile_options = {
-                                    "backend": "inductor",
-                                    "mode": "reduce-overhead",  # 无CUDA图
-                                    "fullgraph": False,
-                                    "disable": False,
-                                }
-                                print(f"  GPU{device_id} 使用安全编译（无CUDA图）")
-                            
-                            # 为每个GPU创建独立的编译实例
-                            print(f"  GPU{device_id} 开始独立编译...")
-                            
-                            # UNet编译（最重要）
-                            if hasattr(unet, 'model'):
-                                try:
-                                    # 直接编译原模型，不需要deepcopy
-                                    # 因为每个GPU加载的是独立的模型实例
-                                    unet.model = torch.compile(unet.model, **realtime_compile_options)
-                                    print(f"  ✅ GPU{device_id} UNet编译完成（多线程安全）")
-                                except Exception as e:
-                                    print(f"  ⚠️ GPU{device_id} UNet编译失败: {str(e)[:100]}")
-                                    # 失败则使用原始模型
-                            
-                            # VAE编译（次要）
-                            if hasattr(vae, 'vae') and hasattr(vae.vae, 'decoder'):
-                                try:
-                                    # VAE解码器也要极致优化
-                                    vae.vae.decoder = torch.compile(vae.vae.decoder, **realtime_compile_options)
-                                    print(f"  ✅ GPU{device_id} VAE解码器编译完成")
-                                except Exception as e:
-                                    print(f"  ⚠️ GPU{device_id} VAE编译失败: {str(e)[:100]}")
-                            
-                            # PE也要编译以减少延迟
-                            if hasattr(pe, 'forward'):
-                                try:
-                                    pe = torch.compile(pe, **realtime_compile_options)
-                                    print(f"  ✅ GPU{device_id} PE音频编码器编译完成")
-                                except Exception as e:
-                                    print(f"  ⚠️ GPU{device_id} PE编译失败: {str(e)[:100]}")
-                            
-                            print(f"GPU{device_id} 模型编译优化完成（安全模式）")
-                            
-                        except Exception as compile_error:
-                            print(f"GPU{device_id} 模型编译失败: {compile_error}")
-                            print(f"GPU{device_id} 使用原始模型（未优化）")
-                            # 编译失败不影响运行，继续使用原始模型
-                    else:
-                        if platform.system() == 'Windows':
-                            print(f"GPU{device_id} 跳过编译（Windows不支持）")
-                        else:
-                            print(f"GPU{device_id} 跳过编译（torch.compile不可用）")
-                    
-                    # 显存监控 - 验证模型是否真正加载
-                    with torch.cuda.device(device):
-                        torch.cuda.synchronize()
-                        allocated = torch.cuda.memory_allocated() / (1024**3)
-                        reserved = torch.cuda.memory_reserved() / (1024**3)
-                        print(f"GPU{device_id} 模型加载后显存: 已分配 {allocated:.2f}GB, 已预留 {reserved:.2f}GB")
-                    
-                    print(f"GPU{device_id} 模型加载完成")
-                    return device_id
-                except Exception as e:
-                    print(f"GPU{device_id} 其他错误，跳过此GPU")
-                    # 恢复原始工作目录
-                    if 'original_cwd' in locals():
-                        os.chdir(original_cwd)
-                    return None
+            if self.gpu_count == 0:
+                print("没有可用GPU，无法初始化模型")
+                return False
+            
+            # 1. 从磁盘读取一次权重，构建CPU主副本
+            stage_start = time.time()
+            loaded = self._load_master_models()
+            self.init_stage_times['load_weights'] = time.time() - stage_start
+            print(f"⏱️ 权重读取完成: {self.init_stage_times['load_weights']:.2f}秒 (来源: {self.model_registry.stats.get('source')})")
+            if not loaded:
+                print("模型权重读取失败")
+                return False
             
-            # SEQUENTIAL_LOADING_FIXED: 顺序初始化避免并发冲突
-            print(f"开始顺序初始化{self.gpu_count}个GPU（避免并发冲突）...")
+            # 2. 并行复制到所有GPU，同时初始化共享组件（Whisper/AudioProcessor/FaceParsing）
+            stage_start = time.time()
             successful_gpus = []
+            with ThreadPoolExecutor(max_workers=self.gpu_count + 1) as init_executor:
+                shared_future = init_executor.submit(self._init_shared_components)
+                replicate_futures = {
+                    init_executor.submit(self._replicate_models_to_gpu, i): i
+                    for i in range(self.gpu_count)
+                }
+                for future in as_completed(replicate_futures):
+                    i = replicate_futures[future]
+                    try:
+                        if future.result() is not None:
+                            successful_gpus.append(i)
+                            print(f"✅ GPU{i} 初始化成功 ({len(successful_gpus)}/{self.gpu_count})")
+                        else:
+                            print(f"❌ GPU{i} 初始化失败，跳过")
+                    except Exception as e:
+                        print(f"❌ GPU{i} 初始化异常: {e}")
+                self.init_stage_times['replicate'] = time.time() - stage_start
+                print(f"⏱️ 并行复制到{self.gpu_count}个GPU完成: {self.init_stage_times['replicate']:.2f}秒")
+                
+                shared_future.result()
+                self.init_stage_times['shared_components'] = time.time() - stage_start
             
-            for i in range(self.gpu_count):
-                print(f"正在初始化GPU {i}/{self.gpu_count}...")
-                try:
-                    # 在每个GPU初始化前清理内存
-                    torch.cuda.set_device(i)
-                    torch.cuda.empty_cache()
-                    
-                    result = init_gpu_model(i)
-                    if result is not None:
-                        successful_gpus.append(i)
-                        print(f"✅ GPU{i} 初始化成功 ({len(successful_gpus)}/{self.gpu_count})")
-                    else:
-                        print(f"❌ GPU{i} 初始化失败，跳过")
-                except Exception as e:
-                    print(f"❌ GPU{i} 初始化异常: {e}")
-                    # 如果是meta tensor错误，尝试重试一次
-                    if "meta tensor" in str(e) or "Cannot copy out" in str(e):
-                        print(f"检测到meta tensor错误，清理内存后重试GPU{i}...")
-                        try:
-                            torch.cuda.empty_cache()
-                            import gc
-                            gc.collect()
-                            result = init_gpu_model(i)
-                            if result is not None:
-                                successful_gpus.append(i)
-                                print(f"✅ GPU{i} 重试成功")
-                            else:
-                                print(f"❌ GPU{i} 重试失败")
-                        except Exception as retry_e:
-                            print(f"❌ GPU{i} 重试异常: {retry_e}")
+            # 主副本不再需要，释放CPU内存
+            self.model_registry.release()
+            gc.collect()
             
+            successful_gpus.sort()
             if len(successful_gpus) == 0:
                 print("所有GPU初始化都失败了")
                 return False
@@ -463,68 +204,31 @@ class UltraFastMuseTalkService:
             else:
                 print(f"所有{self.gpu_count}个GPU初始化完成")
             
-            # 共享组件初始化（只需一次）
-            print("初始化共享组件...")
-            device0 = self.devices[0]
-            
-            # Whisper和AudioProcessor在CPU上，所有GPU共享
-            whisper_dir = "./models/whisper"
-            if WHISPER_AVAILABLE and os.path.exists(whisper_dir):
-                print("开始加载Whisper模型...")
-                try:
-                    self.shared_whisper = WhisperModel.from_pretrained(whisper_dir).eval()
-                    # 将Whisper模型移到GPU0并保持float32（Whisper不支持half）
-                    if torch.cuda.is_available():
-                        self.shared_whisper = self.shared_whisper.to(self.devices[0])
-                        print(f"Whisper模型加载完成，已移至{self.devices[0]}")
-                    else:
-                        print("Whisper模型加载完成（CPU模式）")
-                except Exception as e:
-                    print(f"Whisper模型加载失败: {e}")
-                    self.shared_whisper = None
-            else:
-                if not WHISPER_AVAILABLE:
-                    print("跳过Whisper模型加载 - transformers.WhisperModel不可用")
-                else:
-                    print(f"跳过Whisper模型加载 - 目录不存在: {whisper_dir}")
-                self.shared_whisper = None
-            
-            print("初始化AudioProcessor...")
-            try:
-                # AudioProcessor需要whisper模型路径
-                if os.path.exists(whisper_dir):
-                    self.shared_audio_processor = AudioProcessor(feature_extractor_path=whisper_dir)
-                    print("AudioProcessor初始化完成")
-                else:
-                    print(f"警告: Whisper目录不存在，使用默认AudioProcessor")
-                    self.shared_audio_processor = AudioProcessor(feature_extractor_path=None)
-                    print("AudioProcessor初始化完成 (无Whisper)")
-            except Exception as e:
-                print(f"AudioProcessor初始化失败: {e}")
-                # 创建一个简单的AudioProcessor备用实例
-                try:
-                    print("尝试创建备用AudioProcessor...")
-                    self.shared_audio_processor = AudioProcessor(feature_extractor_path=None)
-                    print("备用AudioProcessor创建成功")
-                except:
-                    self.shared_audio_processor = None
-                    print("AudioProcessor完全失败，音频功能将不可用")
-            
-            print("初始化FaceParsing...")
-            try:
-                self.shared_fp = FaceParsing()
-                print("FaceParsing初始化完成")
-            except Exception as e:
-                print(f"FaceParsing初始化失败: {e}")
-                self.shared_fp = None
-            
             # 时间步长
             print("设置时间步长...")
-            self.timesteps = torch.tensor([0], device=device0, dtype=torch.long)
+            self.timesteps = torch.tensor([0], device=self.devices[0], dtype=torch.long)
             print("时间步长设置完成")
             
+            # 3. 每个GPU启动专用推理线程，在线程内按batch档位编译（编译图/CUDA图只在该线程使用）
+            stage_start = time.time()
+            if self.inference_pool is not None:
+                self.inference_pool.shutdown()
+            self.inference_pool = GPUInferencePool(self.gpu_models)
+            self.compile_manager = CompileManager(model_hash=self.model_registry.model_hash)
+            self.compile_manager.compile_pool(self.inference_pool)
+            self.init_stage_times['compile'] = time.time() - stage_start
+            
+            # 4. batch大小profile（按设备型号+模型hash从磁盘加载，没有时实测）
+            stage_start = time.time()
+            self.batch_autotuner = BatchAutotuner(model_hash=self.model_registry.model_hash)
+            self.batch_autotuner.tune_pool(self.inference_pool)
+            self.reset_batch_limits()
+            self.init_stage_times['autotune'] = time.time() - stage_start
+            
             init_time = time.time() - start_time
+            self.init_stage_times['total'] = init_time
             print(f"极速初始化完成！耗时: {init_time:.2f}秒")
+            print(f"性能分解: 权重读取:{self.init_stage_times['load_weights']:.2f}s + 并行复制:{self.init_stage_times['replicate']:.2f}s + 编译:{self.init_stage_times['compile']:.2f}s")
             print(f"{self.gpu_count}GPU并行引擎就绪 - 毫秒级响应模式")
             
             self.is_initialized = True
@@ -536,6 +240,168 @@ class UltraFastMuseTalkService:
             traceback.print_exc()
             return False
     
+    def _load_master_models(self):
+        """构建CPU上的半精度主副本 - 原始checkpoint只读取一次，命中半精度缓存时完全跳过"""
+        import torch
+        setup_musetalk_env()
+        
+        # 设置模型路径环境变量
+        os.environ['MODEL_PATH'] = '/opt/musetalk/models'
+        os.environ['VAE_PATH'] = '/opt/musetalk/models/sd-vae'
+        os.environ['UNET_PATH'] = '/opt/musetalk/models/musetalk/pytorch_model.bin'
+        os.environ['PE_PATH'] = '/opt/musetalk/models/musetalk/pytorch_model.bin'
+        
+        # 先尝试创建符号链接
+        if not os.path.exists('/opt/musetalk/repo/models'):
+            try:
+                os.symlink('/opt/musetalk/models', '/opt/musetalk/repo/models')
+                print("创建了models符号链接")
+            except:
+                pass
+        
+        def load_from_checkpoints():
+            from musetalk.utils.utils import load_all_model
+            
+            # 改变工作目录到有models链接的地方（只切换一次）
+            original_cwd = os.getcwd()
+            try:
+                os.chdir('/opt/musetalk/repo')
+                print(f"当前工作目录: {os.getcwd()}")
+                print(f"models目录存在: {os.path.exists('models')}, sd-vae路径存在: {os.path.exists('models/sd-vae')}")
+                
+                try:
+                    loaded = load_all_model()
+                except Exception as e:
+                    print(f"默认加载失败: {e}")
+                    print("尝试备用加载方式 (vae_type=sd-vae)...")
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+                    loaded = load_all_model(vae_type="sd-vae")
+            finally:
+                os.chdir(original_cwd)
+            
+            # 兼容返回 (vae, unet, pe) 或 (audio_processor, vae, unet, pe)
+            vae, unet, pe = loaded[-3:]
+            print("模型权重读取成功!")
+            return {'vae': vae, 'unet': unet, 'pe': pe}
+        
+        # 缓存键覆盖所有可能被load_all_model读取的checkpoint
+        models_dir = os.environ['MODEL_PATH']
+        checkpoint_paths = [os.path.join(models_dir, name) for name in ('musetalk', 'musetalkV15', 'sd-vae')]
+        
+        try:
+            self.model_registry.load(load_from_checkpoints, checkpoint_paths)
+        except Exception as e:
+            print(f"模型加载失败: {e}")
+            return False
+        finally:
+            # load_all_model可能默认把部分模型放到cuda:0，这里释放掉
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        
+        print("CPU主副本半精度转换完成")
+        return True
+    
+    def _replicate_models_to_gpu(self, device_id):
+        """把CPU主副本复制到指定GPU（各GPU并行执行）"""
+        import torch
+        device = f'cuda:{device_id}'
+        print(f"🎮 GPU{device_id} 开始复制模型...")
+        
+        try:
+            with torch.cuda.device(device_id):
+                replica = self.model_registry.replicate(device)
+                vae, unet, pe = replica['vae'], replica['unet'], replica['pe']
+                
+                print(f"GPU{device_id} 半精度模型复制完成")
+                
+                # 显存监控 - 验证模型是否真正加载
+                torch.cuda.synchronize()
+                allocated = torch.cuda.memory_allocated() / (1024**3)
+                reserved = torch.cuda.memory_reserved() / (1024**3)
+                print(f"GPU{device_id} 模型加载后显存: 已分配 {allocated:.2f}GB, 已预留 {reserved:.2f}GB")
+            
+            # 存储模型到对应的GPU
+            self.gpu_models[device] = {
+                'vae': vae,
+                'unet': unet,
+                'pe': pe,
+                'device': device
+            }
+            print(f"GPU{device_id} 模型加载完成")
+            return device_id
+            
+        except Exception as e:
+            print(f"GPU{device_id} 模型复制失败: {e}")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            return None
+    
+    def _init_shared_components(self):
+        """初始化共享组件（只需一次）"""
+        import torch
+        print("初始化共享组件...")
+        setup_musetalk_env()
+        from musetalk.utils.face_parsing import FaceParsing
+        from musetalk.utils.audio_processor import AudioProcessor
+        try:
+            from transformers import WhisperModel
+            WHISPER_AVAILABLE = True
+        except ImportError:
+            print("警告: transformers.WhisperModel不可用，将跳过Whisper初始化")
+            WHISPER_AVAILABLE = False
+
+        # Whisper和AudioProcessor在CPU上，所有GPU共享
+        whisper_dir = "./models/whisper"
+        if WHISPER_AVAILABLE and os.path.exists(whisper_dir):
+            print("开始加载Whisper模型...")
+            try:
+                self.shared_whisper = WhisperModel.from_pretrained(whisper_dir).eval()
+                # 将Whisper模型移到GPU0并保持float32（Whisper不支持half）
+                if torch.cuda.is_available():
+                    self.shared_whisper = self.shared_whisper.to(self.devices[0])
+                    print(f"Whisper模型加载完成，已移至{self.devices[0]}")
+                else:
+                    print("Whisper模型加载完成（CPU模式）")
+            except Exception as e:
+                print(f"Whisper模型加载失败: {e}")
+                self.shared_whisper = None
+        else:
+            if not WHISPER_AVAILABLE:
+                print("跳过Whisper模型加载 - transformers.WhisperModel不可用")
+            else:
+                print(f"跳过Whisper模型加载 - 目录不存在: {whisper_dir}")
+            self.shared_whisper = None
+
+        print("初始化AudioProcessor...")
+        try:
+            # AudioProcessor需要whisper模型路径
+            if os.path.exists(whisper_dir):
+                self.shared_audio_processor = AudioProcessor(feature_extractor_path=whisper_dir)
+                print("AudioProcessor初始化完成")
+            else:
+                print(f"警告: Whisper目录不存在，使用默认AudioProcessor")
+                self.shared_audio_processor = AudioProcessor(feature_extractor_path=None)
+                print("AudioProcessor初始化完成 (无Whisper)")
+        except Exception as e:
+            print(f"AudioProcessor初始化失败: {e}")
+            # 创建一个简单的AudioProcessor备用实例
+            try:
+                print("尝试创建备用AudioProcessor...")
+                self.shared_audio_processor = AudioProcessor(feature_extractor_path=None)
+                print("备用AudioProcessor创建成功")
+            except:
+                self.shared_audio_processor = None
+                print("AudioProcessor完全失败，音频功能将不可用")
+
+        print("初始化FaceParsing...")
+        try:
+            self.shared_fp = FaceParsing()
+            print("FaceParsing初始化完成")
+        except Exception as e:
+            print(f"FaceParsing初始化失败: {e}")
+            self.shared_fp = None
+    
     def get_optimal_gpu(self):
         """智能GPU负载均衡"""
         # 选择使用率最低的GPU
@@ -548,75 +414,265 @@ class UltraFastMuseTalkService:
         if device in self.gpu_usage:
             self.gpu_usage[device] = max(0, self.gpu_usage[device] - 1)
     
-    def ultra_fast_inference_parallel(self, template_id, audio_path, output_path, cache_dir=None, batch_size=None, fps=25, auto_adjust=True, streaming=False, skip_frames=1):
+    def select_batch_size(self, num_frames=None, latency_target_ms=None):
+        """按实测profile选择batch大小（没有profile时使用默认值）"""
+        from core.batch_autotuner import DEFAULT_BATCH_SIZE
+        if self.batch_autotuner is None:
+            return DEFAULT_BATCH_SIZE
+        batch_size = self.batch_autotuner.choose_batch_size(num_frames, latency_target_ms)
+        print(f"📏 batch_size={batch_size}（帧数={num_frames}, 延迟目标={latency_target_ms or '默认'}ms）")
+        return batch_size
+    
+    def autotune_batch_sizes(self, force=True):
+        """重新测量各设备的batch profile（按需调用）"""
+        from core.batch_autotuner import BatchAutotuner
+        if not self.is_initialized or self.inference_pool is None:
+            print("模型未初始化，无法测量batch profile")
+            return None
+        if self.batch_autotuner is None:
+            self.batch_autotuner = BatchAutotuner(model_hash=self.model_registry.model_hash)
+        self.batch_autotuner.tune_pool(self.inference_pool, force=force)
+        self.reset_batch_limits()
+        return self.batch_autotuner.get_status()
+    
+    def plan_silence_skip(self, audio_path, num_frames, fps, template_id, cache_dir, cache_data):
+        """计算有声标记和跳帧计划；没有静音段或闭嘴帧不可用时返回 (None, None)"""
+        try:
+            active = compute_activity_mask(load_pcm(audio_path), AUDIO_SAMPLE_RATE, num_frames, fps)
+            plan = plan_silence_skip(active)
+            if plan['infer_mask'].all():
+                return None, None
+            # 请求路径上不渲染：闭嘴帧还没有时本次全部推理，后台渲染供后续请求使用
+            silent_frames = self.get_silent_frames(template_id, cache_dir, cache_data, fps, render=False)
+            if silent_frames is None:
+                return None, None
+            return plan, silent_frames
+        except Exception as e:
+            print(f"⚠️ 静音检测失败，全部帧推理: {e}")
+            return None, None
+    
+    def get_frame_interpolator(self):
+        """关键帧之间的插值器（MUSE_INTERPOLATION_METHOD，默认latent：在各GPU上整批解码插值latent，避免像素混合的嘴部重影）"""
+        if self.frame_interpolator is None:
+            from streaming.frame_interpolation import FrameInterpolator
+            self.frame_interpolator = FrameInterpolator(method=os.environ.get('MUSE_INTERPOLATION_METHOD', 'latent'),
+                                                        decode_fn=self.decode_latents_parallel)
+        return self.frame_interpolator
+    
+    def decode_latents_parallel(self, latents, batch_size=None):
+        """预测latent (N,4,32,32) 按batch轮询分配到各GPU做VAE解码，按输入顺序返回uint8 BGR帧 (N,H,W,3)"""
+        import torch
+        from core.gpu_inference_pool import run_bucketed_decode, concat_frames
+        latents = torch.as_tensor(latents)
+        batch_size = batch_size or self.select_batch_size(len(latents))
+        
+        def decode(device, chunk):
+            with torch.no_grad():
+                return run_bucketed_decode(self.gpu_models[device], chunk.to(device, dtype=self.weight_dtype))
+        
+        futures = []
+        for batch_idx, start in enumerate(range(0, len(latents), batch_size)):
+            device = self.devices[batch_idx % self.gpu_count]
+            chunk = latents[start:start + batch_size]
+            if self.inference_pool is not None:
+                futures.append(self.inference_pool.submit(device, decode, device, chunk))
+            else:
+                futures.append(decode(device, chunk))
+        return concat_frames([f.result() if self.inference_pool is not None else f for f in futures])
+    
+    def get_silent_whisper_chunk(self, fps=25):
+        """静音音频的whisper特征（每个fps只计算一次）"""
+        if fps not in self.silent_whisper_chunks:
+            import tempfile
+            from core.warmup import write_silent_wav
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                silent_wav = os.path.join(tmp_dir, 'silence.wav')
+                write_silent_wav(silent_wav, seconds=1.0)
+                chunks = self.extract_audio_features_ultra_fast(silent_wav, fps)
+            if chunks is None or len(chunks) == 0:
+                return None
+            self.silent_whisper_chunks[fps] = chunks[len(chunks) // 2].detach().cpu()
+        return self.silent_whisper_chunks[fps]
+    
+    def get_silent_frames(self, template_id, cache_dir=None, cache_data=None, fps=25, render=True):
+        """模板每个循环帧的闭嘴渲染 (N,256,256,3)，保存在模板缓存目录，每个模板只推理一次
+        
+        从磁盘以只读mmap加载（多个进程共享页缓存），内存中按LRU最多保留 MUSE_SILENT_FRAMES_CACHE 个模板；
+        render=False（请求路径）时不等待渲染：还没有闭嘴帧就提交后台渲染并返回None
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(self.template_cache_dir, template_id)
+        if cache_data is None:
+            cache_data = self.load_template_cache_optimized(cache_dir, template_id)
+            if not cache_data:
+                return None
+        key = cache_data.get('template_key', template_id)
+        with self._silent_lock:
+            if key in self.silent_frames_cache:
+                self.silent_frames_cache.move_to_end(key)
+                return self.silent_frames_cache[key]
+        
+        cycle_latents = cache_data['input_latent_list_cycle']
+        frames = self._load_silent_frames(key, silent_frames_path(cache_dir, template_id), len(cycle_latents))
+        if frames is None:
+            if not self.is_initialized or self.inference_pool is None:
+                return None
+            with self._silent_lock:
+                future = self.silent_renders.get(key)
+                if future is None:
+                    future = self.silent_render_executor.submit(
+                        self._render_silent_frames, key, template_id, cache_dir, cycle_latents, fps)
+                    self.silent_renders[key] = future
+            if not render:
+                return None
+            frames = future.result()
+            if frames is None:
+                return None
+        
+        with self._silent_lock:
+            self.silent_frames_cache[key] = frames
+            self.silent_frames_cache.move_to_end(key)
+            while len(self.silent_frames_cache) > self.silent_frames_capacity:
+                self.silent_frames_cache.popitem(last=False)
+        return frames
+    
+    def _load_silent_frames(self, key, frames_file, num_frames):
+        """读取闭嘴帧文件（只读mmap）；不存在、比模板缓存旧或帧数不一致时返回None"""
+        cache_file_mtime = int(key.rsplit('@', 1)[1]) if '@' in key else 0
+        try:
+            if os.stat(frames_file).st_mtime_ns < cache_file_mtime:
+                return None
+            frames = np.load(frames_file, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return frames if len(frames) == num_frames else None
+    
+    def _render_silent_frames(self, key, template_id, cache_dir, cycle_latents, fps):
+        """按batch轮询分配到各GPU渲染闭嘴帧，边完成边写入磁盘文件，返回文件的只读mmap"""
+        from core.gpu_inference_pool import run_bucketed_inference
+        from core.resident_latents import stack_latents
+        try:
+            silent_chunk = self.get_silent_whisper_chunk(fps)
+            if silent_chunk is None:
+                return None
+            start = time.time()
+            latents = stack_latents(cycle_latents)
+            batch_size = self.select_batch_size(len(latents))
+            
+            def render(device, latent_batch):
+                whisper = silent_chunk.unsqueeze(0).expand(len(latent_batch), *silent_chunk.shape)
+                return run_bucketed_inference(
+                    self.gpu_models[device], whisper.to(device, dtype=self.weight_dtype),
+                    latent_batch.to(device, dtype=self.weight_dtype), self.timesteps.to(device)
+                )
+            
+            futures = {}
+            for batch_idx, offset in enumerate(range(0, len(latents), batch_size)):
+                device = self.devices[batch_idx % self.gpu_count]
+                future = self.inference_pool.submit(device, render, device, latents[offset:offset + batch_size])
+                futures[future] = offset
+            
+            frames_file = silent_frames_path(cache_dir, template_id)
+            tmp_file = f"{frames_file}.{os.getpid()}.tmp"
+            output = None
+            for future in as_completed(futures):
+                batch_frames = np.asarray(future.result())
+                if output is None:
+                    output = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.uint8,
+                                                       shape=(len(latents),) + batch_frames.shape[1:])
+                offset = futures[future]
+                output[offset:offset + len(batch_frames)] = batch_frames
+            output.flush()
+            del output
+            os.replace(tmp_file, frames_file)
+            print(f"🔇 模板 {template_id} 闭嘴帧渲染完成: {len(latents)}帧, {self.gpu_count}个GPU, {time.time() - start:.2f}秒")
+            return self._load_silent_frames(key, frames_file, len(latents))
+        except Exception as e:
+            print(f"⚠️ 模板 {template_id} 闭嘴帧渲染失败（静音段照常推理）: {e}")
+            return None
+        finally:
+            with self._silent_lock:
+                self.silent_renders.pop(key, None)
+    
+    def preload_template(self, template_id, cache_dir=None):
+        """把模板latent预先上传到所有GPU并常驻（会话开始时调用）"""
+        if not self.is_initialized:
+            return False
+        if cache_dir is None:
+            cache_dir = os.path.join(self.template_cache_dir, template_id)
+        cache_data = self.load_template_cache_optimized(cache_dir, template_id)
+        if not cache_data:
+            return False
+        self.resident_latents.preload(cache_data['template_key'], cache_data['input_latent_list_cycle'],
+                                      list(self.gpu_models), self.weight_dtype)
+        if silence_skip_enabled():
+            self.get_silent_frames(template_id, cache_dir, cache_data)
+        print(f"📌 模板 {template_id} 的latent已常驻 {len(self.gpu_models)} 个GPU")
+        return True
+    
+    def reset_batch_limits(self):
+        """按profile中实测未OOM的最大batch初始化各设备的安全batch上限"""
+        from core.oom_recovery import AdaptiveBatchLimit
+        self.batch_limits = {
+            device: AdaptiveBatchLimit(ceiling=self.batch_autotuner.max_ok_batch_size(device) if self.batch_autotuner else None)
+            for device in self.gpu_models
+        }
+    
+    def warmup_inference(self, batch_sizes=None):
+        """完整推理预热 - 每个GPU按每个batch大小跑 PE->UNet->VAE，再做一次合成和视频编码
+        
+        MUSE_SKIP_WARMUP=1 时跳过；报告保存在 self.warmup_report
+        """
+        from core.warmup import run_warmup, warmup_disabled, synthetic_cache_data, write_silent_wav
+        
+        if warmup_disabled():
+            print("⏭️ 跳过完整推理预热（MUSE_SKIP_WARMUP=1）")
+            self.warmup_report = {'skipped': True}
+            return self.warmup_report
+        
+        if not self.is_initialized:
+            print("模型未初始化，跳过预热")
+            return None
+        
+        cache_data = synthetic_cache_data()
+        warmup_dir = os.path.join(os.environ.get('MUSE_TEMP_DIR', '/tmp'), 'musetalk_warmup')
+        os.makedirs(warmup_dir, exist_ok=True)
+        audio_path = os.path.join(warmup_dir, 'warmup_silence.wav')
+        write_silent_wav(audio_path)
+        
+        def encode(frames):
+            output_path = os.path.join(warmup_dir, 'warmup.mp4')
+            self.generate_video_ultra_fast(frames, audio_path, output_path, 25)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        
+        try:
+            self.warmup_report = run_warmup(
+                self.gpu_models,
+                timesteps=self.timesteps,
+                batch_sizes=batch_sizes,
+                compose_fn=lambda frames: self.ultra_fast_compose_frames(frames, cache_data),
+                encode_fn=encode,
+                run_on_device=self.inference_pool.run if self.inference_pool is not None else None,
+            )
+        finally:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+        return self.warmup_report
+    
+    def ultra_fast_inference_parallel(self, template_id, audio_path, output_path, cache_dir=None, batch_size=None, fps=25, auto_adjust=True, streaming=False, skip_frames=1, stats=None):
         """极速并行推理 - 毫秒级响应
         
         Args:
             auto_adjust: 是否自动调整batch_size（OOM时自动降级）
             streaming: 是否启用流式推理（WebRTC实时通讯）
+            skip_frames: 关键帧最大间隔k（1=每帧推理），非关键帧插值
+            stats: 传入dict时写入本次请求的统计（静音跳帧比例、节省的推理时间）
         """
         # 使用统一的缓存目录
         if cache_dir is None:
             cache_dir = os.path.join(self.template_cache_dir, template_id)
         
-        # 智能批次大小选择 - 基于可用显存和实际测试
-        if batch_size is None:
-            # 获取所有GPU的可用显存
-            try:
-                min_free_memory = float('inf')
-                for gpu_id in range(self.gpu_count):
-                    torch.cuda.set_device(gpu_id)
-                    free_memory = torch.cuda.mem_get_info()[0] / (1024**3)  # 转换为GB
-                    min_free_memory = min(min_free_memory, free_memory)
-                    print(f"GPU {gpu_id} 可用显存: {free_memory:.1f}GB")
-                
-                print(f"最小可用显存: {min_free_memory:.1f}GB")
-                
-                # 根据可用显存动态调整batch_size
-                # 采用批处理+释放策略：每批6帧，处理完释放
-                # 这样可以充分利用显存，又避免OOM
-                
-                if min_free_memory > 40:  # 40GB以上
-                    batch_size = 6  # 每批6帧，处理完释放
-                    print(f"✅ 显存充足({min_free_memory:.1f}GB)，设置batch_size=6（批处理+释放）")
-                elif min_free_memory > 30:  # 30-40GB
-                    batch_size = 6  
-                    print(f"✅ 显存良好({min_free_memory:.1f}GB)，设置batch_size=6（批处理+释放）")
-                elif min_free_memory > 20:  # 20-30GB
-                    batch_size = 4  
-                    print(f"⚠️ 显存中等({min_free_memory:.1f}GB)，设置batch_size=4（批处理+释放）")
-                elif min_free_memory > 15:  # 15-20GB
-                    batch_size = 3  
-                    print(f"⚠️ 显存偏少({min_free_memory:.1f}GB)，设置batch_size=3（批处理+释放）")
-                elif min_free_memory > 10:  # 10-15GB
-                    batch_size = 2  
-                    print(f"❌ 显存紧张({min_free_memory:.1f}GB)，设置batch_size=2（批处理+释放）")
-                else:  # 10GB以下
-                    batch_size = 1  
-                    print(f"❌ 显存不足({min_free_memory:.1f}GB)，设置batch_size=1")
-                    
-                print(f"基于可用显存({min_free_memory:.1f}GB)，设置batch_size={batch_size}")
-                
-                # 双卡优化提示
-                if self.gpu_count > 1:
-                    total_frames = 361  # 示例帧数
-                    batches_needed = (total_frames + batch_size - 1) // batch_size
-                    batches_per_gpu = batches_needed // self.gpu_count
-                    print(f"📊 双GPU并行处理方案：")
-                    print(f"   - 总帧数: {total_frames}")
-                    print(f"   - 每批次: {batch_size}帧")
-                    print(f"   - 总批次: {batches_needed}")
-                    print(f"   - 每GPU处理: ~{batches_per_gpu}批次")
-                    print(f"   - 预计推理次数: {batches_needed}次")
-                    
-            except Exception as e:
-                print(f"显存检测失败: {e}")
-                # 如果检测失败，使用最保守值
-                batch_size = 1
-                print(f"使用最保守batch_size=1")
-        
-        print(f"🔍 推理配置: GPU数={self.gpu_count}, batch_size={batch_size}")
-        
         if not self.is_initialized:
             print("模型未初始化")
             return False
@@ -651,23 +707,61 @@ class UltraFastMuseTalkService:
             prep_time = time.time() - total_start
             print(f"并行预处理完成: {prep_time:.3f}s")
             
+            # batch大小选择 - 基于启动时实测的profile和本次帧数（不在请求路径上查询显存）
+            if batch_size is None:
+                batch_size = self.select_batch_size(len(whisper_chunks))
+            print(f"🔍 推理配置: GPU数={self.gpu_count}, batch_size={batch_size}")
+            
             # 2. 多GPU并行推理（支持跳帧加速）
             inference_start = time.time()
             
-            # 跳帧策略优化
-            if skip_frames > 1:
-                # 暂时禁用跳帧，确保每帧都处理
-                skip_frames = 1
-                print(f"⚡ 全帧模式：每帧都处理（不跳帧）")
+            # 静音段跳过推理，使用模板预先渲染的闭嘴帧
+            silence_plan, silent_frames = None, None
+            if silence_skip_enabled():
+                silence_plan, silent_frames = self.plan_silence_skip(audio_path, len(whisper_chunks), fps, template_id, cache_dir, cache_data)
+            output_indices = np.flatnonzero(silence_plan['infer_mask']) if silence_plan is not None else np.arange(len(whisper_chunks))
+            
+            # 关键帧模式: skip_frames为关键帧最大间隔，音素切换处自动加密
+            keyframe_indices = select_keyframes(whisper_chunks, skip_frames, output_indices) if skip_frames > 1 else output_indices
+            
+            # latent插值模式: 关键帧只跑 PE -> UNet，插值后所有帧整批VAE解码
+            interpolating = len(keyframe_indices) < len(output_indices)
+            latents_only = interpolating and self.get_frame_interpolator().method == 'latent'
             
             # 音频处理
-            res_frame_list = self.execute_4gpu_parallel_inference(
-                whisper_chunks, cache_data, batch_size
-            )
+            if len(keyframe_indices) == 0:
+                res_frame_list = []
+            else:
+                res_frame_list = self.execute_4gpu_parallel_inference(
+                    whisper_chunks, cache_data, batch_size, auto_adjust=auto_adjust, frame_indices=keyframe_indices,
+                    latents_only=latents_only
+                )
+            
+            # 非关键帧在人脸裁剪图（或预测latent）上插值（合成之前）
+            if interpolating:
+                res_frame_list = self.get_frame_interpolator().interpolate_at(res_frame_list, keyframe_indices, output_indices)
+                keyframe_stats = {
+                    'method': self.get_frame_interpolator().method,
+                    'interval': skip_frames,
+                    'keyframes': len(keyframe_indices),
+                    'frames': len(output_indices),
+                    'inference_reduction': round(1 - len(keyframe_indices) / len(output_indices), 4),
+                }
+                print(f"🔑 关键帧模式: 推理 {len(keyframe_indices)}/{len(output_indices)} 帧，其余插值")
+                if stats is not None:
+                    stats['keyframes'] = keyframe_stats
             
             inference_time = time.time() - inference_start
             print(f"{self.gpu_count}GPU并行推理完成: {inference_time:.3f}s, {len(res_frame_list)}帧")
             
+            if silence_plan is not None:
+                res_frame_list = merge_with_silent_frames(res_frame_list, silence_plan, silent_frames)
+                request_stats = silence_stats(silence_plan, inference_time)
+                print(f"🔇 静音跳过 {request_stats['skipped_frames']}/{request_stats['frames']}帧 "
+                      f"({request_stats['skipped_ratio']:.0%}), 约节省 {request_stats['saved_ms']:.0f}ms")
+                if stats is not None:
+                    stats['silence'] = request_stats
+            
             # 3. 极速并行图像合成
             compose_start = time.time()
             video_frames = self.ultra_fast_compose_frames(res_frame_list, cache_data)
@@ -694,17 +788,22 @@ class UltraFastMuseTalkService:
             traceback.print_exc()
             return False
     
-    def execute_4gpu_parallel_inference(self, whisper_chunks, cache_data, batch_size):
-        """多GPU并行推理 - 动态适配GPU数量"""
-        from musetalk.utils.utils import datagen
+    def execute_4gpu_parallel_inference(self, whisper_chunks, cache_data, batch_size, auto_adjust=True, frame_indices=None,
+                                        latents_only=False):
+        """多GPU并行推理 - 动态适配GPU数量
         
+        Args:
+            auto_adjust: OOM时对半拆分重试并降低该GPU的安全batch上限；输出帧数保证完整
+            frame_indices: 只推理这些帧（静音跳帧），默认全部帧；结果按该顺序返回
+            latents_only: 不做VAE解码，返回每帧的预测latent (4,32,32)（latent插值模式）
+        """
+        import torch
+        from core.gpu_inference_pool import run_bucketed_inference, run_inference, run_latent_inference
+        from core.oom_recovery import run_inference_with_oom_split
+        from core.transfer_pipeline import pipeline_enabled
+        from core.resident_latents import build_cycle_batches
         print(f"⚙️ 执行{self.gpu_count}GPU并行推理，batch_size={batch_size}")
         
-        # 推理前清理所有GPU内存
-        for device in self.devices:
-            with torch.cuda.device(device):
-                torch.cuda.empty_cache()
-        
         input_latent_list_cycle = cache_data['input_latent_list_cycle']
         video_num = len(whisper_chunks)
         
@@ -723,25 +822,21 @@ class UltraFastMuseTalkService:
             print(f"  这将减少批次数从{video_num // batch_size}到{video_num // suggested_batch_size}")
             print(f"  预计可节省{(video_num // batch_size - video_num // suggested_batch_size) * 5}秒")
         
-        # 生成所有批次
-        gen = datagen(
-            whisper_chunks=whisper_chunks,
-            vae_encode_latents=input_latent_list_cycle,
-            batch_size=batch_size,
-            delay_frame=0,
-            device='cpu'  # 在CPU上生成数据，避免GPU0内存压力
-        )
-        all_batches = list(gen)
+        # 生成所有批次 - latent只记录循环索引，在各GPU上从常驻latent中取
+        all_batches = build_cycle_batches(whisper_chunks, len(input_latent_list_cycle), batch_size,
+                                          frame_indices=frame_indices)
         total_batches = len(all_batches)
+        resident_key = cache_data.get('template_key')
         
         print(f"{self.gpu_count}GPU并行处理 {total_batches} 批次...")
         
         # 关键优化：每个GPU处理独立的批次，无需同步
-        def process_batch_on_gpu(batch_info):
-            batch_idx, (whisper_batch, latent_batch) = batch_info
+        def process_batch_on_gpu(batch_info, target_device=None):
+            batch_idx, (whisper_batch, cycle_indices) = batch_info
             
             # 智能GPU分配 - 确保使用有效的GPU
-            target_device = self.devices[batch_idx % self.gpu_count]
+            if target_device is None:
+                target_device = self.devices[batch_idx % self.gpu_count]
             
             # 安全检查：确保GPU模型存在
             if target_device not in self.gpu_models:
@@ -749,29 +844,15 @@ class UltraFastMuseTalkService:
                 return batch_idx, []
             
             gpu_models = self.gpu_models[target_device]
-            
-            # 实时监控显存使用率
-            with torch.cuda.device(target_device):
-                free_mem_before = torch.cuda.mem_get_info()[0] / (1024**3)
-                total_mem = torch.cuda.mem_get_info()[1] / (1024**3)
-                used_mem_before = total_mem - free_mem_before
-                usage_percent = (used_mem_before / total_mem) * 100
-                
-                print(f"处理批次 {batch_idx} -> GPU {target_device}")
-                print(f"  批次大小: {whisper_batch.shape[0]}帧")
-                print(f"  显存使用: {used_mem_before:.1f}/{total_mem:.1f}GB ({usage_percent:.1f}%)")
-                
-                # 如果显存使用超过90%，跳过批次避免OOM
-                if usage_percent > 90:
-                    print(f"⚠️ GPU {target_device} 显存使用率过高({usage_percent:.1f}%)，跳过批次")
-                    return batch_idx, []
+            print(f"处理批次 {batch_idx} -> GPU {target_device}（{whisper_batch.shape[0]}帧）")
             
             try:
                 
                 # 关键：数据移动到目标GPU
                 with torch.cuda.device(target_device):
                     whisper_batch = whisper_batch.to(target_device, dtype=self.weight_dtype, non_blocking=True)
-                    latent_batch = latent_batch.to(target_device, dtype=self.weight_dtype, non_blocking=True)
+                    resident = self.resident_latents.get(target_device, resident_key, input_latent_list_cycle, self.weight_dtype)
+                    latent_batch = resident.index_select(0, cycle_indices.to(target_device))
                     # 确保timesteps在正确的设备上
                     if self.timesteps is not None:
                         timesteps = self.timesteps.to(target_device)
@@ -790,37 +871,26 @@ class UltraFastMuseTalkService:
                             raise ValueError(f"VAE模型在{target_device}上未初始化")
                         
                         # 现在预处理直接生成8通道latent，不需要再进行通道数检查和转换
-                        audio_features = gpu_models['pe'](whisper_batch)
-                        pred_latents = gpu_models['unet'].model(
-                            latent_batch, timesteps, encoder_hidden_states=audio_features
-                        ).sample
-                        recon_frames = gpu_models['vae'].decode_latents(pred_latents)
-                    
-                    # 立即移回CPU释放GPU内存
-                    # 检查返回类型，如果已经是numpy数组就直接使用
-                    if isinstance(recon_frames, list):
-                        result_frames = recon_frames
-                    elif isinstance(recon_frames, np.ndarray):
-                        result_frames = [recon_frames[i] for i in range(recon_frames.shape[0])]
-                    else:
-                        # 如果是torch tensor，转换为numpy
-                        result_frames = [frame.cpu().numpy() if hasattr(frame, 'cpu') else frame for frame in recon_frames]
-                    
-                    # 清理GPU内存
-                    del whisper_batch, latent_batch, audio_features, pred_latents, recon_frames
-                    if 'timesteps' in locals():
-                        del timesteps
-                    
-                    # 强制同步和清理
-                    torch.cuda.synchronize(target_device)
-                    torch.cuda.empty_cache()
+                        # 在该GPU的专用线程中执行（编译图/CUDA图线程安全），batch补齐到固定档位
+                        # auto_adjust时OOM自动对半拆分重试，并按该GPU的安全上限切分
+                        output_fn = run_latent_inference if latents_only else run_inference
+                        if auto_adjust:
+                            infer_fn = run_inference_with_oom_split
+                            infer_args = (gpu_models, whisper_batch, latent_batch, timesteps,
+                                          self.batch_limits.get(target_device), target_device, output_fn)
+                        else:
+                            infer_fn = run_bucketed_inference
+                            infer_args = (gpu_models, whisper_batch, latent_batch, timesteps, None, output_fn)
+                        if self.inference_pool is not None:
+                            recon_frames = self.inference_pool.run(target_device, infer_fn, *infer_args)
+                        else:
+                            recon_frames = infer_fn(*infer_args)
                     
-                    # 额外的清理步骤
-                    import gc
-                    gc.collect()
-                    torch.cuda.empty_cache()
+                    # 设备端已量化为uint8 BGR并整批拷回，直接使用 (B,H,W,3) 数组（latents_only时为预测latent）
+                    result_frames = recon_frames
                     
-                    print(f"✅ 批次 {batch_idx} 完成，已释放GPU {target_device}显存")
+                    # 不在每个批次后同步/清空缓存（会阻塞设备并串行化其他批次），缓存分配器复用显存
+                    print(f"✅ 批次 {batch_idx} 完成 (GPU {target_device})")
                     
                     return batch_idx, result_frames
                     
@@ -851,7 +921,42 @@ class UltraFastMuseTalkService:
         
         # 真正的4GPU并行执行
         res_frame_list = []
+        
+        if self.inference_pool is not None and pipeline_enabled():
+            # 每个GPU一条传输流水线: 上传/计算/下载重叠；失败的批次由下面的重试逻辑逐个恢复
+            batch_results = self.run_transfer_pipelines(all_batches, input_latent_list_cycle, resident_key, latents_only)
+        else:
+            batch_results = self._run_batches_threaded(all_batches, process_batch_on_gpu)
+        
+        # 帧数不完整的批次（单帧仍OOM或其他错误）在其他GPU上逐个重试，仍失败则抛出而不是静默丢帧
+        failed_batches = [
+            i for i in range(total_batches)
+            if len(batch_results.get(i, [])) != all_batches[i][0].shape[0]
+        ]
+        if failed_batches:
+            print(f"⚠️ {len(failed_batches)} 个批次帧数不完整，在其他GPU上重试: {failed_batches}")
+        for i in failed_batches:
+            frames = []
+            for offset in range(1, self.gpu_count + 1):
+                # 从原分配GPU的下一块开始轮换（单GPU时重试同一块）
+                retry_device = self.devices[(i + offset) % self.gpu_count]
+                _, frames = process_batch_on_gpu((i, all_batches[i]), retry_device)
+                if len(frames) == all_batches[i][0].shape[0]:
+                    break
+            if len(frames) != all_batches[i][0].shape[0]:
+                raise RuntimeError(f"批次 {i} 在所有GPU上重试后仍失败，停止推理以避免输出缺帧")
+            batch_results[i] = frames
+        
+        # 按顺序合并结果
+        for i in range(total_batches):
+            res_frame_list.extend(batch_results[i])
+        
+        return res_frame_list
+    
+    def _run_batches_threaded(self, all_batches, process_batch_on_gpu):
+        """逐批次提交到线程池（不使用传输流水线时）"""
         batch_results = {}
+        total_batches = len(all_batches)
         
         # 使用更大的并发数，让GPU保持忙碌
         # 关键优化：增加并发任务数，让每个GPU始终有任务处理
@@ -872,22 +977,57 @@ class UltraFastMuseTalkService:
                 completed += 1
                 if completed % 10 == 0 or completed == total_batches:
                     print(f"进度: {completed}/{total_batches} 批次完成")
+        return batch_results
+    
+    def run_transfer_pipelines(self, all_batches, cycle_latents, resident_key=None, latents_only=False):
+        """按轮询分配把批次交给各GPU的传输流水线，返回 {批次索引: 帧}（失败的批次不在结果中）
         
-        # 处理完所有批次后，只清理一次内存
-        if total_batches > 20:  # 只有在批次很多时才清理
-            for device in self.devices:
-                with torch.cuda.device(device):
+        Args:
+            all_batches: [(whisper_batch, cycle_indices)]
+            cycle_latents: 模板循环latent，首次使用时按设备上传并常驻
+            resident_key: 常驻缓存键（None时只上传本次使用）
+            latents_only: 只返回预测latent，不做VAE解码
+        """
+        import torch
+        from core.transfer_pipeline import TransferPipeline
+        timesteps = self.timesteps if self.timesteps is not None else torch.tensor([0], dtype=torch.long)
+        
+        def run_device(device, batch_indices):
+            pipeline = self.transfer_pipelines.get(device)
+            if pipeline is None:
+                pipeline = self.transfer_pipelines[device] = TransferPipeline(device, self.gpu_models[device])
+            results = {}
+            try:
+                batches = (all_batches[i] for i in batch_indices)
+                resident = self.resident_latents.get(device, resident_key, cycle_latents, self.weight_dtype)
+                for batch_idx, frames in zip(batch_indices, pipeline.run(batches, timesteps, resident, latents_only)):
+                    results[batch_idx] = frames
+            except Exception as e:
+                print(f"⚠️ {device} 传输流水线在 {len(results)}/{len(batch_indices)} 批次处失败，剩余批次逐个重试: {e}")
+                failed_idx = batch_indices[min(len(results), len(batch_indices) - 1)]
+                if isinstance(e, torch.cuda.OutOfMemoryError) and device in self.batch_limits:
+                    self.batch_limits[device].record_oom(all_batches[failed_idx][0].shape[0])
+                if torch.device(device).type == 'cuda':
                     torch.cuda.empty_cache()
+            return results
         
-        # 按顺序合并结果
-        for i in range(total_batches):
-            if i in batch_results:
-                res_frame_list.extend(batch_results[i])
+        futures = []
+        for device_idx, device in enumerate(self.devices):
+            batch_indices = list(range(device_idx, len(all_batches), self.gpu_count))
+            if batch_indices and device in self.gpu_models:
+                futures.append(self.inference_pool.submit(device, run_device, device, batch_indices))
         
-        return res_frame_list
+        batch_results = {}
+        for future in futures:
+            batch_results.update(future.result())
+        print(f"传输流水线完成 {len(batch_results)}/{len(all_batches)} 批次")
+        return batch_results
     
     def ultra_fast_compose_frames(self, res_frame_list, cache_data):
         """极速并行图像合成 - 32线程"""
+        import cv2
+        from musetalk.utils.blending import get_image_blending
+        
         coord_list_cycle = cache_data['coord_list_cycle']
         frame_list_cycle = cache_data['frame_list_cycle']
         mask_coords_list_cycle = cache_data['mask_coords_list_cycle']
@@ -967,7 +1107,8 @@ class UltraFastMuseTalkService:
                 # if len(res_frame.shape) == 3 and res_frame.shape[2] == 3:
                 #     res_frame = cv2.cvtColor(res_frame.astype(np.uint8), cv2.COLOR_BGR2RGB)
                 
-                res_frame = cv2.resize(res_frame.astype(np.uint8), (x2-x1, y2-y1))
+                # 推理输出已是连续的uint8帧，无需逐帧转换
+                res_frame = cv2.resize(np.ascontiguousarray(res_frame), (x2-x1, y2-y1))
                 
                 # 使用优化的blending
                 mask_coords = mask_coords_list_cycle[i % len(mask_coords_list_cycle)]
@@ -1034,6 +1175,7 @@ class UltraFastMuseTalkService:
     
     def extract_audio_features_ultra_fast(self, audio_path, fps):
         """极速音频特征提取 - 优化版"""
+        import torch
         try:
             import time
             start = time.time()
@@ -1098,6 +1240,7 @@ class UltraFastMuseTalkService:
     
     def load_template_cache_optimized(self, cache_dir, template_id):
         """优化的模板缓存加载"""
+        from core.resident_latents import template_key
         try:
             # 尝试多种可能的文件名（cache_dir已经包含template_id）
             possible_files = [
@@ -1127,8 +1270,11 @@ class UltraFastMuseTalkService:
                     print(f"目录不存在: {cache_dir}")
                 return None
             
-            with open(cache_file, 'rb') as f:
-                cache_data = pickle.load(f)
+            # 多进程部署时各进程共用一份模板数据（core/shared_templates.py）
+            cache_data = load_template_shared(template_id, cache_file)
+            if cache_data is None:
+                return None
+            cache_data['template_key'] = template_key(template_id, cache_file)
             
             return cache_data
             
@@ -1138,6 +1284,7 @@ class UltraFastMuseTalkService:
     
     def generate_video_ultra_fast(self, video_frames, audio_path, output_path, fps):
         """极速视频生成"""
+        import cv2
         try:
             # 直接内存生成，无临时文件
             print(f"直接生成视频: {len(video_frames)} 帧")
@@ -1230,8 +1377,16 @@ class UltraFastMuseTalkService:
             print(f"视频生成失败: {str(e)}")
             return False
 
-# 全局服务实例
-global_service = UltraFastMuseTalkService()
+# 全局服务实例（首次使用时创建）
+_global_service = None
+
+
+def get_global_service() -> UltraFastMuseTalkService:
+    """获取全局服务实例"""
+    global _global_service
+    if _global_service is None:
+        _global_service = UltraFastMuseTalkService()
+    return _global_service
 
 def start_ultra_fast_service(port=28888):
     """启动极速服务"""
@@ -1256,7 +1411,7 @@ def start_ultra_fast_service(port=28888):
     # 初始化模型
     print("开始初始化Ultra Fast模型...")
     try:
-        if not global_service.initialize_models_ultra_fast():
+        if not get_global_service().initialize_models_ultra_fast():
             print("模型初始化失败 - 返回False")
             return
         print("模型初始化成功！")
@@ -1348,32 +1503,40 @@ def handle_client_ultra_fast(client_socket):
                         template_image_path = f"/opt/musetalk/repo/LmyDigitalHuman/wwwroot/templates/{filename}"
                         print(f"修正图片路径: {template_image_path}")
                     
-                    # 调用真正的预处理功能
+                    # 提交到预处理工作池（各设备常驻已初始化的预处理器，多个模板并行处理）
                     try:
-                        # 导入预处理模块
-                        # 导入预处理器
                         sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-                        from core.preprocessing import OptimizedPreprocessor
+                        from core.preprocess_pool import get_preprocess_pool, PRIORITY_NORMAL
                         
                         # 获取缓存目录
                         cache_dir = os.environ.get('MUSE_TEMPLATE_CACHE_DIR', '/opt/musetalk/template_cache')
                         
-                        # 创建预处理器并执行
-                        preprocessor = OptimizedPreprocessor()
-                        preprocessor.initialize_models()
-                        success = preprocessor.preprocess_template_ultra_fast(
-                            template_path=template_image_path,
-                            output_dir=cache_dir,
-                            template_id=template_id
+                        job = get_preprocess_pool().submit(
+                            template_id, template_image_path, cache_dir,
+                            bbox_shift=int(bbox_shift),
+                            priority=int(request.get('priority', PRIORITY_NORMAL))
                         )
                         
-                        response = {
-                            'success': success,
-                            'templateId': template_id,
-                            'message': 'Preprocessing completed' if success else 'Preprocessing failed',
-                            'processTime': 1.0  # 实际处理时间
-                        }
-                        print(f"预处理{'成功' if success else '失败'}: {template_id}")
+                        if request.get('async', False):
+                            # 立即返回任务ID，用 preprocess_status 命令查询进度
+                            response = {
+                                'success': True,
+                                'templateId': template_id,
+                                'jobId': job.job_id,
+                                'status': job.status,
+                                'message': 'Preprocessing queued',
+                                'processTime': 0
+                            }
+                        else:
+                            success = job.wait()
+                            response = {
+                                'success': success,
+                                'templateId': template_id,
+                                'jobId': job.job_id,
+                                'message': 'Preprocessing completed' if success else f'Preprocessing failed: {job.error}',
+                                'processTime': job.snapshot()['run_seconds']
+                            }
+                            print(f"预处理{'成功' if success else '失败'}: {template_id}")
                         
                     except Exception as e:
                         print(f"预处理异常: {e}")
@@ -1391,6 +1554,20 @@ def handle_client_ultra_fast(client_socket):
                     client_socket.send(response_json.encode('utf-8'))
                     print(f"✅ 发送预处理响应: {template_id}, 结果: {response['success']}")
                     
+                elif command == 'preprocess_status':
+                    # 预处理任务状态/进度（不带jobId时返回所有任务）
+                    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                    from core.preprocess_pool import get_preprocess_pool
+                    pool = get_preprocess_pool()
+                    job_id = request.get('jobId') or request.get('job_id')
+                    if job_id:
+                        job = pool.get_job(job_id)
+                        response = ({'success': True, 'job': job.snapshot()} if job is not None
+                                    else {'success': False, 'message': f'Unknown job: {job_id}'})
+                    else:
+                        response = {'success': True, 'jobs': pool.list_jobs(), 'stats': pool.stats()}
+                    client_socket.send((json.dumps(response) + '\n').encode('utf-8'))
+                    
                 elif command == 'ping':
                     response = {'success': True, 'message': 'pong'}
                     client_socket.send((json.dumps(response) + '\n').encode('utf-8'))
@@ -1410,7 +1587,7 @@ def handle_client_ultra_fast(client_socket):
                     
                     # 极速推理
                     start_time = time.time()
-                    success = global_service.ultra_fast_inference_parallel(
+                    success = get_global_service().ultra_fast_inference_parallel(
                         template_id=request['template_id'],
                         audio_path=request['audio_path'],
                         output_path=request['output_path'],
@@ -8,7 +8,6 @@
 import os
 import sys
 import json
-import pickle
 import torch
 import cv2
 import numpy as np
@@ -29,6 +28,9 @@ import imageio
 
 # 添加MuseTalk模块路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'MuseTalk'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.shared_templates import load_template_shared
 
 from musetalk.utils.face_parsing import FaceParsing
 from musetalk.utils.utils import datagen, load_all_model
@@ -221,8 +223,9 @@ class GlobalMuseTalkService:
                 raise FileNotFoundError(f"元数据文件不存在: {metadata_file}")
             
             # 加载缓存数据
-            with open(cache_file, 'rb') as f:
-                cache_data = pickle.load(f)
+            cache_data = load_template_shared(template_id, cache_file)
+            if cache_data is None:
+                raise ValueError(f"缓存文件无法读取: {cache_file}")
             
             with open(metadata_file, 'r', encoding='utf-8') as f:
                 metadata = json.load(f)
@@ -19,8 +19,11 @@ import queue
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from offline.batch_inference import UltraFastMuseTalkService
-from streaming.frame_interpolation import FrameInterpolator
+# 注意：推理服务（torch/MuseTalk）在创建API服务实例时才导入，保证模块导入和/health轻量
+from core.startup import get_startup_tracker, STAGE_LOADING_MODELS, STAGE_WARMING, STAGE_READY
+
+# 进程启动即开始计时（starting阶段）
+get_startup_tracker()
 
 
 class StreamingMuseTalkAPI:
@@ -41,20 +44,16 @@ class StreamingMuseTalkAPI:
         if hasattr(self, '_initialized'):
             return
             
-        # 核心服务
+        from offline.batch_inference import UltraFastMuseTalkService
+        from streaming.frame_interpolation import FrameInterpolator
+        
+        # 核心服务（模型在initialize()中分阶段加载，构造时不阻塞）
         self.musetalk_service = UltraFastMuseTalkService()
         self.interpolator = FrameInterpolator(method='optical_flow')
         
-        # 立即初始化模型，避免首次调用时的延迟
-        print("🚀 自动初始化MuseTalk模型...")
-        try:
-            success = self.musetalk_service.initialize_models_ultra_fast()
-            if success:
-                print("✅ 模型自动初始化成功")
-            else:
-                print("⚠️ 模型自动初始化失败，将在首次调用时重试")
-        except Exception as e:
-            print(f"⚠️ 模型自动初始化异常: {e}")
+        # 启动阶段跟踪 + 初始化锁（后台启动线程和/api/initialize可能同时调用）
+        self.startup = get_startup_tracker()
+        self._init_lock = threading.Lock()
         
         # 模板缓存
         self.template_cache = {}
@@ -62,7 +61,7 @@ class StreamingMuseTalkAPI:
         
         # 配置参数
         self.segment_duration = float(os.environ.get('SEGMENT_DURATION', '1.0'))
-        self.skip_frames = int(os.environ.get('SKIP_FRAMES', '2'))
+        self.skip_frames = int(os.environ.get('SKIP_FRAMES', '1'))
         self.batch_size_config = {
             'ultra_fast': 1,   # 0.5秒以内 - 单帧处理最稳定
             'fast': 1,         # 1秒以内 - 也用单帧
@@ -80,33 +79,42 @@ class StreamingMuseTalkAPI:
         print("✅ StreamingMuseTalkAPI 初始化完成")
     
     def initialize(self) -> bool:
-        """初始化服务（由C#调用）"""
-        try:
-            print("🚀 初始化MuseTalk推理服务...")
-            
-            # 检查是否已经初始化
-            if self.musetalk_service.is_initialized:
+        """初始化服务（启动时后台调用，也可由C#调用）
+        
+        分阶段执行: loading_models -> warming -> ready，各阶段耗时记录在startup中
+        """
+        with self._init_lock:
+            # 检查是否已经就绪（后台启动线程可能已完成）
+            if self.startup.is_ready:
                 print("✅ 模型已经初始化，跳过重复初始化")
                 return True
             
-            # 初始化模型 - 使用正确的方法名
-            success = self.musetalk_service.initialize_models_ultra_fast()
-            if not success:
-                print("❌ 模型初始化失败")
+            try:
+                print("🚀 初始化MuseTalk推理服务...")
+                
+                # 阶段1: 加载模型（权重读取一次，并行复制到各GPU）
+                self.startup.enter(STAGE_LOADING_MODELS)
+                success = self.musetalk_service.initialize_models_ultra_fast()
+                if not success:
+                    print("❌ 模型初始化失败")
+                    self.startup.fail('模型初始化失败')
+                    return False
+                
+                # 阶段2: 预热模型
+                self.startup.enter(STAGE_WARMING)
+                self._warmup_models()
+                
+                self.startup.enter(STAGE_READY)
+                print("✅ MuseTalk推理服务就绪")
+                return True
+                
+            except Exception as e:
+                print(f"❌ 初始化失败: {e}")
+                self.startup.fail(str(e))
                 return False
-            
-            # 预热模型
-            self._warmup_models()
-            
-            print("✅ MuseTalk推理服务就绪")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 初始化失败: {e}")
-            return False
     
     def _warmup_models(self):
-        """预热模型，减少首次推理延迟"""
+        """预热模型，减少首次推理延迟（音频特征 + 每个GPU/batch大小的完整推理图）"""
         try:
             print("🔥 预热模型...")
             
@@ -122,12 +130,16 @@ class StreamingMuseTalkAPI:
             
             # 清理
             os.remove(dummy_path)
+            
+            # PE -> UNet -> VAE -> 合成 -> 编码
+            self.musetalk_service.warmup_inference()
             print("✅ 模型预热完成")
             
         except Exception as e:
             print(f"⚠️ 模型预热失败: {e}")
     
-    def preprocess_template(self, template_id: str, image_path: str, force: bool = False) -> Dict:
+    def preprocess_template(self, template_id: str, image_path: str, force: bool = False, bbox_shift: int = 0,
+                            priority: int = 10, wait: bool = True) -> Dict:
         """
         预处理模板（由C#调用）
         返回关键推理信息用于持久化
@@ -135,17 +147,22 @@ class StreamingMuseTalkAPI:
         Args:
             template_id: 模板ID
             image_path: 图片路径
-            force: 是否强制重新处理（清除缓存）
+            force: 是否强制重新处理（按阶段哈希复用未变化的阶段，不清除缓存）
+            bbox_shift: 人脸框上边界偏移
+            priority: 预处理队列优先级（越小越先执行）
+            wait: 是否等待预处理完成（False时立即返回job_id，用 /api/preprocess_jobs/{job_id} 查询进度）
         """
         try:
-            print(f"📋 预处理模板: {template_id} (force={force})")
+            print(f"📋 预处理模板: {template_id} (force={force}, bbox_shift={bbox_shift})")
             
             # 检查缓存
             cache_path = os.path.join(self.template_cache_dir, template_id)
             pkl_file = os.path.join(cache_path, f"{template_id}_preprocessed.pkl")
             
-            # 如果不是强制重处理，且缓存存在，返回缓存
-            if not force and os.path.exists(pkl_file):
+            # 如果不是强制重处理，且缓存存在、参数一致，返回缓存
+            from core.template_stages import load_manifest_params
+            cached_params = load_manifest_params(cache_path, template_id) or {}
+            if not force and os.path.exists(pkl_file) and cached_params.get('bbox_shift', 0) == bbox_shift:
                 print(f"✅ 使用缓存模板: {template_id}")
                 return {
                     'success': True,
@@ -154,47 +171,35 @@ class StreamingMuseTalkAPI:
                     'message': '模板已预处理（使用缓存）'
                 }
             
-            # 如果是强制重处理，清理旧缓存
-            if force and os.path.exists(cache_path):
-                print(f"🗑️ 清理旧缓存: {template_id}")
-                import shutil
-                shutil.rmtree(cache_path, ignore_errors=True)
-            
-            # 创建缓存目录
-            os.makedirs(cache_path, exist_ok=True)
-            
-            # 调用预处理
-            from core.preprocessing import OptimizedPreprocessor
-            preprocessor = OptimizedPreprocessor()
-            success = preprocessor.preprocess_template_ultra_fast(
-                template_path=image_path,
-                output_dir=self.template_cache_dir,
-                template_id=template_id
-            )
-            
-            if success:
-                # 加载到内存缓存
-                self.template_cache[template_id] = {
-                    'path': cache_path,
-                    'loaded_at': time.time()
+            # 提交到预处理工作池（各设备常驻预处理器，只重算输入或参数变化的阶段）
+            from core.preprocess_pool import get_preprocess_pool
+            job = get_preprocess_pool().submit(template_id, image_path, self.template_cache_dir,
+                                               bbox_shift=bbox_shift, priority=priority,
+                                               on_success=self._on_template_preprocessed)
+            if not wait:
+                return {
+                    'success': True,
+                    'template_id': template_id,
+                    'job': job.snapshot(),
+                    'message': '预处理任务已提交'
                 }
-                
+            
+            if job.wait():
                 return {
                     'success': True,
                     'template_id': template_id,
                     'cache_path': cache_path,
+                    'job': job.snapshot(),
                     'message': '模板预处理成功'
                 }
             else:
-                # 预处理失败，清理缓存目录
-                print(f"❌ 预处理失败，清理缓存: {template_id}")
-                import shutil
-                if os.path.exists(cache_path):
-                    shutil.rmtree(cache_path, ignore_errors=True)
+                # 预处理失败: 保留已完成的阶段（重试时复用），上一次成功的缓存不受影响
+                print(f"❌ 预处理失败: {template_id}")
                 
                 return {
                     'success': False,
-                    'message': '模板预处理失败'
+                    'job': job.snapshot(),
+                    'message': job.error or '模板预处理失败'
                 }
                 
         except Exception as e:
@@ -204,6 +209,26 @@ class StreamingMuseTalkAPI:
                 'message': str(e)
             }
     
+    def _on_template_preprocessed(self, job):
+        """预处理完成（在预处理工作线程中调用）"""
+        cache_path = os.path.join(job.output_dir, job.template_id)
+        
+        # 预先渲染闭嘴帧（静音段跳过推理时使用），模型未就绪时在首次使用时渲染
+        if self.musetalk_service.is_initialized:
+            self.musetalk_service.get_silent_frames(job.template_id, cache_path)
+        
+        # 加载到内存缓存
+        self.template_cache[job.template_id] = {
+            'path': cache_path,
+            'loaded_at': time.time()
+        }
+    
+    def get_preprocess_job(self, job_id: str) -> Optional[Dict]:
+        """预处理任务状态/进度"""
+        from core.preprocess_pool import get_preprocess_pool
+        job = get_preprocess_pool().get_job(job_id)
+        return job.snapshot() if job is not None else None
+    
     def start_session(self, session_id: str, template_id: str) -> Dict:
         """
         开始对话会话（由C#调用）
@@ -219,6 +244,9 @@ class StreamingMuseTalkAPI:
                     'message': f'模板不存在: {template_id}'
                 }
             
+            # 模板latent预先常驻到各GPU，会话内的请求只上传whisper特征
+            self.musetalk_service.preload_template(template_id, cache_path)
+            
             # 创建会话
             self.active_sessions[session_id] = {
                 'template_id': template_id,
@@ -245,7 +273,8 @@ class StreamingMuseTalkAPI:
         session_id: str,
         audio_path: str,
         segment_index: int = 0,
-        is_final: bool = False
+        is_final: bool = False,
+        keyframe_interval: Optional[int] = None
     ) -> Dict:
         """
         处理音频段（由C#调用）
@@ -256,6 +285,7 @@ class StreamingMuseTalkAPI:
             audio_path: 音频文件路径
             segment_index: 段索引
             is_final: 是否是最后一段
+            keyframe_interval: 关键帧最大间隔k（1=每帧推理），默认 SKIP_FRAMES
             
         Returns:
             处理结果，包含视频路径和延迟信息
@@ -281,26 +311,21 @@ class StreamingMuseTalkAPI:
             # 根据音频长度选择处理策略
             num_frames = int(duration * 25)  # 25fps
             
-            # 优化策略：先确保能生成视频，每帧都处理
-            # 基于实测：每帧需要约3GB显存，batch_size需要保守设置
+            # 根据音频长度标记模式；关键帧间隔按请求指定，默认 SKIP_FRAMES
             if num_frames <= 25:  # 1秒以内
-                batch_size = 1  # 单帧处理最安全
-                skip_frames = 1  # 不跳帧，每帧都处理
                 mode = 'realtime'
             elif num_frames <= 50:  # 2秒以内
-                batch_size = 1  # 单帧处理
-                skip_frames = 1  # 不跳帧，每帧都处理
                 mode = 'fast'
             elif num_frames <= 100:  # 4秒以内
-                batch_size = 1  # 单帧处理
-                skip_frames = 1  # 不跳帧，每帧都处理
                 mode = 'balanced'
             else:  # 4秒以上
-                batch_size = 1  # 单帧处理
-                skip_frames = 1  # 不跳帧，每帧都处理
                 mode = 'quality'
+            skip_frames = max(1, keyframe_interval if keyframe_interval is not None else self.skip_frames)
+            
+            # batch大小按启动时实测的profile和延迟目标选择
+            batch_size = self.musetalk_service.select_batch_size(num_frames)
             
-            print(f"⚡ 处理音频段 {segment_index}: {duration:.2f}秒, {num_frames}帧, 模式={mode}")
+            print(f"⚡ 处理音频段 {segment_index}: {duration:.2f}秒, {num_frames}帧, 模式={mode}, batch_size={batch_size}, 关键帧间隔={skip_frames}")
             
             # 生成输出路径 - 使用正确的挂载路径
             output_dir = "/videos"  # 这是容器内的挂载路径
@@ -309,6 +334,7 @@ class StreamingMuseTalkAPI:
             output_path = os.path.join(output_dir, output_filename)
             
             # 调用推理
+            inference_stats = {}
             success = self.musetalk_service.ultra_fast_inference_parallel(
                 template_id=template_id,
                 audio_path=audio_path,
@@ -317,7 +343,8 @@ class StreamingMuseTalkAPI:
                 batch_size=batch_size,
                 skip_frames=skip_frames,
                 streaming=True,
-                auto_adjust=True
+                auto_adjust=True,
+                stats=inference_stats
             )
             
             process_time = time.time() - start_time
@@ -339,6 +366,8 @@ class StreamingMuseTalkAPI:
                     'process_time': process_time,
                     'latency_ms': process_time * 1000,
                     'mode': mode,
+                    'silence': inference_stats.get('silence'),
+                    'keyframes': inference_stats.get('keyframes'),
                     'is_final': is_final
                 }
                 
@@ -436,10 +465,26 @@ class StreamingMuseTalkAPI:
         """
         获取服务状态（由C#调用）
         """
+        from core.shape_buckets import get_bucket_stats
+        from core.preprocess_pool import get_preprocess_pool
+        from core.shared_templates import get_shared_template_store
+        shared_store = get_shared_template_store()
+        
         return {
-            'status': 'ready',
+            'status': self.startup.stage,
+            'startup': self.startup.snapshot(),
+            'init_stage_times': self.musetalk_service.init_stage_times,
+            'model_registry': self.musetalk_service.model_registry.stats,
+            'warmup': self.musetalk_service.warmup_report,
+            'compile': self.musetalk_service.compile_manager.get_status() if self.musetalk_service.compile_manager else None,
+            'shape_buckets': get_bucket_stats().snapshot(),
+            'batch_profiles': self.musetalk_service.batch_autotuner.get_status() if self.musetalk_service.batch_autotuner else None,
+            'oom_limits': {str(d): limit.snapshot() for d, limit in self.musetalk_service.batch_limits.items()},
+            'resident_latents': self.musetalk_service.resident_latents.snapshot(),
             'active_sessions': len(self.active_sessions),
             'templates_cached': len(self.template_cache),
+            'preprocess_pool': get_preprocess_pool().stats(),
+            'shared_templates': shared_store.snapshot() if shared_store else None,
             'gpu_count': self.musetalk_service.gpu_count if hasattr(self.musetalk_service, 'gpu_count') else 0,
             'config': {
                 'segment_duration': self.segment_duration,
@@ -463,8 +508,8 @@ def get_api_service() -> StreamingMuseTalkAPI:
 
 # HTTP API接口（供C#调用）
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import uvicorn
 
 app = FastAPI(title="MuseTalk Streaming API")
 
@@ -473,6 +518,9 @@ class PreprocessRequest(BaseModel):
     template_id: str
     image_path: str
     force: bool = False  # 是否强制重新处理
+    bbox_shift: int = 0  # 人脸框上边界偏移
+    priority: int = 10  # 预处理队列优先级（越小越先执行）
+    wait: bool = True  # 是否等待完成（False时返回job，用 /api/preprocess_jobs/{job_id} 查询）
 
 
 class SessionRequest(BaseModel):
@@ -485,37 +533,73 @@ class ProcessRequest(BaseModel):
     audio_path: str
     segment_index: int = 0
     is_final: bool = False
+    keyframe_interval: Optional[int] = None  # 关键帧最大间隔，不传时使用 SKIP_FRAMES
 
 
 @app.on_event("startup")
 async def startup_event():
-    """启动时初始化服务"""
+    """启动时在后台线程初始化服务，HTTP端口立即可用"""
     service = get_api_service()
-    service.initialize()
+    threading.Thread(target=service.initialize, name='musetalk-startup', daemon=True).start()
 
 
 @app.post("/api/initialize")
 async def initialize():
-    """初始化服务"""
+    """初始化服务（若后台初始化进行中，等待其完成）"""
     service = get_api_service()
-    success = service.initialize()
+    loop = asyncio.get_event_loop()
+    success = await loop.run_in_executor(None, service.initialize)
     if success:
         return {"success": True, "message": "服务初始化成功"}
     else:
         raise HTTPException(status_code=500, detail="服务初始化失败")
 
 
+@app.post("/api/autotune")
+async def autotune():
+    """重新测量各GPU的batch大小profile"""
+    service = get_api_service()
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, service.musetalk_service.autotune_batch_sizes)
+    if result is not None:
+        return {"success": True, "profiles": result}
+    else:
+        raise HTTPException(status_code=503, detail="模型未初始化")
+
+
 @app.post("/api/preprocess_template")
 async def preprocess_template(request: PreprocessRequest):
     """预处理模板"""
     service = get_api_service()
-    result = service.preprocess_template(request.template_id, request.image_path, request.force)
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(
+        None, service.preprocess_template, request.template_id, request.image_path,
+        request.force, request.bbox_shift, request.priority, request.wait
+    )
     if result['success']:
         return result
     else:
         raise HTTPException(status_code=400, detail=result['message'])
 
 
+@app.get("/api/preprocess_jobs")
+async def list_preprocess_jobs(status: Optional[str] = None):
+    """预处理任务列表（可按状态过滤: queued/running/completed/failed）"""
+    from core.preprocess_pool import get_preprocess_pool
+    pool = get_preprocess_pool()
+    return {"jobs": pool.list_jobs(status), "stats": pool.stats()}
+
+
+@app.get("/api/preprocess_jobs/{job_id}")
+async def get_preprocess_job(job_id: str):
+    """预处理任务状态/进度"""
+    service = get_api_service()
+    job = service.get_preprocess_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"预处理任务不存在: {job_id}")
+    return job
+
+
 @app.post("/api/start_session")
 async def start_session(request: SessionRequest):
     """开始会话"""
@@ -535,7 +619,8 @@ async def process_segment(request: ProcessRequest):
         request.session_id,
         request.audio_path,
         request.segment_index,
-        request.is_final
+        request.is_final,
+        request.keyframe_interval
     )
     if result['success']:
         return result
@@ -563,12 +648,22 @@ async def get_status():
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
-    return {"status": "healthy", "timestamp": time.time()}
+    """健康检查 - status为启动阶段: starting/loading_models/warming/ready/failed
+    
+    只有ready时返回200，其他阶段返回503（响应内容相同），调用方按状态码判断服务是否可用
+    """
+    tracker = get_startup_tracker()
+    health = tracker.snapshot()
+    health['timestamp'] = time.time()
+    if not tracker.is_ready:
+        return JSONResponse(status_code=503, content=health)
+    return health
 
 
 def start_api_server(host='0.0.0.0', port=28888):
     """启动API服务器"""
+    import uvicorn
+    
     print(f"🌐 启动MuseTalk API服务: http://{host}:{port}")
     uvicorn.run(app, host=host, port=port)
 
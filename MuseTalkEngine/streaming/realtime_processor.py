@@ -55,7 +55,7 @@ class RealtimeSegmentProcessor:
         
         print("🚀 初始化实时处理器...")
         self.service = UltraFastMuseTalkService()
-        self.service.initialize_models()
+        self.service.initialize_models_ultra_fast()
         
         # 预热模型（减少首次推理延迟）
         self._warmup_models()
@@ -76,6 +76,10 @@ class RealtimeSegmentProcessor:
             
             if os.path.exists(dummy_path):
                 os.remove(dummy_path)
+            
+            # 完整推理图预热（PE -> UNet -> VAE -> 合成 -> 编码）
+            if self.service:
+                self.service.warmup_inference()
             print("✅ 模型预热完成")
         except Exception as e:
             print(f"⚠️ 模型预热失败: {e}")
@@ -171,25 +175,24 @@ class RealtimeSegmentProcessor:
         self,
         template_id: str,
         segment_info: Dict,
-        priority: int = 0
+        priority: int = 0,
+        skip_frames: int = 1
     ) -> Dict:
-        """异步处理单个音频片段 - 优化版"""
+        """异步处理单个音频片段 - 优化版（skip_frames为关键帧最大间隔，1=每帧推理）"""
         start_time = time.time()
         
         try:
             # 动态调整推理参数
             num_frames = segment_info['frames']
             
-            # 极速模式：短段用小batch，长段跳帧
+            # 极速模式：短段用小batch（关键帧间隔由调用方指定）
             if num_frames <= 12:  # 0.5秒以内
                 batch_size = num_frames
-                skip_frames = 1
             elif num_frames <= 25:  # 1秒以内
                 batch_size = 12
-                skip_frames = 2
             else:  # 1秒以上
                 batch_size = 8
-                skip_frames = 3
+            skip_frames = max(1, int(skip_frames))
             
             # 生成输出路径
             output_path = f"/tmp/rt_video_{template_id}_{segment_info['index']}_{int(time.time()*1000)}.mp4"
@@ -262,9 +265,10 @@ class RealtimeSegmentProcessor:
         self,
         template_id: str,
         audio_stream: AsyncGenerator,
-        callback=None
+        callback=None,
+        skip_frames: int = 1
     ):
-        """处理实时音频流"""
+        """处理实时音频流（skip_frames为关键帧最大间隔，1=每帧推理）"""
         print("🎙️ 开始处理实时音频流...")
         
         # 音频缓冲区
@@ -292,7 +296,7 @@ class RealtimeSegmentProcessor:
                 
                 # 异步处理（不阻塞）
                 task = asyncio.create_task(
-                    self.process_segment_async(template_id, segment)
+                    self.process_segment_async(template_id, segment, skip_frames=skip_frames)
                 )
                 segment_tasks.append(task)
                 
@@ -315,7 +319,7 @@ class RealtimeSegmentProcessor:
                     audio_data, 16000, len(segment_tasks), 
                     len(segment_tasks) * self.optimal_segment_duration
                 )
-                result = await self.process_segment_async(template_id, segment)
+                result = await self.process_segment_async(template_id, segment, skip_frames=skip_frames)
                 if callback and result['success']:
                     await callback(result)
         
@@ -396,14 +400,15 @@ class StreamingPipeline:
                     await self.processor.process_audio_stream(
                         template_id,
                         audio_generator(),
-                        callback=lambda r: self._send_result(websocket, r)
+                        callback=lambda r: self._send_result(websocket, r),
+                        skip_frames=data.get('keyframe_interval', 1)
                     )
                     
                 elif data['type'] == 'complete_audio':
                     # 处理完整音频
                     audio_path = data['audio_path']
                     await self._process_complete_audio(
-                        websocket, template_id, audio_path
+                        websocket, template_id, audio_path, data.get('keyframe_interval', 1)
                     )
                     
         except Exception as e:
@@ -425,8 +430,8 @@ class StreamingPipeline:
             }
         }))
     
-    async def _process_complete_audio(self, websocket, template_id, audio_path):
-        """处理完整音频文件"""
+    async def _process_complete_audio(self, websocket, template_id, audio_path, skip_frames=1):
+        """处理完整音频文件（skip_frames为关键帧最大间隔，来自消息的keyframe_interval）"""
         # 加载音频
         audio_data, sr = librosa.load(audio_path, sr=16000)
         
@@ -437,7 +442,7 @@ class StreamingPipeline:
         tasks = []
         for segment in segments:
             task = asyncio.create_task(
-                self.processor.process_segment_async(template_id, segment)
+                self.processor.process_segment_async(template_id, segment, skip_frames=skip_frames)
             )
             tasks.append(task)
         
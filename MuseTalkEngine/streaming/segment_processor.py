@@ -34,7 +34,8 @@ class SegmentProcessor:
         
         print("🚀 初始化分段处理器...")
         self.service = UltraFastMuseTalkService()
-        self.service.initialize_models()
+        self.service.initialize_models_ultra_fast()
+        self.service.warmup_inference()
         print("✅ 分段处理器初始化完成")
         
     def split_audio_to_segments(self, audio_path: str) -> List[Dict]:
@@ -94,20 +95,16 @@ class SegmentProcessor:
         try:
             start_time = time.time()
             
-            # 优化的批次大小策略
+            # 优化的批次大小策略（关键帧间隔由调用方指定，默认每帧推理）
             num_frames = segment_info['frames']
             if num_frames <= 12:  # 0.5秒以内 - 极速模式
                 batch_size = min(num_frames, 6)
-                skip_frames = 1
             elif num_frames <= 25:  # 1秒以内 - 快速模式
                 batch_size = min(num_frames, 12)
-                skip_frames = 2
             elif num_frames <= 50:  # 2秒以内 - 标准模式
                 batch_size = 16
-                skip_frames = 2
-            else:  # 2秒以上 - 跳帧模式
+            else:  # 2秒以上
                 batch_size = 20
-                skip_frames = 3
             
             # 生成输出路径
             output_path = f"/tmp/segment_{template_id}_{segment_info['index']}.mp4"
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试入口模块的导入耗时（基于 python -X importtime）
+防止重量级依赖（torch/cv2/transformers/musetalk）重新回到模块导入路径上
+"""
+
+import os
+import re
+import sys
+import time
+import subprocess
+import importlib.util
+
+ENGINE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 模块 -> (导入耗时上限ms, 禁止在导入时加载的模块, 运行前需要存在的依赖)
+IMPORT_BUDGETS = {
+    'core.template_manager': (300, ['torch', 'cv2', 'numpy', 'transformers', 'musetalk'], []),
+    'core.startup': (100, ['torch', 'cv2', 'numpy', 'transformers', 'musetalk'], []),
+    'offline.batch_inference': (500, ['torch', 'cv2', 'transformers', 'musetalk', 'imageio'], ['numpy']),
+    'streaming.api_service': (1000, ['torch', 'cv2', 'transformers', 'musetalk'], ['fastapi', 'numpy']),
+}
+
+# CLI命令 -> 耗时上限ms
+CLI_BUDGETS = [
+    (['core/template_manager.py', 'list', '--output_dir', '/tmp/musetalk_import_time_check'], 1000),
+]
+
+_IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_import(module: str):
+    """在子进程中导入模块，返回 (累计耗时ms, 加载的顶层包集合)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ENGINE_ROOT,
+        env=dict(os.environ, PYTHONPATH=ENGINE_ROOT),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else '导入失败')
+
+    cumulative_ms = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        loaded.add(name.split('.')[0])
+        if name == module:
+            cumulative_ms = int(match.group(2)) / 1000
+    return cumulative_ms, loaded
+
+
+def measure_cli(args):
+    """执行CLI命令，返回耗时ms（命令失败时抛出RuntimeError）"""
+    start = time.time()
+    result = subprocess.run([sys.executable] + args, cwd=ENGINE_ROOT, capture_output=True, text=True)
+    elapsed_ms = (time.time() - start) * 1000
+    if result.returncode != 0:
+        output = (result.stderr or result.stdout).strip().splitlines()
+        raise RuntimeError(output[-1] if output else f'退出码 {result.returncode}')
+    return elapsed_ms
+
+
+def check_import_time():
+    """检查入口模块的导入耗时和导入依赖，返回问题列表"""
+    errors = []
+
+    print("=" * 60)
+    print("测试模块导入耗时")
+    print("=" * 60)
+
+    for module, (budget_ms, forbidden, requires) in IMPORT_BUDGETS.items():
+        missing = [dep for dep in requires if importlib.util.find_spec(dep) is None]
+        if missing:
+            print(f"⏭️ {module:30} - 跳过（缺少依赖: {', '.join(missing)}）")
+            continue
+
+        try:
+            cumulative_ms, loaded = measure_import(module)
+        except RuntimeError as e:
+            errors.append(f"❌ {module:30} - 导入失败: {e}")
+            print(errors[-1])
+            continue
+
+        heavy = sorted(loaded.intersection(forbidden))
+        if heavy:
+            errors.append(f"❌ {module:30} - 导入时加载了重量级依赖: {', '.join(heavy)}")
+            print(errors[-1])
+        elif budget_ms is not None and cumulative_ms > budget_ms:
+            errors.append(f"❌ {module:30} - 导入耗时 {cumulative_ms:.0f}ms 超过上限 {budget_ms}ms")
+            print(errors[-1])
+        else:
+            print(f"✅ {module:30} - {cumulative_ms:.0f}ms")
+
+    for args, budget_ms in CLI_BUDGETS:
+        command = ' '.join(args)
+        try:
+            elapsed_ms = measure_cli(args)
+        except RuntimeError as e:
+            errors.append(f"❌ {command} - 执行失败: {e}")
+            print(errors[-1])
+            continue
+        if elapsed_ms > budget_ms:
+            errors.append(f"❌ {command} - 耗时 {elapsed_ms:.0f}ms 超过上限 {budget_ms}ms")
+            print(errors[-1])
+        else:
+            print(f"✅ {command} - {elapsed_ms:.0f}ms")
+
+    print("=" * 60)
+
+    if errors:
+        print(f"\n❌ 发现 {len(errors)} 个导入耗时问题:")
+        for error in errors:
+            print(f"  {error}")
+    else:
+        print("\n✅ 所有导入耗时测试通过!")
+    return errors
+
+
+def test_import_time():
+    """入口模块的导入耗时和导入依赖不超过上限"""
+    errors = check_import_time()
+    assert not errors, '\n'.join(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check_import_time() else 0)